@@ -0,0 +1,404 @@
+'''
+Замеры скорости скриптов из src/main на локальных заменах боевых сервисов.
+
+Каждый скрипт запускается как по крону (отдельным процессом) против локального Postgres,
+фейкового WB API (utils.fake_wb_api) и фейкового Google Sheets (utils.fake_gspread) на фиксированном
+наборе данных. Внешняя сеть для скриптов закрыта через неработающий прокси. По каждому
+скрипту записываются время, число запросов к API, трафик, строки, записанные в БД,
+и пиковая память процесса. Результаты сохраняются в JSON и сравниваются с baseline.json.
+
+Пример:
+    python benchmarks/run_benchmarks.py --dsn postgresql://postgres@localhost/bench --dataset default
+    python benchmarks/run_benchmarks.py --dsn ... --update-baseline   # записать текущие числа как эталон
+    python benchmarks/run_benchmarks.py --dsn ... --check             # код выхода 1 при регрессии
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import statistics
+import urllib.request
+from datetime import datetime
+
+import psycopg2
+from psycopg2.extensions import parse_dsn
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+sys.path.append(SRC_DIR)
+
+from utils import fake_wb_api, fake_gspread
+
+
+SCHEMA_PATH = os.path.join(BENCH_DIR, 'schema.sql')
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+# наборы данных: число кабинетов (токенов) и размеры каждого кабинета в фейке
+DATASETS = {
+    'small': {'cabinets': 2, 'sizes': {'products': 200, 'orders': 2000, 'feedbacks': 2000}},
+    'default': {'cabinets': 8, 'sizes': {'products': 2000, 'orders': 20000, 'feedbacks': 20000}},
+}
+
+AUTOPILOT_ARTICLES_PER_CABINET = 50
+UNIT_TABLE = 'UNIT 2.0 (tested)'
+UNIT_SHEET = 'MAIN (tested)'
+UNIT_REMAINS_COL = 51
+
+
+def setup_autopilot(conn, services, tokens):
+    '''
+    Таблицы ПУ и UNIT в фейковом Sheets и справочники артикулов в БД для autopilot_hourly
+    '''
+    articles = []
+    for account, token in tokens.items():
+        products = services.wb_fake.cabinet(token)['products'][:AUTOPILOT_ARTICLES_PER_CABINET]
+        articles.extend((p['nmID'], account, p['vendorCode']) for p in products)
+
+    unit_header = ['Артикул', 'ЛК', 'wild', 'Мар'] + [''] * (UNIT_REMAINS_COL - 5) + ['Свободный остаток\n(сервис)']
+    unit_rows = [[nm, account, wild, '25%'] + [''] * (UNIT_REMAINS_COL - 5) + [nm % 300] for nm, account, wild in articles]
+    pilot_rows = [['Панель управления'], [''], ['Артикул']] + [[nm] for nm, _, _ in articles]
+
+    services.sheets.spreadsheets.clear()
+    services.sheets.add_spreadsheet(UNIT_TABLE, {UNIT_SHEET: [unit_header] + unit_rows})
+    services.sheets.add_spreadsheet('Автопилот (бенчмарк)', {'Автопилот': pilot_rows}, rows=len(pilot_rows), cols=260)
+
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE card_data, article")
+        cur.executemany("INSERT INTO card_data (article_id) VALUES (%s)", [(nm,) for nm, _, _ in articles])
+        cur.executemany("INSERT INTO article (nm_id, account) VALUES (%s, %s)", [(nm, account) for nm, account, _ in articles])
+    conn.commit()
+
+    return {'AUTOPILOT_TABLE_NAME': 'Автопилот (бенчмарк)', 'AUTOPILOT_SHEET_NAME': 'Автопилот',
+            'UNIT_TABLE': UNIT_TABLE, 'UNIT_MAIN_SHEET': UNIT_SHEET}
+
+
+# скрипты для замера: путь от src, таблицы, которые очищаются перед каждым прогоном,
+# и подготовка данных (таблицы в фейковом Sheets, справочники в БД) -> доп. переменные окружения
+JOBS = {
+    'wb_stocks': {'script': 'main/wb_stocks.py', 'tables': ['wb_stock']},
+    'feedbacks_to_db': {'script': 'main/feedbacks_to_db.py', 'tables': ['wb_feedbacks']},
+    'autopilot_hourly': {'script': 'main/autopilot_hourly.py', 'tables': ['spp_history', 'spp_latest', 'adv_stats_daily'],
+                         'setup': setup_autopilot},
+}
+
+# метрики-счётчики детерминированы: любой рост относительно baseline - регрессия
+COUNTER_METRICS = ['api_calls', 'sheets_calls', 'db_rows_written']
+# метрики с шумом: регрессия, если хуже baseline больше чем на tolerance
+NOISY_METRICS = ['wall_time_s', 'peak_rss_mb']
+
+PG_STATS_DELAY = 0.6   # сек, чтобы статистика завершившегося процесса дошла до pg_stat_user_tables
+DEAD_PROXY = 'http://127.0.0.1:9'   # всё, что не ушло на локальные фейки, падает сразу
+
+
+class FakeServices:
+    '''
+    Фейковые сервисы в отдельном потоке со своим event loop
+    '''
+
+    def __init__(self, seed, rate_scale, sizes, sheets_write_quota = None):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.wb_runner, self.wb_url = self._call(fake_wb_api.start_fake_server(seed=seed, rate_scale=rate_scale, sizes=sizes))
+        self.wb_fake = self.wb_runner.app['fake']
+        self.sheets = fake_gspread.FakeSheetsBackend(write_quota=sheets_write_quota)
+        self.sheets_runner, self.sheets_url = self._call(fake_gspread.start_fake_server(self.sheets))
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def env(self):
+        return {'WB_API_BASE_URL': self.wb_url, 'GSHEETS_FAKE_URL': self.sheets_url,
+                'HTTP_PROXY': DEAD_PROXY, 'HTTPS_PROXY': DEAD_PROXY, 'NO_PROXY': '127.0.0.1,localhost'}
+
+    def reset(self):
+        _http_json(f'{self.wb_url}/_fake/reset', method='POST')
+        self.sheets.reset_stats()
+
+    def stats(self):
+        return _http_json(f'{self.wb_url}/_fake/stats'), self.sheets.stats()
+
+    def close(self):
+        self._call(self.wb_runner.cleanup())
+        self._call(self.sheets_runner.cleanup())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+
+def _http_json(url, method = 'GET'):
+    request = urllib.request.Request(url, method=method, data=b'' if method == 'POST' else None)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def db_env(dsn):
+    '''
+    DSN -> переменные окружения, которые читает create_connection_w_env
+    '''
+    params = parse_dsn(dsn)
+    return {
+        'USER_2': params.get('user', os.getenv('USER', '')),
+        'NAME_2': params.get('dbname', ''),
+        'PASSWORD_2': params.get('password', ''),
+        'HOST_2': params.get('host', 'localhost'),
+        'PORT_2': params.get('port', '5432'),
+    }
+
+
+def prepare_db(conn, tables):
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        schema = f.read()
+    with conn.cursor() as cur:
+        cur.execute(schema)
+        # таблицы, которые скрипт создаёт сам, на первом прогоне ещё может не быть
+        existing = []
+        for table in tables:
+            cur.execute("SELECT to_regclass(%s)", (table,))
+            if cur.fetchone()[0]:
+                existing.append(table)
+        if existing:
+            cur.execute(f"TRUNCATE {', '.join(existing)}")
+    conn.commit()
+
+
+def db_write_counters(conn):
+    '''
+    {таблица: вставлено + обновлено + удалено строк} по всем пользовательским таблицам
+    '''
+    time.sleep(PG_STATS_DELAY)
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_stat_clear_snapshot()")
+        cur.execute("SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables")
+        rows = dict(cur.fetchall())
+    conn.commit()
+    return rows
+
+
+def run_script(script, env, timeout, log_path):
+    '''
+    Запускает скрипт отдельным процессом. Returns (код выхода, время, пиковая память в МБ)
+    '''
+    with open(log_path, 'w', encoding='utf-8') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, script)], cwd=SRC_DIR, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+        deadline = start + timeout
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if time.perf_counter() > deadline:
+                proc.kill()
+                pid, status, rusage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(0.05)
+        wall_time = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss на Linux в КБ, на macOS в байтах
+    peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return proc.returncode, wall_time, peak_rss_mb
+
+
+def bench_job(name, job, conn, services, base_env, tokens, repeat, timeout, work_dir):
+    runs = []
+    for i in range(repeat):
+        prepare_db(conn, job['tables'])
+        env = dict(base_env)
+        if job.get('setup'):
+            env.update(job['setup'](conn, services, tokens))
+        services.reset()
+        before = db_write_counters(conn)
+
+        log_path = os.path.join(work_dir, f'{name}_{i}.log')
+        exit_code, wall_time, peak_rss_mb = run_script(job['script'], env, timeout, log_path)
+
+        after = db_write_counters(conn)
+        api, sheets = services.stats()
+        rows_by_table = {t: n - before.get(t, 0) for t, n in after.items() if n - before.get(t, 0)}
+        runs.append({
+            'exit_code': exit_code,
+            'wall_time_s': round(wall_time, 3),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'api_calls': api['requests'],
+            'api_throttled': api['throttled'],
+            'api_bytes_sent': api['bytes_received'],
+            'api_bytes_received': api['bytes_sent'],
+            'api_calls_by_path': api['by_path'],
+            'sheets_calls': sheets['requests'],
+            'sheets_peak_per_minute': sheets['peak_per_minute'],
+            'sheets_cells_written': sheets['cells_written'],
+            'sheets_throttled': sheets['throttled'],
+            'sheets_calls_by_method': sheets['by_method'],
+            'db_rows_written': sum(rows_by_table.values()),
+            'db_rows_by_table': rows_by_table,
+        })
+        if exit_code != 0:
+            with open(log_path, encoding='utf-8', errors='replace') as f:
+                tail = f.read()[-2000:]
+            print(f'  {name}: код выхода {exit_code}, лог {log_path}\n{tail}')
+            break
+
+    result = dict(runs[-1])
+    result['wall_times'] = [r['wall_time_s'] for r in runs]
+    result['wall_time_s'] = round(statistics.median(result['wall_times']), 3)
+    result['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(dsn, dataset = 'default', job_names = None, repeat = 1, seed = 0, rate_scale = 0.01, timeout = 1800,
+                   sheets_write_quota = None):
+    config = DATASETS[dataset]
+    job_names = job_names or list(JOBS)
+    work_dir = tempfile.mkdtemp(prefix='wb_bench_')
+
+    # названия кабинетов - как ЛК в UNIT (с заглавной буквы)
+    tokens = {f'Bench{i:02d}': f'bench-token-{i:02d}' for i in range(config['cabinets'])}
+    with open(os.path.join(work_dir, 'tokens.json'), 'w', encoding='utf-8') as f:
+        json.dump(tokens, f)
+
+    services = FakeServices(seed=seed, rate_scale=rate_scale, sizes=config['sizes'], sheets_write_quota=sheets_write_quota)
+    env = {
+        **os.environ,
+        **db_env(dsn),
+        **services.env(),
+        # BASE_DIR / CREDS_DIR с абсолютным CREDS_DIR даёт путь во временную папку
+        'CREDS_DIR': work_dir,
+        'TOKENS_FILE': 'tokens.json',
+        'CREDS_FILE': 'creds.json',
+        'LOGS_PATH': os.path.join(work_dir, 'logs'),
+        'LOGS_DIR': os.path.join(work_dir, 'logs'),
+        'LOG_FILE': 'bench.log',
+    }
+    os.makedirs(env['LOGS_PATH'], exist_ok=True)
+
+    conn = psycopg2.connect(dsn)
+    results = {}
+    try:
+        for name in job_names:
+            print(f'{name}...')
+            results[name] = bench_job(name, JOBS[name], conn, services, env, tokens, repeat, timeout, work_dir)
+            r = results[name]
+            print(f"  {r['wall_time_s']} s, {r['api_calls']} API calls, {r['sheets_calls']} Sheets calls, "
+                  f"{r['db_rows_written']} rows, {r['peak_rss_mb']} MB")
+    finally:
+        conn.close()
+        services.close()
+
+    report = {
+        'dataset': dataset,
+        'dataset_config': config,
+        'seed': seed,
+        'rate_scale': rate_scale,
+        'sheets_write_quota': sheets_write_quota,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'jobs': results,
+    }
+    if all(r['exit_code'] == 0 for r in results.values()):
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return report
+
+
+def compare_with_baseline(report, baseline, tolerance = 0.2):
+    '''
+    Сравнение с эталоном. Returns список регрессий (пустой - всё в порядке).
+    Скрипт без эталона - тоже ошибка: иначе проверка молча ничего не сравнивает
+    '''
+    regressions = []
+    base_jobs = baseline.get(report['dataset'], {})
+    for name, current in report['jobs'].items():
+        base = base_jobs.get(name)
+        if base is None:
+            regressions.append(f"{name}: нет в baseline для набора {report['dataset']} (запустите с --update-baseline)")
+            continue
+        if current['exit_code'] != 0:
+            regressions.append(f"{name}: завершился с кодом {current['exit_code']}")
+            continue
+        for metric in COUNTER_METRICS + NOISY_METRICS:
+            old, new = base.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (1.0 if new else 0.0)
+            limit = tolerance if metric in NOISY_METRICS else 0
+            mark = 'REGRESSION' if change > limit else ''
+            print(f'{name:20} {metric:16} {old:>12} -> {new:>12} ({change:+.1%}) {mark}')
+            if mark:
+                regressions.append(f'{name}.{metric}: {old} -> {new} ({change:+.1%})')
+    return regressions
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(report):
+    baseline = load_baseline()
+    baseline[report['dataset']] = {
+        name: {k: r[k] for k in COUNTER_METRICS + NOISY_METRICS + ['exit_code']}
+        for name, r in report['jobs'].items()
+    }
+    with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Замеры скриптов на локальных заменах WB API и БД')
+    parser.add_argument('--dsn', default=os.getenv('BENCH_DSN'), help='локальная БД Postgres (не прод!)')
+    parser.add_argument('--dataset', choices=list(DATASETS), default='default')
+    parser.add_argument('--job', action='append', choices=list(JOBS), help='только указанные скрипты')
+    parser.add_argument('--repeat', type=int, default=1, help='прогонов на скрипт, время - медиана')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-scale', type=float, default=0.01, help='множитель лимитов фейкового API')
+    parser.add_argument('--timeout', type=int, default=1800)
+    parser.add_argument('--sheets-write-quota', type=int, help='записей в минуту в фейковом Sheets (429 сверх квоты)')
+    parser.add_argument('--output', help='файл результатов (по умолчанию benchmarks/results/<dataset>_<время>.json)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение времени и памяти')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true', help='код выхода 1 при регрессии относительно baseline')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('нужен --dsn или BENCH_DSN')
+    if args.check and not args.update_baseline and args.dataset not in load_baseline():
+        parser.error(f'нет эталона для набора {args.dataset} в {BASELINE_PATH} - сначала запустите с --update-baseline')
+
+    report = run_benchmarks(args.dsn, dataset=args.dataset, job_names=args.job, repeat=args.repeat,
+                            seed=args.seed, rate_scale=args.rate_scale, timeout=args.timeout,
+                            sheets_write_quota=args.sheets_write_quota)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Результаты: {output}')
+
+    if args.update_baseline:
+        save_baseline(report)
+        print(f'baseline обновлён: {BASELINE_PATH}')
+    else:
+        regressions = compare_with_baseline(report, load_baseline(), args.tolerance)
+        if regressions:
+            print('Регрессии:\n' + '\n'.join(regressions))
+            if args.check:
+                sys.exit(1)
@@ -0,0 +1,68 @@
+-- Таблицы, в которые пишут замеряемые скрипты (минимально необходимые колонки и ключи из прода)
+
+CREATE TABLE IF NOT EXISTS wb_stock (
+    last_change_date timestamp,
+    warehouse_name text,
+    supplier_article text,
+    nm_id bigint,
+    barcode text,
+    quantity integer,
+    in_way_to_client integer,
+    in_way_from_client integer,
+    quantity_full integer,
+    category text,
+    subject text,
+    brand text,
+    tech_size text,
+    price numeric,
+    discount numeric,
+    is_supply boolean,
+    is_realization boolean,
+    sc_code text,
+    UNIQUE (last_change_date, warehouse_name, nm_id)
+);
+
+CREATE TABLE IF NOT EXISTS wb_feedbacks (
+    id text PRIMARY KEY,
+    nmid bigint,
+    productvaluation integer,
+    createddate timestamptz,
+    "text" text,
+    pros text,
+    cons text,
+    bables jsonb,
+    answer_text text,
+    photolinks jsonb,
+    video jsonb,
+    username text,
+    isablereturnproductorders boolean,
+    isablesupplierfeedbackvaluation boolean,
+    isablesupplierproductvaluation boolean,
+    wasviewed boolean,
+    parentfeedbackid text,
+    childfeedbackid text,
+    matchingsize text,
+    lastordercreatedat timestamptz,
+    lastordershkid bigint,
+    returnproductordersdate timestamptz,
+    supplierfeedbackvaluation integer,
+    supplierproductvaluation integer
+);
+
+-- autopilot_hourly: справочники артикулов и история СПП
+CREATE TABLE IF NOT EXISTS card_data (
+    article_id bigint
+);
+
+CREATE TABLE IF NOT EXISTS article (
+    nm_id bigint,
+    account text
+);
+
+CREATE TABLE IF NOT EXISTS spp_history (
+    nm_id bigint,
+    full_price numeric,
+    spp_percent numeric,
+    spp_price numeric,
+    created_at timestamp DEFAULT NOW()
+);
@@ -10,7 +10,8 @@ import os
 from pathlib import Path
 from utils.logger import setup_logger
 from utils.my_db_functions import fetch_db_data_into_list
-from utils.my_gspread import get_col_index, remove_duplicates_from_col, connect_to_remote_sheet, remove_duplicates_by_val, find_duplicates_by_val_and_warn
+from utils.cache import invalidate
+from utils.my_gspread import get_col_index, remove_duplicates_from_col, connect_to_remote_sheet, remove_duplicates_by_val, find_duplicates_by_val_and_warn, init_client
 from utils.my_api import get_product_by_nmid
 from utils.my_general import open_json
 
@@ -456,7 +457,7 @@ if __name__ == "__main__":
     try:
     # Строим путь к creds.json относительно расположения текущего файла (add_new_items.py)
         creds_path = Path(__file__).parent.parent.parent / "creds" / "creds.json"
-        my_client = gspread.service_account(filename=str(creds_path)) 
+        my_client = init_client(str(creds_path)) 
         if remote:
             new_items_table = my_client.open('Новый товар')
             new_items_sh = new_items_table.worksheet('Для юнит')
@@ -647,4 +648,7 @@ if __name__ == "__main__":
 
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+    finally:
+        # UNIT могла измениться (в т.ч. частично при ошибке) - сбрасываем кеш артикулов и ЛК
+        invalidate('utils.my_gspread')
\ No newline at end of file
@@ -9,7 +9,8 @@ import os
 
 from utils.logger import setup_logger
 from utils.my_db_functions import fetch_db_data_into_list
-from utils.my_gspread import get_col_index, remove_duplicates_from_col, connect_to_remote_sheet, remove_duplicates_by_val, find_duplicates_by_val_and_warn
+from utils.cache import invalidate
+from utils.my_gspread import get_col_index, remove_duplicates_from_col, connect_to_remote_sheet, remove_duplicates_by_val, find_duplicates_by_val_and_warn, init_client
 from utils.my_api import get_product_by_nmid
 from utils.my_general import open_json
 from pathlib import Path
@@ -409,7 +410,7 @@ if __name__ == "__main__":
     only_warn = True    # <--- поставить only_warn=False если нужно удалять дубликаты  !!!!!
 
     try:
-        my_client = gspread.service_account(filename=CREDS_PATH) 
+        my_client = init_client(CREDS_PATH) 
         if remote:
             new_items_table = my_client.open('Новый товар')
             new_items_sh = new_items_table.worksheet('Для юнит')
@@ -595,4 +596,7 @@ if __name__ == "__main__":
 
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+    finally:
+        # UNIT могла измениться (в т.ч. частично при ошибке) - сбрасываем кеш артикулов и ЛК
+        invalidate('utils.my_gspread')
\ No newline at end of file
@@ -3,20 +3,28 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 import asyncio
+import aiohttp
 import requests
 from datetime import datetime, timedelta
 from psycopg2.extras import execute_values
 
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
+from utils.my_api import get_rate_limiter, wb_url
 from utils.my_general import ensure_datetime
-from utils.my_db_functions import create_connection_w_env
+from utils.my_db_functions import create_connection_w_env, fetch_db_data_into_list
 
 
 # ---- LOGS ----
 logger = setup_logger("adv_spend.log")
 
 DB_TABLE = 'adv_spend_new' # change
+UPD_URL = wb_url('advert', "/adv/v1/upd")
+UPD_INTERVAL = 1        # квота /adv/v1/upd: 1 запрос в секунду
+MAX_CHUNK = 31          # максимальный период одного запроса, дней
+OVERLAP_DAYS = 1        # сколько дней до водяного знака перезапрашиваем (списания могут дописываться задним числом)
+DEFAULT_START = datetime(2024, 1, 1)  # с какой даты грузим кабинет без данных в БД
+CLIENT_START = {'Старт2': datetime(2025, 9, 1), 'Вектор2': datetime(2025, 9, 1)}
 
 
 def get_wb_adv_costs(token: str, date_from: str, date_to: str):
@@ -31,7 +39,7 @@ def get_wb_adv_costs(token: str, date_from: str, date_to: str):
     Returns:
         dict: JSON response from the API, or error details.
     """
-    url = "https://advert-api.wildberries.ru/adv/v1/upd"
+    url = wb_url('advert', "/adv/v1/upd")
     
     headers = {
         "Authorization": token
@@ -47,13 +55,34 @@ def get_wb_adv_costs(token: str, date_from: str, date_to: str):
     return response.json()
 
 
-def insert_advert_spend(data_list, conn):
+async def get_wb_adv_costs_async(session: aiohttp.ClientSession, token: str, date_from: str, date_to: str):
+    """
+    Async version of get_wb_adv_costs. Calls with the same token share one rate limiter.
+    """
+    await get_rate_limiter(("adv_upd", token), UPD_INTERVAL).wait()
+    params = {"from": date_from, "to": date_to}
+    async with session.get(UPD_URL, headers={"Authorization": token}, params=params) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None) or []
+
+
+def load_watermarks(conn=None):
+    """
+    Returns {account: max upd_time} already stored in DB_TABLE.
+    """
+    rows = fetch_db_data_into_list(f"SELECT account, MAX(upd_time) FROM {DB_TABLE} GROUP BY account", conn=conn)
+    return {account: upd_time for account, upd_time in rows}
+
+
+def insert_advert_spend(data_list, conn, replace_period=None):
     """
     Inserts a list of dicts into advert_spend_new.
     
     Args:
         data_list (list of dict): Input data.
         conn: psycopg2 database connection.
+        replace_period (tuple of datetime): (date_from, date_to) - if given, rows of the same account
+            within these days are deleted in the same transaction, so re-fetched periods don't create duplicates.
     """
     if not data_list:
         return
@@ -97,78 +126,66 @@ def insert_advert_spend(data_list, conn):
 
     try:
         with conn.cursor() as cur:
-            execute_values(cur, sql, values)
+            if replace_period is not None:
+                cur.execute(
+                    f"DELETE FROM {DB_TABLE} WHERE account = %s AND upd_time >= %s AND upd_time < %s",
+                    (rows[0]["account"], replace_period[0], replace_period[1] + timedelta(days=1))
+                )
+            execute_values(cur, sql, values, page_size=1000)
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
 
-async def process_client(client: str, token: str, start_date: datetime, end_date: datetime, max_chunk: int, conn):
+async def process_client(client: str, token: str, start_date: datetime, end_date: datetime, max_chunk: int, conn=None, session=None):
     """
     Process all data for a single client asynchronously, slicing into chunks.
+    Each chunk replaces the stored rows of its period, so overlapping runs are idempotent.
+    Uses its own DB connection and HTTP session unless they are passed in.
     """
-    current_start = start_date
-    logger.info(f'Started processing client {client}')
-    while current_start <= end_date:
-        current_end = min(current_start + timedelta(days=max_chunk-1), end_date)
-        period = f"{current_start.strftime('%Y-%m-%d')}-{current_end.strftime('%Y-%m-%d')}"
-        
-        try: 
-            data = get_wb_adv_costs(
-                token=token,
-                date_from=current_start.strftime("%Y-%m-%d"),
-                date_to=current_end.strftime("%Y-%m-%d")
-            )
-
-            ids = set([i['advertId'] for i in data])
-            
-            if data:
-                logger.info(f"Successfully retrieved {len(data)} for {client}, {period}, ids: {ids}")
-            
-                for item in data:
-                    item['account'] = client
-
-                insert_advert_spend(data, conn)
-                logger.info(f"Successfully added data for {client}, {period} to DB")
-            else:
-                logger.warning(f"No data for client {client}, period {period}")
-
-        except Exception as e:
-            logger.error(f"Error for client {client} period {period}: {e}")
-
-        # move to next chunk
-        current_start = current_end + timedelta(days=1)
-
-        # respect API limit
-        await asyncio.sleep(1)
+    own_conn = conn is None
+    own_session = session is None
+    if own_conn:
+        conn = create_connection_w_env()
+    if own_session:
+        session = aiohttp.ClientSession()
 
+    current_start = start_date
+    logger.info(f'Started processing client {client}: {start_date:%Y-%m-%d} - {end_date:%Y-%m-%d}')
+    try:
+        while current_start <= end_date:
+            current_end = min(current_start + timedelta(days=max_chunk-1), end_date)
+            period = f"{current_start.strftime('%Y-%m-%d')}-{current_end.strftime('%Y-%m-%d')}"
 
-async def upload_all_data_async():
-    """
-    Main async function to process multiple clients concurrently.
-    """
-    tokens = load_api_tokens()
-    conn = create_connection_w_env()
+            try:
+                data = await get_wb_adv_costs_async(
+                    session=session,
+                    token=token,
+                    date_from=current_start.strftime("%Y-%m-%d"),
+                    date_to=current_end.strftime("%Y-%m-%d")
+                )
 
-    start_date = datetime(2025, 1, 1)
-    end_date = datetime.today() - timedelta(days=1)
-    max_chunk = 31
+                if data:
+                    logger.info(f"Successfully retrieved {len(data)} rows for {client}, {period}")
 
-    tasks = []
-    for client, token in tokens.items():
-        # set custom start date for specific clients
-        if client in ['Старт2', 'Вектор2']:
-            start_date = datetime(2025, 9, 1)  # custom date for these clients
-        else:
-            start_date = datetime(2024, 1, 1)   # default date
+                    for item in data:
+                        item['account'] = client
 
-        tasks.append(process_client(client, token, start_date, end_date, max_chunk, conn))
+                    insert_advert_spend(data, conn, replace_period=(current_start, current_end))
+                    logger.info(f"Successfully added data for {client}, {period} to DB")
+                else:
+                    logger.warning(f"No data for client {client}, period {period}")
 
-    await asyncio.gather(*tasks)
+            except Exception as e:
+                logger.error(f"Error for client {client} period {period}: {e}")
 
-# # logic for uploading ALL data
-# if __name__ == "__main__":
-#     asyncio.run(upload_all_data_async())
+            # move to next chunk
+            current_start = current_end + timedelta(days=1)
+    finally:
+        if own_session:
+            await session.close()
+        if own_conn:
+            conn.close()
 
 
 async def upload_data_for_range(start_date, end_date):
@@ -180,19 +197,40 @@ async def upload_data_for_range(start_date, end_date):
     end_date = ensure_datetime(end_date)
 
     tokens = load_api_tokens()
-    conn = create_connection_w_env()
-    max_chunk = 31
 
-    tasks = [
-        process_client(client, token, start_date, end_date, max_chunk, conn)
-        for client, token in tokens.items()
-    ]
+    async with aiohttp.ClientSession() as session:
+        tasks = [
+            process_client(client, token, start_date, end_date, MAX_CHUNK, session=session)
+            for client, token in tokens.items()
+        ]
+        await asyncio.gather(*tasks)
+
+
+async def upload_incremental(end_date=None, overlap_days=OVERLAP_DAYS):
+    """
+    Loads only new spend for every client: from the client's stored max upd_time
+    (minus overlap_days) up to end_date (yesterday by default).
+    """
+    end_date = ensure_datetime(end_date) if end_date else datetime.today() - timedelta(days=1)
+    end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    tokens = load_api_tokens()
+    watermarks = load_watermarks()
+
+    tasks = []
+    async with aiohttp.ClientSession() as session:
+        for client, token in tokens.items():
+            watermark = watermarks.get(client)
+            if watermark:
+                start_date = datetime.combine(watermark.date(), datetime.min.time()) - timedelta(days=overlap_days)
+            else:
+                start_date = CLIENT_START.get(client, DEFAULT_START)
+            start_date = min(start_date, end_date)
+            tasks.append(process_client(client, token, start_date, end_date, MAX_CHUNK, session=session))
+
+        await asyncio.gather(*tasks)
 
-    await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
-    # dynamically get yesterday
-    yesterday = datetime.today() - timedelta(days=1)
-    
-    # call async function for yesterday only
-    asyncio.run(upload_data_for_range(yesterday, yesterday))
+    # from each client's watermark up to yesterday
+    asyncio.run(upload_incremental())
@@ -22,6 +22,7 @@ from time import sleep
 from db_data_to_purch_gs import update_orders_by_regions
 from autopilot_hourly import parse_data_from_WB
 from utils.my_gspread import init_client
+from utils.my_api import wb_url
 from utils import my_pandas, my_gspread
 from utils import my_db_functions as db
 from utils.logger import setup_logger
@@ -368,7 +369,7 @@ async def parse_data_from_WB(session, article):
 
 
     # URL эндпоинта WB, который возвращает карточку товара
-    url = "https://card.wb.ru/cards/v4/detail"
+    url = wb_url('card', "/cards/v4/detail")
 
     # Параметры запроса
     # Эти параметры WB ожидает в query string
@@ -923,7 +924,7 @@ if __name__ == "__main__":
     autopilot_adv_status = {int(key): 'реклама' if value > 0 else '' for key, value in autopilot_adv_status.items()}
 
     # connect to unit
-    client = gspread.service_account(filename=CREDS_PATH)
+    client = init_client(CREDS_PATH)
     unit_table = client.open(UNIT_TABLE)
     unit_sh = unit_table.worksheet(UNIT_MAIN_SHEET)
 
@@ -23,11 +23,12 @@ from psycopg2.extras import execute_values
 
 # my packages
 # from utils.env_loader import *
-from utils import my_pandas, my_gspread
+from utils import my_pandas, my_gspread, metrics
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_db_functions import fetch_db_data_into_dict, create_connection_w_env
 
-from new_adv import get_all_adv_data, processed_adv_data
+from new_adv import update_adv_stats_store
 from  pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
@@ -108,7 +109,7 @@ logging.basicConfig(
 
 def get_fun(account: str, api_token: str, nmIDs: list):
     logging.info(f"Начало обработки аккаунта {account}")
-    url = 'https://seller-analytics-api.wildberries.ru/api/analytics/v3/sales-funnel/products'
+    url = wb_url('analytics', '/api/analytics/v3/sales-funnel/products')
     headers = {'Authorization': api_token}
 
     my_date = datetime.now()
@@ -220,6 +221,7 @@ def get_fun(account: str, api_token: str, nmIDs: list):
 
 
 
+@metrics.span('collect_full_funnel_data')
 def collect_full_funnel_data(articles_sorted = None):
     '''
     Собирает данные по воронке по всем клиентам. Отдаёт словарь и заголовки колонок.
@@ -293,7 +295,7 @@ def get_full_prices_from_API_WB(filter_articles = None):
     articles_clients = {i['article_id'] : str(i['account']).capitalize() for i in data}
 
     tokens = load_api_tokens()
-    url = 'https://discounts-prices-api.wildberries.ru/api/v2/list/goods/filter'
+    url = wb_url('prices', '/api/v2/list/goods/filter')
     all_prices = {}
     
     for account, api_token in tokens.items():
@@ -326,7 +328,7 @@ def parse_data_from_WB(articles, return_keys=None, handle_nested_keys=None, show
     Пример: [['sizes', 0, 'price']] → data['sizes'][0]['price']
     '''
     
-    url = "https://card.wb.ru/cards/v4/detail"
+    url = wb_url('card', "/cards/v4/detail")
     params = {
         "appType": 1,
         "curr": "rub",
@@ -393,6 +395,7 @@ def parse_data_from_WB(articles, return_keys=None, handle_nested_keys=None, show
 
 
 
+@metrics.span('load_adv_spend')
 def load_adv_spend(articles_sorted=None):
     '''
     Возвращает данные по Сумме затрат из API Кометы.
@@ -451,6 +454,7 @@ def load_adv_spend(articles_sorted=None):
 
 
 
+@metrics.span('get_data_from_WB')
 def get_data_from_WB(articles = None):
 
     '''
@@ -493,6 +497,7 @@ def get_data_from_WB(articles = None):
     return result
 
 
+@metrics.span('get_calc_data')
 def get_calc_data(adv_spend, fun_data, fun_headers):
     '''
     'Прибыль с заказов по ИУ', ЧП-РК, ДРР, cpo
@@ -535,22 +540,26 @@ def get_calc_data(adv_spend, fun_data, fun_headers):
     return profit_data, net_profit, adv_part, cpo
 
 
+@metrics.span('process_adv_stat_new')
 def process_adv_stat_new():
     '''
-    Получает рекламную статистику по всем кабинетам с помощью асинхронной функции.
-    Берёт только общие просмотры, клики и затраты, агрегирует данные по артикулам.
+    Получает рекламную статистику по всем кабинетам с помощью асинхронной функции
+    и сохраняет её в БД (вчера и сегодня).
+    Берёт только общие просмотры, клики и затраты за сегодня, агрегирует данные по артикулам.
     Дополнительно считает ctr, cpc, cpm
 
     Возвращает лист словарей
     '''
     logging.info('Processing adv_stat new...')
     
-    raw_data = asyncio.run(get_all_adv_data())
-    data = processed_adv_data(raw_data)
+    data = update_adv_stats_store()
+    today = datetime.now().strftime('%Y-%m-%d')
 
     agg = defaultdict(lambda: {'clicks': 0, 'views': 0, 'adv_spend': 0})
     for i in data:
-        aid = i['article_id']
+        if i['date'] != today:
+            continue
+        aid = i['nm_id']
         agg[aid]['clicks'] += i['clicks']
         agg[aid]['views'] += i['views']
         agg[aid]['adv_spend'] += i['sum']
@@ -627,6 +636,7 @@ def push_data(sh, dct, metric_names, gsheet_headers, matched_metrics, articles_s
 
 
 
+@metrics.span('push_data_static_range')
 def push_data_static_range(sh, dct, metric_names, gsheet_headers, matched_metrics, articles_sorted, col_num, values_first_row, sh_len):
     '''
     Pushes dictionary data to Google Sheets using STATIC column ranges.
@@ -691,6 +701,7 @@ def push_data_static_range(sh, dct, metric_names, gsheet_headers, matched_metric
                 break
 
 
+@metrics.span('load_unit_remains')
 def load_unit_remains(unit_sh = None):
 
     if unit_sh is None:
@@ -723,37 +734,72 @@ def load_unit_remains(unit_sh = None):
     return unit_remains
 
 
+SPP_LATEST_TABLE = 'spp_latest'
+
+
+def create_spp_latest_table(connection):
+    '''
+    Таблица последних значений цены/СПП по артикулу (ведётся upsert-ом вместе с записью в spp_history)
+    и индекс по spp_history.created_at для проверки "уже писали в этом часу".
+    При первом запуске заполняется из spp_history.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SPP_LATEST_TABLE} (
+                nm_id BIGINT PRIMARY KEY,
+                full_price NUMERIC,
+                spp_percent NUMERIC,
+                spp_price NUMERIC,
+                updated_at TIMESTAMP DEFAULT NOW()
+            );
+            CREATE INDEX IF NOT EXISTS spp_history_created_at_idx ON spp_history (created_at);
+        """)
+        cursor.execute(f"SELECT 1 FROM {SPP_LATEST_TABLE} LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute(f"""
+                INSERT INTO {SPP_LATEST_TABLE} (nm_id, full_price, spp_percent, spp_price, updated_at)
+                SELECT DISTINCT ON (nm_id) nm_id, full_price, spp_percent, spp_price, created_at
+                FROM spp_history
+                ORDER BY nm_id, created_at DESC
+                ON CONFLICT (nm_id) DO NOTHING;
+            """)
+            logging.info(f"{SPP_LATEST_TABLE} заполнена из spp_history: {cursor.rowcount} артикулов")
+    connection.commit()
+
+
+@metrics.span('insert_spp_data_to_db')
 def insert_spp_data_to_db(connection, wb_data):
 
     '''
     Функция insert_spp_data_to_db вставляет данные о ценах и скидках товаров в таблицу spp_history.
     - Пропускает вставку, если данные за текущий час уже существуют.
-    - Получает последние значения цен из базы для каждого товара.
-    - Добавляет только новые записи или записи с изменившейся ценой.
+    - Получает последние значения цен из spp_latest (по первичному ключу) для каждого товара.
+    - Добавляет только новые записи или записи с изменившейся ценой, spp_latest обновляется в той же транзакции.
     - Игнорирует товары с отсутствующими или некорректными значениями (нечисловыми).
     ''' 
+    create_spp_latest_table(connection)
 
     # I.
     # ПУ обновляется раз в полчаса, записывать данные нужно раз в час
-    # --> проверяем, были ли записи в этом часу
+    # --> проверяем, были ли записи в этом часу (диапазон по created_at - идёт по индексу)
     with connection.cursor() as cursor:
         cursor.execute("""
             SELECT 1
             FROM spp_history
-            WHERE date(created_at) = current_date
-                AND date_part('hour', created_at) = date_part('hour', NOW())
+            WHERE created_at >= date_trunc('hour', NOW())
+                AND created_at < date_trunc('hour', NOW()) + INTERVAL '1 hour'
             LIMIT 1;
         """)
         if cursor.fetchone():
             logging.info("Найдено обновление цены за последний час. Изменения не внесены в spp_history")
             return
     
-        # II. Берем последние данные для каждого артикула из БД
-        cursor.execute("""
-            SELECT DISTINCT ON (nm_id) nm_id, full_price, spp_price
-            FROM spp_history
-            ORDER BY nm_id, created_at DESC;
-        """)
+        # II. Берем последние данные для переданных артикулов из spp_latest
+        cursor.execute(f"""
+            SELECT nm_id, full_price, spp_price
+            FROM {SPP_LATEST_TABLE}
+            WHERE nm_id = ANY(%s);
+        """, (list(wb_data.keys()),))
         last_data = {row[0]: {'full_price': row[1], 'spp_price': row[2]} for row in cursor.fetchall()}
 
         # III. Добавляем данные, только если есть изменения в цене
@@ -771,16 +817,31 @@ def insert_spp_data_to_db(connection, wb_data):
                 records.append((nm_id, full_price, spp_percent, spp_price))
 
         if records:
-            execute_values(cursor, """
-                    INSERT INTO spp_history (nm_id, full_price, spp_percent, spp_price)
-                    VALUES %s;
-                """, records)
-            connection.commit()
+            try:
+                execute_values(cursor, """
+                        INSERT INTO spp_history (nm_id, full_price, spp_percent, spp_price)
+                        VALUES %s;
+                    """, records)
+                execute_values(cursor, f"""
+                        INSERT INTO {SPP_LATEST_TABLE} (nm_id, full_price, spp_percent, spp_price)
+                        VALUES %s
+                        ON CONFLICT (nm_id) DO UPDATE SET
+                            full_price = EXCLUDED.full_price,
+                            spp_percent = EXCLUDED.spp_percent,
+                            spp_price = EXCLUDED.spp_price,
+                            updated_at = NOW();
+                    """, records)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
             logging.info("Найдены изменения в цене СПП. Изменения записаны в БД")
 
 
 if __name__ == "__main__":
 
+    metrics.start_run('autopilot_hourly')
+
     pilot_table_name = os.getenv('AUTOPILOT_TABLE_NAME')
     pilot_sheet_name = os.getenv('AUTOPILOT_SHEET_NAME')
 
@@ -906,7 +967,7 @@ if __name__ == "__main__":
             insert_spp_data_to_db(connection, wb_data)
             connection.close()
         except Exception as e:
-            logging.erorr(f"Ошибка при попытке внесения изменений СПП цены: {e}")
+            logging.error(f"Ошибка при попытке внесения изменений СПП цены: {e}")
 
         try:
             # выгружаем promo, rating, prices, spp
@@ -945,4 +1006,6 @@ if __name__ == "__main__":
             logging.error(f"Ошибка при выгрузке Цены с СПП: {e}")
         
     except Exception as e:
-        logging.error(f'Error:\n{e}')
\ No newline at end of file
+        metrics.finish_run(error=e)
+        logging.error(f'Error:\n{e}')
+        raise
\ No newline at end of file
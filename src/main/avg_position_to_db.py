@@ -12,10 +12,11 @@ import logging
 import requests
 from time import sleep
 from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
 
 # my packages
-from utils.env_loader import *
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_general import aggregate_dct_data
 from utils.my_db_functions import create_connection_w_env, load_articles_clients_data, insert_dct_data_to_db
 
@@ -35,6 +36,18 @@ logging.basicConfig(
 )
 
 
+# ---- SET UP ----
+
+# table/details отдаёт значения, агрегированные за весь период (current/dynamics),
+# поэтому дневную строку avg_position можно получить только запросом за один день.
+# Экономим не шириной периода, а тем, что не запрашиваем уже покрытые пары (артикул, дата).
+CHUNK_SIZE = 50         # максимум nmIds в одном запросе
+REQUEST_DELAY = 22      # сек. между запросами одного кабинета
+COVERAGE_TABLE = 'avg_position_coverage'
+DAILY_LAG_DAYS = 3      # данные за день считаются готовыми через 3 дня
+DAILY_WINDOW_DAYS = 7   # ежедневный запуск дозапрашивает недостающие пары за последние 7 дней
+
+
 
 async def get_pagination_data(api_token, start_date, end_date, nmIds = None, orderBy_field = 'avgPosition', orderBy_mode = 'asc', positionCluster = 'all', limit = 1000, offset = 0):
     '''
@@ -53,7 +66,7 @@ async def get_pagination_data(api_token, start_date, end_date, nmIds = None, ord
 
     # если в артикулах есть артикул не от того продавца, выгружаются данные только по подходящим артикулам (апи не ломается)
 
-    url = 'https://seller-analytics-api.wildberries.ru/api/v2/search-report/table/details'
+    url = wb_url('analytics', '/api/v2/search-report/table/details')
     headers = {'Authorization': api_token, 'Content-Type': 'application/json'}
     json_data = {
         'currentPeriod': {
@@ -79,7 +92,7 @@ async def get_pagination_data(api_token, start_date, end_date, nmIds = None, ord
             except Exception as e:
                 data = await response.json()
                 logging.error(f'API error: {e}:  {data}')
-                return []
+                return None
 
 
 def create_avg_position_table():
@@ -120,6 +133,78 @@ def create_avg_position_table():
         logging.error('Error during creating the avg_position db table:\n{e}')
 
 
+def create_avg_position_coverage_table(conn):
+    '''
+    Таблица покрытия: какие пары (артикул, дата) уже успешно запрошены.
+    За даты старше DAILY_LAG_DAYS отмечаются все запрошенные артикулы, в т.ч. без данных в ответе
+    (данные за день уже окончательные). За более свежие даты - только вернувшиеся, остальные дозапрашиваются позже.
+    Пары с ошибкой API не отмечаются никогда.
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {COVERAGE_TABLE} (
+            nm_id BIGINT NOT NULL,
+            report_date DATE NOT NULL,
+            loaded_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (nm_id, report_date)
+        );
+        """)
+    conn.commit()
+
+
+def load_coverage(conn, nmIDs, start_date, end_date):
+    '''
+    Возвращает {артикул: {даты 'YYYY-MM-DD'}}, за которые данные уже есть.
+    Учитывает и таблицу покрытия, и сами строки avg_position (данные, загруженные до появления покрытия).
+    '''
+    query = f"""
+        SELECT nm_id, report_date
+        FROM {COVERAGE_TABLE}
+        WHERE report_date BETWEEN %(start)s AND %(end)s
+            AND nm_id = ANY(%(ids)s)
+        UNION
+        SELECT nmId, report_date
+        FROM avg_position
+        WHERE report_date BETWEEN %(start)s AND %(end)s
+            AND nmId = ANY(%(ids)s)
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, {'start': start_date, 'end': end_date, 'ids': list(nmIDs)})
+        rows = cur.fetchall()
+
+    coverage = {}
+    for nm_id, report_date in rows:
+        coverage.setdefault(nm_id, set()).add(report_date.strftime('%Y-%m-%d'))
+    return coverage
+
+
+def mark_covered(conn, nmIDs, date_str):
+    '''
+    Отмечает пары (артикул, дата) как загруженные. Коммит делает вызывающая сторона.
+    '''
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            f"INSERT INTO {COVERAGE_TABLE} (nm_id, report_date) VALUES %s ON CONFLICT DO NOTHING",
+            [(nm_id, date_str) for nm_id in nmIDs]
+        )
+
+
+def plan_requests(nmIDs, dates, coverage = None, chunk_size = CHUNK_SIZE):
+    '''
+    Составляет минимальный набор запросов [(date_str, [nmIds])], покрывающий недостающие пары (артикул, дата).
+    Т.к. период не делится по дням, на каждую дату нужен ceil(кол-во недостающих / chunk_size) запросов -
+    артикулы, у которых дата уже есть, в запрос не попадают.
+    '''
+    coverage = coverage or {}
+    plan = []
+    for single_date in dates:
+        date_str = single_date.strftime('%Y-%m-%d')
+        missing = [nm_id for nm_id in nmIDs if date_str not in coverage.get(nm_id, ())]
+        plan.extend((date_str, missing[i:i + chunk_size]) for i in range(0, len(missing), chunk_size))
+    return plan
+
+
 def daterange(start, end):
     '''
     Считает range дат, включая start и end
@@ -184,107 +269,98 @@ def load_hist_data(api_token, nmIDs, start_date, end_date):
     end = datetime.strptime(end_date, '%Y-%m-%d')
     all_data = []
 
-    nmIds_chunks = [nmIDs[i:i + 50] for i in range(0, len(nmIDs), 50)]
-    dates = list(daterange(start, end + timedelta(days=1)))
-    
-    for i, single_date in enumerate(dates):
-        date_str = single_date.strftime('%Y-%m-%d')
-        daily_data = []
-
-        for j, chunk in enumerate(nmIds_chunks):
-            try:
-                chunk_data = run_async_func_to_thread(
-                    get_pagination_data(
-                        api_token=api_token,
-                        start_date=date_str,
-                        end_date=date_str,
-                        nmIds=chunk
-                    )
-                )
-                daily_data.extend(chunk_data)
-                logging.info(f"The data for chunk {j+1}/{len(nmIds_chunks)} on {date_str} is loaded")
-
-            except Exception as e:
-                logging.error(f'Error while loading chunk for {date_str}:\n{e}')
-            finally:
-                # Sleep after each chunk except the last one
-                if j < len(nmIds_chunks) - 1:
-                    sleep(21)
-
-        print(f'The data for {date_str} is loaded')
-
-        for item in daily_data:
-            clean_item = clean_item_data(item, date_str)
-            all_data.append(clean_item)
-        
-        # Sleep after each date except the last one
-        if i < len(dates) - 1:
-            sleep(21)
+    plan = plan_requests(nmIDs, daterange(start, end + timedelta(days=1)))
+
+    for i, (date_str, chunk) in enumerate(plan):
+        try:
+            chunk_data = run_async_func_to_thread(
+                get_pagination_data,
+                api_token=api_token,
+                start_date=date_str,
+                end_date=date_str,
+                nmIds=chunk
+            )
+            all_data.extend(clean_item_data(item, date_str) for item in chunk_data or [])
+            logging.info(f"The data for request {i+1}/{len(plan)} on {date_str} is loaded")
+
+        except Exception as e:
+            logging.error(f'Error while loading chunk for {date_str}:\n{e}')
+        finally:
+            # Sleep after each request except the last one
+            if i < len(plan) - 1:
+                sleep(REQUEST_DELAY)
 
     return all_data
 
 
 async def load_and_update_hist_data(api_token, nmIDs, start_date, end_date, conn, client):
     '''
-    Выгружает и загружает в БД данные по каждому дню отдельно.
+    Выгружает и загружает в БД только недостающие пары (артикул, дата) по таблице покрытия.
+    Каждый запрос вставляется в БД вместе с отметкой о покрытии в одной транзакции.
+    Возвращает число запросов, завершившихся ошибкой.
     '''
     start = datetime.strptime(start_date, '%Y-%m-%d')
     end = datetime.strptime(end_date, '%Y-%m-%d')
 
-    nmIds_chunks = [nmIDs[i:i + 50] for i in range(0, len(nmIDs), 50)]
-    dates = list(daterange(start, end + timedelta(days=1)))
-
-    for i, single_date in enumerate(dates):
-        date_str = single_date.strftime('%Y-%m-%d')
-        daily_data = []
-
-        for j, chunk in enumerate(nmIds_chunks):
-            try:
-                chunk_data = await get_pagination_data(
-                    api_token=api_token,
-                    start_date=date_str,
-                    end_date=date_str,
-                    nmIds=chunk
-                )
-                if chunk_data:
-                    daily_data.extend(chunk_data)
-                    logging.info(f"Client: {client:^10} - The data for chunk {j+1}/{len(nmIds_chunks)} on {date_str} is loaded.")
-
-            except Exception as e:
-                logging.error(f'Error while loading chunk for {date_str}:\n{e}, client: {client}')
-            finally:
-                if j < len(nmIds_chunks) - 1:
-                    await asyncio.sleep(22)
-
-        cleaned_data = [clean_item_data(item, date_str) for item in daily_data]
+    coverage = load_coverage(conn, nmIDs, start.date(), end.date())
+    plan = plan_requests(nmIDs, daterange(start, end + timedelta(days=1)), coverage)
+
+    # за даты не позже final_date данные окончательные - пустой ответ тоже считается покрытием
+    final_date = (datetime.now() - timedelta(days=DAILY_LAG_DAYS)).strftime('%Y-%m-%d')
+
+    full_requests = -(-len(nmIDs) // CHUNK_SIZE) * ((end - start).days + 1)
+    logging.info(f"Client: {client:^10} - {len(plan)} requests planned instead of {full_requests}")
+
+    errors = 0
+    for i, (date_str, chunk) in enumerate(plan):
+        try:
+            chunk_data = await get_pagination_data(
+                api_token=api_token,
+                start_date=date_str,
+                end_date=date_str,
+                nmIds=chunk
+            )
+            if chunk_data is None:
+                # ошибка API - не отмечаем покрытие, артикулы будут запрошены при следующем запуске
+                errors += 1
+                continue
 
-        if cleaned_data:
-            try:
+            cleaned_data = [clean_item_data(item, date_str) for item in chunk_data]
+            if cleaned_data:
                 insert_dct_data_to_db(cleaned_data, conn)
-                conn.commit()
-                logging.info(f"Inserted {len(cleaned_data)} rows for {date_str}\n")
-            except Exception as e:
-                conn.rollback()
-                logging.error(f"Failed to insert data for {date_str}: {e}\n")
-        else:
-            logging.info(f"No data for {date_str}")
+            if date_str <= final_date:
+                mark_covered(conn, chunk, date_str)
+            else:
+                mark_covered(conn, {item['nmId'] for item in cleaned_data if item['nmId'] in chunk}, date_str)
+            conn.commit()
+            logging.info(f"Client: {client:^10} - Inserted {len(cleaned_data)} rows for {date_str} (request {i+1}/{len(plan)})")
 
-        if i < len(dates) - 1:
-            await asyncio.sleep(22)
+        except Exception as e:
+            conn.rollback()
+            errors += 1
+            logging.error(f'Error while loading chunk for {date_str}:\n{e}, client: {client}')
+        finally:
+            if i < len(plan) - 1:
+                await asyncio.sleep(REQUEST_DELAY)
+
+    return errors
 
 
 async def get_and_upload_data_to_db(start_date, end_date):
     '''
     Загружает и обновляет данные по каждому клиенту и каждому дню.
+    Возвращает список клиентов, по которым были ошибки (их пары дозапросятся при следующем запуске).
     '''
     tokens = load_api_tokens()
     conn = create_connection_w_env()
 
     try:
+        create_avg_position_coverage_table(conn)
         id_client = load_articles_clients_data(conn)
         client_id = aggregate_dct_data(id_client)
 
         tasks = []
+        task_clients = []
 
         for client, ids in client_id.items():
             logging.info(f'Processing client {client}...')
@@ -301,10 +377,19 @@ async def get_and_upload_data_to_db(start_date, end_date):
 
             logging.info(f"Loading data for {client} from {client_start} to {end_date}")
             tasks.append(load_and_update_hist_data(api_token, ids, client_start, end_date, conn, client))
+            task_clients.append(client)
         
-        await asyncio.gather(*tasks, return_exceptions=True)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        failed = []
+        for client, res in zip(task_clients, results):
+            if isinstance(res, Exception):
+                logging.error(f"Client {client} failed: {res}")
+            if isinstance(res, Exception) or res:
+                failed.append(client)
 
         logging.info(f"Finished processing all clients.")
+        return failed
 
     except Exception as e:
         logging.critical(f"Unexpected error in get_and_upload_data_to_db: {e}")
@@ -313,5 +398,14 @@ async def get_and_upload_data_to_db(start_date, end_date):
         conn.close()
 
 if __name__ == "__main__":
-    start_date = end_date = (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%d') # yesterday
-    asyncio.run(get_and_upload_data_to_db(start_date, end_date))
\ No newline at end of file
+    # python avg_position_to_db.py [YYYY-MM-DD YYYY-MM-DD] - дозагрузка за период
+    # без аргументов - окно DAILY_WINDOW_DAYS дней по t-3: запрашиваются только пары без данных
+    if len(sys.argv) > 2:
+        start_date, end_date = sys.argv[1], sys.argv[2]
+    else:
+        end = datetime.now() - timedelta(days=DAILY_LAG_DAYS)
+        start_date = (end - timedelta(days=DAILY_WINDOW_DAYS - 1)).strftime('%Y-%m-%d')
+        end_date = end.strftime('%Y-%m-%d')
+    failed = asyncio.run(get_and_upload_data_to_db(start_date, end_date))
+    if failed:
+        sys.exit(f"Средние позиции загружены с ошибками по кабинетам: {', '.join(failed)}")
\ No newline at end of file
@@ -6,7 +6,7 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 # libraries
-from datetime import datetime
+from datetime import datetime, date, timedelta
 import pandas as pd
 import gspread
 import logging
@@ -14,9 +14,10 @@ import os
 
 # my packages
 # from utils.env_loader import *
-from utils.my_db_functions import create_connection_w_env, fetch_db_data_into_dict, list_to_sql_select
-from utils.my_gspread import column_number_to_letter, add_data_to_range, clean_number, connect_to_local_sheet
+from utils.my_db_functions import fetch_db_data_into_dict, list_to_sql_select
+from utils.my_gspread import column_number_to_letter, clean_number, connect_to_local_sheet, init_client
 from utils.my_general import open_json
+from utils.snapshots import load_snapshot
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -36,12 +37,27 @@ PURCHASE_TABLE=os.getenv('PURCHASE_TABLE')
 CHINA_TABLE=os.getenv('CHINA_TABLE')
 CHINA_ORDERS=os.getenv('CHINA_ORDERS')
 CHINA_COUNT=os.getenv('CHINA_COUNT')
+WHITE_ORDERS='Заказы белые ТЕСТ'
 
 ITEMS_FIXED_PRICE=os.getenv('ITEMS_FIXED_PRICE')
 
 DB_PURCHASE_PRICE=os.getenv('DB_PURCHASE_PRICE')
 DB_ANALYSIS=os.getenv('DB_ANALYSIS')
 
+# заказы и остатки по артикулам за день - снапшот для load_db_data
+QUERY_DAILY = f'''
+    SELECT
+        date,
+        local_vendor_code,
+        MAX(subject_name) AS subject_name,
+        SUM(orders_count)::float8 AS orders_per_day,
+        SUM(total_quantity)::float8 AS fbo,
+        AVG(stock_fbs)::float8 AS fbs
+    FROM {DB_ANALYSIS}
+    WHERE date BETWEEN {{date_from}} AND {{date_to}}
+    GROUP BY date, local_vendor_code
+'''
+
 
 # ---- LOGS ----
 
@@ -98,82 +114,25 @@ WILDS_TO_EXCLUDE = [
 ]
 
 def load_db_data(wilds):
+    '''
+    Остатки на вчера и средние заказы в день за 7/14/30 дней по wilds.
+    Дневные агрегаты берутся из локального снапшота (utils/snapshots.py) - из БД догружаются только последние дни
 
-    if not isinstance(wilds, list):
-        wilds = list(wilds)
-
-    conn = create_connection_w_env()
-    wilds_sql = list_to_sql_select(wilds, extra_quotes = True)
-
-    query = f'''
-    with week as (
-        select
-            date,
-            local_vendor_code,
-            sum(orders_count) as orders_per_day
-    from {DB_ANALYSIS}
-    where
-        date BETWEEN CURRENT_DATE - INTERVAL '7 days' AND CURRENT_DATE - INTERVAL '1 day'
-    group by
-        date,
-        local_vendor_code),
-    two_weeks as (
-        select
-            date,
-            local_vendor_code,
-            sum(orders_count) as orders_per_day
-    from {DB_ANALYSIS}
-    where date BETWEEN CURRENT_DATE - INTERVAL '14 days' AND CURRENT_DATE - INTERVAL '1 day'
-    group by
-        date,
-        local_vendor_code),
-    month as (
-        select
-            date,
-            local_vendor_code,
-            sum(orders_count) as orders_per_day
-        from {DB_ANALYSIS}
-    where
-        date BETWEEN CURRENT_DATE - INTERVAL '30 days' AND CURRENT_DATE - INTERVAL '1 day'
-    group by
-        date,
-        local_vendor_code),
-    warehouse_rem as (
-        select 
-            o.local_vendor_code,
-            max(o.subject_name) as subject_name,
-            max(p.name) as name,
-            sum(o.total_quantity) as fbo,
-            avg(o.stock_fbs) as fbs
-        from {DB_ANALYSIS} o
-        left join products p
-        on o.local_vendor_code = p.id
-        where o.date = CURRENT_DATE - INTERVAL '1 day'
-        group by o.local_vendor_code
-    )
-    select
-        w.local_vendor_code,
-        wr.subject_name,
-        wr.name,
-        wr.fbo,
-        wr.fbs,
-        ROUND(avg(w.orders_per_day), 2) as avg_orders_week,
-        ROUND(avg(tw.orders_per_day), 2) as avg_orders_two_weeks,
-        ROUND(avg(m.orders_per_day), 2) as avg_orders_month
-    from week w
-    join two_weeks tw
-    on w.local_vendor_code = tw.local_vendor_code
-    join month m 
-    on w.local_vendor_code = m.local_vendor_code
-    join warehouse_rem wr 
-    on w.local_vendor_code = wr.local_vendor_code
-    where w.local_vendor_code in ({wilds_sql})
-    group by w.local_vendor_code, wr.subject_name, wr.name, wr.fbo, wr.fbs
-    order by local_vendor_code
+    Result:
+        [{'local_vendor_code': 'wild1', 'subject_name': ..., 'fbo': ..., 'fbs': ...,
+          'avg_orders_week': ..., 'avg_orders_two_weeks': ..., 'avg_orders_month': ...}, ...]
     '''
-    res = fetch_db_data_into_dict(query, conn)
+    yesterday = date.today() - timedelta(days=1)
+    df = load_snapshot('china_buy_daily', QUERY_DAILY, date_from=yesterday - timedelta(days=29), date_to=yesterday)
+    df = df[df['local_vendor_code'].isin(set(wilds))]
 
-    return res
+    # в выгрузку попадают артикулы, по которым есть строки за вчера
+    res = df[df['date'] == yesterday][['local_vendor_code', 'subject_name', 'fbo', 'fbs']].set_index('local_vendor_code')
+    for col, days in [('avg_orders_week', 7), ('avg_orders_two_weeks', 14), ('avg_orders_month', 30)]:
+        window = df[df['date'] >= yesterday - timedelta(days=days - 1)]
+        res[col] = window.groupby('local_vendor_code')['orders_per_day'].mean().round(2)
+
+    return res.reset_index().sort_values('local_vendor_code').to_dict('records')
 
 
 def load_unique_wilds_from_orders(orders_sh = None, table = None, client = None):
@@ -187,7 +146,7 @@ def load_unique_wilds_from_orders(orders_sh = None, table = None, client = None)
             sheet = client.open(CHINA_COUNT)
             orders_sh = sheet.worksheet(CHINA_ORDERS)
         else:
-            client = gspread.service_account(filename=CREDS_PATH)
+            client = init_client(CREDS_PATH)
             sheet = client.open(CHINA_COUNT)
             orders_sh = sheet.worksheet(CHINA_ORDERS)
 
@@ -218,37 +177,65 @@ def load_unique_wilds_from_orders(orders_sh = None, table = None, client = None)
 #     return sopost_dct
 
 
-def load_sopost_wilds(client = None, wilds = None):
+def read_sheets(spreadsheet, sheet_names):
+    '''
+    Значения листов таблицы одним запросом values_batch_get
+
+    Result:
+        {sheet_name : [[row1], [row2], ...]}
+    '''
+    res = spreadsheet.values_batch_get([f"'{name}'" for name in sheet_names])
+    return {name : value_range.get('values', []) for name, value_range in zip(sheet_names, res['valueRanges'])}
+
+
+def find_headers(values):
+    '''
+    Returns:
+        (номер строки заголовков с 1, заголовки) - строка, у которой в первой колонке 'Фото'
+    '''
+    first_col_values = [row[0] if row else '' for row in values]
+    header_row_num = first_col_values.index('Фото') + 1
+    return header_row_num, values[header_row_num - 1]
+
+
+def col_from_values(values, headers, col_name, header_row_num):
+    '''
+    Значения колонки col_name ниже строки заголовков, как col_values (пустой хвост обрезан)
+    '''
+    idx = headers.index(col_name)
+    col = [row[idx] if idx < len(row) else '' for row in values[header_row_num:]]
+    while col and col[-1] == '':
+        col.pop()
+    return col
+
+
+def load_sopost_wilds(sopost_values, wilds = None):
     '''
     Arguments:
+        sopost_values: значения листа Сопост (заголовки в первой строке)
         wilds [list]: if given, returns the result for given wilds
 
     Result:
         {wild1 : name, wild2 : ...}
     '''
-    if client is None:
-        client = gspread.service_account(filename=CREDS_PATH)
-    sopost = client.open(UNIT_TABLE).worksheet('Сопост')
-    sopost_headers = sopost.row_values(1)
-    sopost_wilds = sopost.col_values(sopost_headers.index('wild') + 1)[1:]
-    sopost_names = sopost.col_values(sopost_headers.index('Наименование') + 1)[1:]
+    sopost_headers = sopost_values[0]
+    sopost_wilds = col_from_values(sopost_values, sopost_headers, 'wild', 1)
+    sopost_names = col_from_values(sopost_values, sopost_headers, 'Наименование', 1)
     sopost_dct = {w : n for w, n in zip(sopost_wilds, sopost_names)}
     if wilds:
         sopost_dct = { k:v for k, v in sopost_dct.items() if k in wilds}
     return sopost_dct
 
 
-def load_unique_wilds_from_china(sh):
+def load_unique_wilds_from_china(values):
     '''
     Returns:
-        a list of dicts with unique wilds and their names if they have flag 'K' or 'KK' in the column 'Страна' in the given sheet 
+        a list of dicts with unique wilds and their names if they have flag 'K' or 'KK' in the column 'Страна' in the given sheet values
     '''
-    headers_num = sh.col_values(1).index('Фото') + 1
-    headers = sh.row_values(headers_num)
-    wilds = sh.col_values(headers.index('wild') + 1)[headers_num:]
-    names = sh.col_values(headers.index('Модель') + 1)[headers_num:]
-    country = sh.col_values(headers.index('Страна') + 1)[headers_num:]
-    # dct = [{'wild': w, 'name': n} for w, n, c in zip(wilds, names, country) if str(c).capitalize() == 'К']
+    headers_num, headers = find_headers(values)
+    wilds = col_from_values(values, headers, 'wild', headers_num)
+    names = col_from_values(values, headers, 'Модель', headers_num)
+    country = col_from_values(values, headers, 'Страна', headers_num)
     dct = {w : n for w, n, c in zip(wilds, names, country) if str(c).upper() in ['К', 'КК']}
     return dct
 
@@ -314,12 +301,17 @@ def load_last_purch_price(wilds = None):
 
     return db_data
 
-def update_purchase_price_in_gs(orders_sh):
-    header_row_num = list(orders_sh.col_values(1)).index('Фото') + 1
-    headers = orders_sh.row_values(header_row_num)
+def purchase_price_output(sheet_name, values):
+    '''
+    Последние закупочные цены для колонки 'Последняя цена рынок' листа sheet_name.
+
+    Returns:
+        ({wild : name} с листа, запрос на запись {'range': ..., 'values': ...} для values_batch_update)
+    '''
+    header_row_num, headers = find_headers(values)
 
-    wilds_raw = orders_sh.col_values(headers.index('wild') + 1)[header_row_num:]
-    names_raw = orders_sh.col_values(headers.index('Модель') + 1)[header_row_num:]
+    wilds_raw = col_from_values(values, headers, 'wild', header_row_num)
+    names_raw = col_from_values(values, headers, 'Модель', header_row_num)
 
     orders_sh_wilds_lst = [[w, n] for w, n in zip(wilds_raw, names_raw)] # 23.10: вкл пустые строки для выгрузки в гугл
 
@@ -336,11 +328,9 @@ def update_purchase_price_in_gs(orders_sh):
     ]
 
     price_col_letter = column_number_to_letter(headers.index('Последняя цена рынок'))
-    output_range = f'{price_col_letter}{header_row_num + 1}:{price_col_letter}{orders_sh.row_count}'
-    print(f'Uploading new prices to the range {output_range}')
-    orders_sh.update(result, range_name = output_range)
-    logging.info(f"Successfully added purchase price to the sheet {orders_sh.title}")
-    return orders_sh_wilds
+    output_range = f"'{sheet_name}'!{price_col_letter}{header_row_num + 1}:{price_col_letter}{header_row_num + max(len(result), 1)}"
+    logging.info(f'Prepared {len(result)} purchase prices for the range {output_range}')
+    return orders_sh_wilds, {'range': output_range, 'values': result}
 
 def load_db_categories():
     query = f'''
@@ -359,49 +349,56 @@ if __name__ == "__main__":
     
     # 1. connect to client
     try:
-        client = gspread.service_account(filename=CREDS_PATH)
+        client = init_client(CREDS_PATH)
         table = client.open(CHINA_TABLE) # prod
 
         logging.info(f"Connected to the table {CHINA_TABLE}")
     except Exception as e:
         logging.error(f"Failed to connect to the table '{CHINA_TABLE}:\n{e}")
 
-    # 2. выгружаем закупочные цены в CHINA_ORDERS
+    # 2. чтение: по одному values_batch_get на каждую таблицу
     try:
-        orders_sh = table.worksheet(CHINA_ORDERS)
-        orders_sh_wilds = update_purchase_price_in_gs(orders_sh)
+        china_values = read_sheets(table, [CHINA_ORDERS, WHITE_ORDERS, CHINA_COUNT])
+
+        pro_client = init_client(PRO_CREDS_PATH)
+        purch_values = read_sheets(pro_client.open(PURCHASE_TABLE), ['Рынок_сервис', 'Ксиоми_сервис'])
 
-        new_sh = table.worksheet('Заказы белые ТЕСТ')
-        new_wilds = update_purchase_price_in_gs(new_sh)
+        sopost_values = read_sheets(client.open(UNIT_TABLE), ['Сопост'])['Сопост']
+        logging.info('Retrieved data from gs tables')
+    except Exception as e:
+        logging.error(f"Failed to read data from gs tables. Error:\n{e}")
+        raise
+
+    # все записи в CHINA_TABLE копятся здесь и отправляются одним values_batch_update
+    output = []
+
+    # 3. закупочные цены в CHINA_ORDERS
+    try:
+        orders_sh_wilds, price_update = purchase_price_output(CHINA_ORDERS, china_values[CHINA_ORDERS])
+        new_wilds, new_price_update = purchase_price_output(WHITE_ORDERS, china_values[WHITE_ORDERS])
+        output += [price_update, new_price_update]
         
     except Exception as e:
-        logging.error(f"Failed to upload purchase price. Error:\n{e}")
+        logging.error(f"Failed to prepare purchase price. Error:\n{e}")
         raise
 
-    # 3. выгружаем данные в CHINA_COUNT
+    # 4. данные для CHINA_COUNT
     try:
         logging.info(f"Started processing sheet {CHINA_COUNT}")
 
-        # sh = connect_to_local_sheet(os.getenv("LOCAL_TEST_TABLE"), CHINA_COUNT) # test
-
-        sh = table.worksheet(CHINA_COUNT) # prod
-        first_col_values = sh.col_values(1)
-        header_row_num = first_col_values.index('Фото') + 1
-        headers = sh.row_values(header_row_num) # нужны только для расчёта range
+        count_values = china_values[CHINA_COUNT]
+        header_row_num, headers = find_headers(count_values) # нужны только для расчёта range
 
 
         # ---- new part: get wilds from three tables ----
 
         # Добавляем данные из Расчёта закупки
-        pro_client = gspread.service_account(filename=PRO_CREDS_PATH)
-        purch_table = pro_client.open(PURCHASE_TABLE)
-        market_res = load_unique_wilds_from_china(purch_table.worksheet('Рынок_сервис'))
-        xiamoi_res = load_unique_wilds_from_china(purch_table.worksheet('Ксиоми_сервис'))
-        logging.info('Retrieved wilds from three gs tables')
+        market_res = load_unique_wilds_from_china(purch_values['Рынок_сервис'])
+        xiamoi_res = load_unique_wilds_from_china(purch_values['Ксиоми_сервис'])
         
 
         # add wilds from sopost
-        sopost_wilds = load_sopost_wilds()
+        sopost_wilds = load_sopost_wilds(sopost_values)
         sopost_wilds = {w : n for w, n in sopost_wilds.items() if w not in WILDS_TO_EXCLUDE}
 
 
@@ -440,8 +437,8 @@ if __name__ == "__main__":
 
         # ---- 6.11 - move cells of the final order ----
         # достаем текущие данные {wild : итоговый заказ}
-        fin_order_wilds = sh.col_values(headers.index('Артикул') + 1)
-        fin_order_data = sh.col_values(headers.index('Итоговый заказ') + 1)
+        fin_order_wilds = col_from_values(count_values, headers, 'Артикул', 0)
+        fin_order_data = col_from_values(count_values, headers, 'Итоговый заказ', 0)
         fin_order_dct = {w : o for w, o in zip(fin_order_wilds, fin_order_data)}
 
 
@@ -472,32 +469,36 @@ if __name__ == "__main__":
             }
         }
 
-        for m in metrics:
-            col_num = headers.index(metrics[m]['metric_ru'])
-            col_letter = column_number_to_letter(col_num)
-            metrics[m]['col_num'] = col_num
-            metrics[m]['col_letter'] = col_letter
+        # строки прошлой выгрузки ниже новых данных затираем пустыми значениями (раньше - batch_clear)
+        prev_rows = len(fin_order_wilds) - header_row_num
+        end_row = header_row_num + max(len(data), prev_rows)
+        padding = [['']] * max(prev_rows - len(data), 0)
 
         # выгружаем по столбцам в CHINA_TABLE
         for metric_name, metric_data in metrics.items():
-            try:
-                output_data = [[i[metric_name]] for i in data]
-                end_row = header_row_num + len(output_data)
-                output_range = f'{metric_data["col_letter"]}{header_row_num + 1}:{metric_data["col_letter"]}{end_row}'
-                add_data_to_range(sh, output_data, output_range, clean_range=True)
-                logging.info(f"Successfully added {metric_data['metric_ru']} to the range {output_range}, sheet {CHINA_ORDERS}")
-            except Exception as e:
-                logging.error(f"Failed to add {metric_data['metric_ru']} to the range {output_range}, sheet {CHINA_ORDERS}:\n{e}")
+            col_letter = column_number_to_letter(headers.index(metric_data['metric_ru']))
+            output_data = [[i[metric_name]] for i in data] + padding
+            output_range = f"'{CHINA_COUNT}'!{col_letter}{header_row_num + 1}:{col_letter}{end_row}"
+            output.append({'range': output_range, 'values': output_data})
 
         # --- 6.11 переносим кол-во финального заказа в соответствующие ячейки ---
         output_wilds = [i['local_vendor_code'] for i in data]
-        fin_order_output = [[fin_order_dct.get(i, '')] for i in output_wilds]
+        fin_order_output = [[fin_order_dct.get(i, '')] for i in output_wilds] + padding
         fin_order_col_letter = column_number_to_letter(headers.index('Итоговый заказ'))
-        sh.update(values = fin_order_output, range_name=f"{fin_order_col_letter}{header_row_num + 1}:{fin_order_col_letter}{end_row}")
-        logging.info(f"Successfully added final order to the sheet {CHINA_ORDERS}")
+        output.append({'range': f"'{CHINA_COUNT}'!{fin_order_col_letter}{header_row_num + 1}:{fin_order_col_letter}{end_row}",
+                       'values': fin_order_output})
 
-        sh.update([[f'Актуализировано на {datetime.now().strftime("%d.%m.%Y %H:%M")}']], range_name = 'A2')
+        output.append({'range': f"'{CHINA_COUNT}'!A2",
+                       'values': [[f'Актуализировано на {datetime.now().strftime("%d.%m.%Y %H:%M")}']]})
     
     except Exception as e:
-        logging.error(f"Failed to upload data to the sheet {CHINA_COUNT}:\n{e}")
-        raise
\ No newline at end of file
+        logging.error(f"Failed to prepare data for the sheet {CHINA_COUNT}:\n{e}")
+        raise
+
+    # 5. запись: один values_batch_update
+    try:
+        table.values_batch_update({'valueInputOption': 'RAW', 'data': output})
+        logging.info(f"Successfully uploaded {len(output)} ranges to {CHINA_ORDERS}, {WHITE_ORDERS}, {CHINA_COUNT}")
+    except Exception as e:
+        logging.error(f"Failed to upload data to {CHINA_TABLE}:\n{e}")
+        raise
@@ -0,0 +1,154 @@
+# ---- IMPORTS ----
+
+# making it work for cron
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from datetime import date
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from utils.logger import setup_logger
+from utils.my_gspread import connect_to_remote_sheet
+from utils.my_db_functions import create_connection_w_env, fetch_db_data_into_list
+
+
+# ---- LOGS ----
+logger = setup_logger("commission_schedule_to_db.log")
+
+
+DB_TABLE = 'commission_schedule'
+ANY = '*'   # ставка действует для любого предмета / типа склада
+
+# типы складов, как в orders.warehouse_type
+WAREHOUSE_TYPES = {'FBO': 'Склад WB', 'FBS': 'Склад продавца'}
+
+# исторические границы, которые раньше были зашиты в net_profit_from_orders
+FIRST_DATE = date(2000, 1, 1)               # "Предыдущая комиссия ИУ" - действует с начала истории
+COMMISSION_CHANGE_DATE = date(2025, 7, 1)   # с этой даты комиссия ИУ по типу склада
+COMMON_COMMISSION_DATE = date(2026, 1, 1)   # с этой даты единая комиссия
+COMMON_COMMISSION = 26
+
+
+def create_commission_schedule_table(conn):
+    '''
+    Версионированная таблица комиссий: ставка действует с valid_from до следующей версии
+    того же (subject, warehouse_type). '*' - для любого предмета / типа склада, конкретная ставка важнее '*'.
+    Побеждает более поздняя версия: единая ставка ('*', '*') с 2026-01-01 перекрывает ставки предметов
+    до тех пор, пока ставку предмета не поменяют на листе - тогда действует новая версия с датой синхронизации.
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DB_TABLE} (
+            subject TEXT NOT NULL,
+            warehouse_type TEXT NOT NULL,
+            valid_from DATE NOT NULL,
+            commission NUMERIC(5,2) NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (subject, warehouse_type, valid_from)
+        );
+        """)
+    conn.commit()
+
+
+def load_commissions_sheet():
+    '''
+    Загрузка данных по комиссии с листа "Комиссия с июля" таблицы UNIT
+    '''
+    sh = connect_to_remote_sheet('UNIT 2.0 (tested)', 'Комиссия с июля')
+    sh_values = sh.get_all_values()
+    com = pd.DataFrame(sh_values[1:], columns=sh_values[0])
+    clean_com = com.drop(columns = ['FBO\nКомиссия общая', 'FBS\nКомиссия общая'])
+    clean_com = clean_com.rename(columns={'FBO ИУ\nс июля': 'FBO', 'FBS ИУ\nс июля':'FBS', 'Предыдущая комиссия ИУ': 'BeforeJuly'})
+    clean_com = clean_com.set_index('Наименование предмета')
+    for col in ['FBO', 'FBS', 'BeforeJuly']:
+        clean_com[col] = pd.to_numeric(clean_com[col].str.replace(',', '.'), errors='coerce')
+    return clean_com
+
+
+def sheet_to_rates(com):
+    '''
+    {(subject, warehouse_type): commission} по текущим значениям листа
+    '''
+    rates = {}
+    for subject, row in com.iterrows():
+        if not subject:
+            continue
+        for col, warehouse_type in WAREHOUSE_TYPES.items():
+            if pd.notna(row[col]):
+                rates[(subject, warehouse_type)] = float(row[col])
+    return rates
+
+
+def seed_rows(com):
+    '''
+    Первичное заполнение: история, которая раньше была зашита в коде.
+    '''
+    rows = [(subject, ANY, FIRST_DATE, float(rate)) for subject, rate in com['BeforeJuly'].items() if subject and pd.notna(rate)]
+    rows += [(subject, warehouse_type, COMMISSION_CHANGE_DATE, rate) for (subject, warehouse_type), rate in sheet_to_rates(com).items()]
+    rows.append((ANY, ANY, COMMON_COMMISSION_DATE, COMMON_COMMISSION))
+    return rows
+
+
+def load_current_rates(conn):
+    '''
+    Последняя версия ставки по каждому (subject, warehouse_type) с конкретным типом склада
+    '''
+    rows = fetch_db_data_into_list(f'''
+        SELECT DISTINCT ON (subject, warehouse_type) subject, warehouse_type, commission
+        FROM {DB_TABLE}
+        WHERE subject != '{ANY}' AND warehouse_type != '{ANY}'
+        ORDER BY subject, warehouse_type, valid_from DESC
+    ''', conn=conn)
+    return {(subject, warehouse_type): float(commission) for subject, warehouse_type, commission in rows}
+
+
+def sync_commission_schedule(valid_from = None):
+    '''
+    Переносит правки листа "Комиссия с июля" в БД новыми версиями с датой valid_from (по умолчанию сегодня).
+    Пустая таблица заполняется историей целиком.
+    '''
+    valid_from = valid_from or date.today()
+    com = load_commissions_sheet()
+
+    conn = create_connection_w_env()
+    try:
+        create_commission_schedule_table(conn)
+
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT 1 FROM {DB_TABLE} LIMIT 1")
+            is_empty = cur.fetchone() is None
+
+        if is_empty:
+            rows = seed_rows(com)
+        else:
+            current = load_current_rates(conn)
+            rows = [(subject, warehouse_type, valid_from, rate)
+                    for (subject, warehouse_type), rate in sheet_to_rates(com).items()
+                    if current.get((subject, warehouse_type)) != rate]
+
+        if not rows:
+            logger.info('Изменений комиссий в UNIT не найдено')
+            return
+
+        with conn.cursor() as cur:
+            execute_values(cur, f'''
+                INSERT INTO {DB_TABLE} (subject, warehouse_type, valid_from, commission)
+                VALUES %s
+                ON CONFLICT (subject, warehouse_type, valid_from)
+                DO UPDATE SET commission = EXCLUDED.commission, created_at = NOW()
+            ''', rows)
+        conn.commit()
+        logger.info(f'В {DB_TABLE} добавлено версий комиссий: {len(rows)}')
+
+    except Exception as e:
+        conn.rollback()
+        logger.error(f'Ошибка при синхронизации комиссий: {e}')
+        raise
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sync_commission_schedule()
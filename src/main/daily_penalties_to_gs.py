@@ -11,6 +11,7 @@ from datetime import datetime, timedelta
 
 # my packages
 from utils.my_db_functions import create_connection_w_env
+from utils.my_gspread import init_client
 from utils.utils import get_db_table, update_df_in_google
 
 from pathlib import Path
@@ -129,7 +130,7 @@ if __name__ == "__main__":
     # orders_sheet = wks.worksheet('Штрафы')
     # update_df_in_google(clean_df, orders_sheet)
 
-    gc = gspread.service_account(filename=PRO_CREDS_PATH)
+    gc = init_client(PRO_CREDS_PATH)
     # gc = gspread.service_account(filename=CREDS_PATH)
     wks = gc.open(AUTOPILOT_TABLE_NAME)
     orders_sheet = wks.worksheet('Штрафы')
@@ -2,13 +2,14 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
+from psycopg2.extras import execute_values
 
 # from utils.my_gspread import connect_to_local_sheet
 
-from utils.my_db_functions import get_df_from_db
-from utils.my_gspread import init_client, clean_extra_rows
+from utils.my_db_functions import get_df_from_db, create_connection_w_env, fetch_db_data_into_list
+from utils.my_gspread import init_client, sync_rows_by_key, column_number_to_letter
 from utils.logger import setup_logger
 from utils.my_pandas import format_datetime
 
@@ -80,13 +81,14 @@ SUPPLY_RENAME = {
 }
 
 
-def load_orders_data(months):
+def load_orders_data(months, since = None):
     """
     Загружает данные из БД ordered_goods_from_buyers за последние `months` месяцев.
     Загружает только конкретные колонки для стабильности.
+    При since - только документы, обновлённые с этой даты.
     """
 
-    query = '''
+    query = f'''
         select
         main.id,
         main.guid,
@@ -131,16 +133,20 @@ def load_orders_data(months):
     LEFT JOIN receipts_for_ordered_goods_from_buyers AS receipts
         ON main.id = receipts.ordered_goods_from_buyers_id
     WHERE main.is_valid = TRUE
-    AND main.update_document_datetime >= DATE '2025-05-01';
+    AND main.update_document_datetime >= DATE '2025-05-01'
+    {f"""AND (main.update_document_datetime >= DATE '{since}'
+         OR main.id IN (SELECT ordered_goods_from_buyers_id FROM receipts_for_ordered_goods_from_buyers
+                        WHERE reciept_date >= DATE '{since}'))""" if since else ''};
     '''
     df = get_df_from_db(query)
     return df.fillna('')
 
 
-def load_supply_data(months):
+def load_supply_data(months, since = None):
     """
     Загружает данные из БД supply_to_sellers_warehouse за последние `months` месяцев.
     Загружает только конкретные колонки для стабильности.
+    При since - только документы, обновлённые с этой даты.
     """
     columns = [
         "id", "guid", "document_number", "document_created_at", "supply_date",
@@ -154,14 +160,15 @@ def load_supply_data(months):
     SELECT {cols_str}
     FROM public.supply_to_sellers_warehouse
     WHERE is_valid = TRUE
-      AND update_document_datetime >= '2025-05-01' -- NOW() - INTERVAL '{months} months';
+      AND update_document_datetime >= '2025-05-01' -- NOW() - INTERVAL '{months} months'
+      {f"AND update_document_datetime >= '{since}'" if since else ''};
     '''
     df = get_df_from_db(query)
     return df.fillna('')
 
-def load_wb_supplies():
-    # Загружает данные для таблицы БД_поставки в Расчет Закупки
-    query = '''
+def load_wb_supplies(since = None):
+    # Загружает данные для таблицы БД_поставки в Расчет Закупки (при since - только изменённые с этой даты поставки)
+    query = f'''
         SELECT DISTINCT ON (wsg.id, wsg.vendor_code)
                     wsg.id AS "Номер поставки",
                     ws.supply_date AS "Плановая дата поставки",
@@ -181,106 +188,194 @@ def load_wb_supplies():
                 LEFT JOIN article a
                     USING(nm_id)
                 WHERE ws.create_date >= NOW() - INTERVAL '2 months'
+                {f"""AND wsg.id IN (SELECT id FROM wb_supplies WHERE updated_date >= '{since}'
+                                    UNION SELECT id FROM wb_supplies_goods WHERE created_at >= '{since}')""" if since else ''}
                 ORDER BY wsg.id, wsg.vendor_code, ws.updated_date DESC, wsg.created_at DESC;
         '''
     return get_df_from_db(query)
 
 
+REGION_DIM_TABLE = 'region_dim'
+REGION_AGG_TABLE = 'orders_by_region_daily'
+REGION_REPORT_DAYS = 14     # сколько дней выгружается на лист Заказы_Регионы
+REGION_REFRESH_DAYS = 3     # сколько последних дней агрегата пересчитывается (заказы приходят с задержкой)
+OTHER_REGION = 'Другие'
+
+# округ / страна --> регионы: начальное заполнение region_dim. Дальше справочник ведётся в БД -
+# правки в таблице не перезаписываются, новые регионы добавляются туда же
+REGION_DISTRICTS_SEED = {
+    'Центральный': [
+        'Москва','Московская область','Белгородская область','Брянская область','Владимирская область','Воронежская область',
+        'Ивановская область','Калужская область','Костромская область','Курская область','Липецкая область','Орловская область',
+        'Рязанская область','Смоленская область','Тамбовская область','Тверская область','Тульская область','Ярославская область'
+    ],
+    'Северо-Западный': [
+        'Санкт-Петербург','Ленинградская область','Архангельская область','Вологодская область','Калининградская область',
+        'Мурманская область','Новгородская область','Псковская область','Республика Карелия','Республика Коми',
+        'Ненецкий автономный округ'
+    ],
+    'Южный + Северо-Кавказский': [
+        'Краснодарский край','Астраханская область','Волгоградская область','Ростовская область','Республика Крым',
+        'г. Севастополь','Севастополь','Республика Адыгея','Республика Калмыкия','Республика Дагестан','Республика Ингушетия',
+        'Кабардино-Балкарская Республика','Карачаево-Черкесская Республика','Республика Северная Осетия-Алания',
+        'Республика Северная Осетия — Алания','Чеченская Республика','Ставропольский край','федеральная территория Сириус'
+    ],
+    'Приволжский': [
+        'Нижегородская область','Республика Башкортостан','Кировская область','Республика Марий Эл','Республика Мордовия',
+        'Оренбургская область','Пензенская область','Пермский край','Самарская область','Саратовская область',
+        'Республика Татарстан','Удмуртская Республика','Ульяновская область','Чувашская Республика'
+    ],
+    'Уральский': [
+        'Свердловская область','Тюменская область','Челябинская область','Ханты-Мансийский автономный округ',
+        'Ямало-Ненецкий автономный округ','Курганская область'
+    ],
+    'Дальневосточный + Сибирский': [
+        'Новосибирская область','Иркутская область','Кемеровская область','Красноярский край','Омская область',
+        'Томская область','Республика Алтай','Алтайский край','Республика Бурятия','Республика Тыва','Республика Хакасия',
+        'Забайкальский край','Приморский край','Хабаровский край','Амурская область','Камчатский край','Магаданская область',
+        'Сахалинская область','Еврейская автономная область','Чукотский автономный округ','Республика Саха (Якутия)'
+    ],
+    'Беларусь': [
+        'Гомельская область','Минская область','Брестская область','Витебская область','Гродненская область',
+        'Могилевская область','Могилёвская область','г. Минск','Минск'
+    ],
+    'Казахстан': [
+        'Астана','город республиканского значения Астана','Алматы','Шымкент','Акмолинская область','Актюбинская область',
+        'Алматинская область','Атырауская область','Восточно-Казахстанская область','Жамбылская область',
+        'Западно-Казахстанская область','Карагандинская область','Костанайская область','Кызылординская область',
+        'Мангистауская область','Павлодарская область','Северо-Казахстанская область','Туркестанская область',
+        'область Жетысу','область Абай'
+    ],
+    'Грузия': [
+        'Тбилиси','Аджария','Гурия','Имеретия','Кахетия','Мцхета-Мтианети','Рача-Лечхуми и Квемо-Сванети',
+        'Самегрело-Верхняя Сванетия','Самцхе-Джавахети','Квемо-Картли','Шида-Картли'
+    ],
+    'Армения': [
+        'Ереван','Арагацотн','Арагацотнская область','Арарат','Араратская область','Армавир','Гехаркуник',
+        'Гехаркуникская область','Котайк','Котайкская область','Лори','Лорийская область','Ширак','Ширакская область',
+        'Сюник','Сюникская область','Тавуш','Тавушская область','Вайоц-Дзор'
+    ],
+    'Киргизия': [
+        'Бишкек','город республиканского подчинения Бишкек','Ош','Баткенская область','Джалал-Абадская область',
+        'Иссык-Кульская область','Нарынская область','Ошская область','Таласская область','Чуйская область'
+    ],
+    'Таджикистан': [
+        'Душанбе','Горно-Бадахшанская автономная область','Согдийская область','Хатлонская область',
+        'Районы республиканского подчинения'
+    ],
+    'Узбекистан': [
+        'Ташкент','Андижанская область','Бухарская область','Джизакская область','Кашкадарьинская область',
+        'Навоийская область','Наманганская область','Самаркандская область','Сурхандарьинская область',
+        'Сырдарьинская область','Ташкентская область','Ферганская область','Хорезмская область',
+        'Республика Каракалпакстан'
+    ],
+    'Турция': ['Стамбул'],
+}
+
+RUSSIAN_DISTRICTS = {'Центральный', 'Северо-Западный', 'Южный + Северо-Кавказский', 'Приволжский',
+                     'Уральский', 'Дальневосточный + Сибирский'}
+
+
+def seed_region_dim(cur):
+    '''
+    Заполняет region_dim из REGION_DISTRICTS_SEED; существующие строки не трогает
+    '''
+    rows = [(region, district, 'Россия' if district in RUSSIAN_DISTRICTS else 'Зарубежье')
+            for district, regions in REGION_DISTRICTS_SEED.items() for region in regions]
+    execute_values(cur, f"""
+        INSERT INTO {REGION_DIM_TABLE} (region_name, district, macro_region)
+        VALUES %s
+        ON CONFLICT (region_name) DO NOTHING
+    """, rows)
+    logger.info(f'{REGION_DIM_TABLE}: начальное заполнение, добавлено регионов: {cur.rowcount}')
+
+
+def sync_region_dim(conn):
+    '''
+    Создаёт справочник region_dim (регион --> округ и макрорегион) и агрегат заказов по регионам.
+    Справочник заполняется из REGION_DISTRICTS_SEED только пока он пуст - источник правды region_dim в БД.
+    Коммит делает вызывающая сторона.
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {REGION_DIM_TABLE} (
+            region_name TEXT PRIMARY KEY,
+            district TEXT NOT NULL,
+            macro_region TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS {REGION_AGG_TABLE} (
+            date DATE NOT NULL,
+            article_id BIGINT NOT NULL,
+            district TEXT NOT NULL,
+            orders_count INTEGER NOT NULL,
+            PRIMARY KEY (date, article_id, district)
+        );
+        CREATE INDEX IF NOT EXISTS {REGION_AGG_TABLE}_article_date_idx ON {REGION_AGG_TABLE} (article_id, date DESC);
+        """)
+        cur.execute(f"SELECT EXISTS (SELECT 1 FROM {REGION_DIM_TABLE})")
+        if not cur.fetchone()[0]:
+            seed_region_dim(cur)
+
+
+def refresh_orders_by_regions(conn = None):
+    '''
+    Инкрементально пересчитывает агрегат orders_by_region_daily: последние REGION_REFRESH_DAYS дней
+    от последней даты агрегата (или REGION_REPORT_DAYS дней, если агрегат пуст).
+    Пересчитываемые дни удаляются и вставляются заново в одной транзакции.
+    '''
+    own_conn = conn is None
+    if own_conn:
+        conn = create_connection_w_env()
+    try:
+        sync_region_dim(conn)
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT CASE
+                    WHEN MAX(date) IS NULL THEN CURRENT_DATE - {REGION_REPORT_DAYS}
+                    ELSE LEAST(MAX(date), CURRENT_DATE) - {REGION_REFRESH_DAYS}
+                END
+                FROM {REGION_AGG_TABLE}
+            """)
+            refresh_from = cur.fetchone()[0]
+
+            cur.execute(f"DELETE FROM {REGION_AGG_TABLE} WHERE date >= %s", (refresh_from,))
+            cur.execute(f"""
+                INSERT INTO {REGION_AGG_TABLE} (date, article_id, district, orders_count)
+                SELECT
+                    o.date,
+                    o.article_id,
+                    COALESCE(r.district, '{OTHER_REGION}') AS district,
+                    COUNT(o.is_realization) AS orders_count
+                FROM orders o
+                LEFT JOIN {REGION_DIM_TABLE} r
+                    ON r.region_name = o.region_name
+                WHERE o.date >= %s
+                GROUP BY o.date, o.article_id, COALESCE(r.district, '{OTHER_REGION}')
+            """, (refresh_from,))
+            logger.info(f'{REGION_AGG_TABLE}: пересчитаны дни с {refresh_from}, строк: {cur.rowcount}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+
 def load_orders_by_regions(logger = logger):
+    '''
+    Заказы по округам за последние REGION_REPORT_DAYS дней из предагрегированной таблицы
+    '''
+    refresh_orders_by_regions()
 
-    # query = '''
-    # SELECT
-    #     date as "Дата",
-    #     article_id as "Артикул",
-    #     region_name as "Регион",
-    #     COUNT(is_realization) as "Количество заказов"
-    # FROM orders o
-    # WHERE "date" >= CURRENT_DATE - 10
-    # GROUP BY date,
-    #     article_id,
-    #     region_name
-    # ORDER BY
-    #     article_id,
-    #     date DESC;
-    # '''
-
-    query = '''
+    query = f'''
     SELECT
         date AS "Дата",
         article_id AS "Артикул",
-        CASE
-            WHEN region_name IN (
-                'Москва','Московская область','Белгородская область','Брянская область','Владимирская область','Воронежская область',
-                'Ивановская область','Калужская область','Костромская область','Курская область','Липецкая область','Орловская область',
-                'Рязанская область','Смоленская область','Тамбовская область','Тверская область','Тульская область','Ярославская область'
-            ) THEN 'Центральный'
-            WHEN region_name IN (
-                'Санкт-Петербург','Ленинградская область','Архангельская область','Вологодская область','Калининградская область',
-                'Мурманская область','Новгородская область','Псковская область','Республика Карелия','Республика Коми',
-                'Ненецкий автономный округ'
-            ) THEN 'Северо-Западный'
-            WHEN region_name IN (
-                'Краснодарский край','Астраханская область','Волгоградская область','Ростовская область','Республика Крым',
-                'г. Севастополь','Севастополь','Республика Адыгея','Республика Калмыкия','Республика Дагестан','Республика Ингушетия',
-                'Кабардино-Балкарская Республика','Карачаево-Черкесская Республика','Республика Северная Осетия-Алания',
-                'Республика Северная Осетия — Алания','Чеченская Республика','Ставропольский край','федеральная территория Сириус'
-            ) THEN 'Южный + Северо-Кавказский'
-            WHEN region_name IN (
-                'Нижегородская область','Республика Башкортостан','Кировская область','Республика Марий Эл','Республика Мордовия',
-                'Оренбургская область','Пензенская область','Пермский край','Самарская область','Саратовская область',
-                'Республика Татарстан','Удмуртская Республика','Ульяновская область','Чувашская Республика'
-            ) THEN 'Приволжский'
-            WHEN region_name IN (
-                'Свердловская область','Тюменская область','Челябинская область','Ханты-Мансийский автономный округ',
-                'Ямало-Ненецкий автономный округ','Курганская область'
-            ) THEN 'Уральский'
-            WHEN region_name IN (
-                'Новосибирская область','Иркутская область','Кемеровская область','Красноярский край','Омская область',
-                'Томская область','Республика Алтай','Алтайский край','Республика Бурятия','Республика Тыва','Республика Хакасия',
-                'Забайкальский край','Приморский край','Хабаровский край','Амурская область','Камчатский край','Магаданская область',
-                'Сахалинская область','Еврейская автономная область','Чукотский автономный округ','Республика Саха (Якутия)'
-            ) THEN 'Дальневосточный + Сибирский'
-            WHEN region_name IN (
-                'Гомельская область','Минская область','Брестская область','Витебская область','Гродненская область',
-                'Могилевская область','Могилёвская область','г. Минск','Минск'
-            ) THEN 'Беларусь'
-            WHEN region_name IN (
-                'Астана','город республиканского значения Астана','Алматы','Шымкент','Акмолинская область','Актюбинская область',
-                'Алматинская область','Атырауская область','Восточно-Казахстанская область','Жамбылская область',
-                'Западно-Казахстанская область','Карагандинская область','Костанайская область','Кызылординская область',
-                'Мангистауская область','Павлодарская область','Северо-Казахстанская область','Туркестанская область',
-                'область Жетысу','область Абай'
-            ) THEN 'Казахстан'
-            WHEN region_name IN (
-                'Тбилиси','Аджария','Гурия','Имеретия','Кахетия','Мцхета-Мтианети','Рача-Лечхуми и Квемо-Сванети',
-                'Самегрело-Верхняя Сванетия','Самцхе-Джавахети','Квемо-Картли','Шида-Картли'
-            ) THEN 'Грузия'
-            WHEN region_name IN (
-                'Ереван','Арагацотн','Арагацотнская область','Арарат','Араратская область','Армавир','Гехаркуник',
-                'Гехаркуникская область','Котайк','Котайкская область','Лори','Лорийская область','Ширак','Ширакская область',
-                'Сюник','Сюникская область','Тавуш','Тавушская область','Вайоц-Дзор'
-            ) THEN 'Армения'
-            WHEN region_name IN (
-                'Бишкек','город республиканского подчинения Бишкек','Ош','Баткенская область','Джалал-Абадская область',
-                'Иссык-Кульская область','Нарынская область','Ошская область','Таласская область','Чуйская область'
-            ) THEN 'Киргизия'
-            WHEN region_name IN (
-                'Душанбе','Горно-Бадахшанская автономная область','Согдийская область','Хатлонская область',
-                'Районы республиканского подчинения'
-            ) THEN 'Таджикистан'
-            WHEN region_name IN (
-                'Ташкент','Андижанская область','Бухарская область','Джизакская область','Кашкадарьинская область',
-                'Навоийская область','Наманганская область','Самаркандская область','Сурхандарьинская область',
-                'Сырдарьинская область','Ташкентская область','Ферганская область','Хорезмская область',
-                'Республика Каракалпакстан'
-            ) THEN 'Узбекистан'
-            WHEN region_name = 'Стамбул' THEN 'Турция'
-            ELSE 'Другие'
-        END AS "Регион",
-        COUNT(is_realization) AS "Количество заказов"
-    FROM orders o
-    WHERE date >= CURRENT_DATE - 14
-    GROUP BY date, article_id, "Регион"
+        district AS "Регион",
+        orders_count AS "Количество заказов"
+    FROM {REGION_AGG_TABLE}
+    WHERE date >= CURRENT_DATE - {REGION_REPORT_DAYS}
     ORDER BY article_id, date desc;
     '''
     
@@ -303,91 +398,157 @@ def update_orders_by_regions(client, logger = logger):
     logger.info('Данные успешно добавлены на лист Заказы_Регионы')
 
 
+SYNC_STATE_TABLE = 'gs_sync_state'
+SYNC_LOOKBACK_DAYS = 3      # изменённые за эти дни до прошлой выгрузки строки перезаписываются
+
+WB_SUPPLY_STATUSES = {
+    1: "Не запланировано",
+    2: "Запланировано",
+    3: "Отгрузка разрешена",
+    4: "Идёт приёмка",
+    5: "Принято",
+    6: "Отгружено на воротах",
+}
+
+# все ключи (первая колонка листа), которые должны быть на листе: всё остальное удаляется
+EXPORT_KEY_QUERIES = {
+    'Заказы_поставщиков_1С': '''
+        SELECT DISTINCT id FROM ordered_goods_from_buyers
+        WHERE is_valid = TRUE AND update_document_datetime >= DATE '2025-05-01'
+    ''',
+    'Приходы_1С': '''
+        SELECT DISTINCT id FROM public.supply_to_sellers_warehouse
+        WHERE is_valid = TRUE AND update_document_datetime >= '2025-05-01'
+    ''',
+    'БД_поставки': '''
+        SELECT DISTINCT wsg.id FROM wb_supplies_goods wsg
+        LEFT JOIN wb_supplies ws ON wsg.id = ws.id
+        WHERE ws.create_date >= NOW() - INTERVAL '2 months'
+    ''',
+}
+
+
+def format_date_cols(df, cols):
+    for col in cols:
+        if col in df.columns:
+            df[col] = df[col].replace(['0', '00.00.0000', 0, ''], pd.NA)
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[col] = df[col].dt.strftime('%d.%m.%Y')
+            df[col] = df[col].fillna('')
+    return df
+
+
+def prepare_orders(since = None, months = None):
+    orders_db = load_orders_data(months = months, since = since)
+    orders_db = format_date_cols(orders_db, ['document_created_at', 'supply_date', 'update_document_datetime',
+                                             'created_at', 'expected_receipt_date', 'shipment_date', 'receipt_date'])
+    return orders_db.rename(columns=ORDERS_RENAME)
+
+
+def prepare_supply(since = None, months = None):
+    supply_db = load_supply_data(months = months, since = since)
+    supply_db = format_date_cols(supply_db, ['document_created_at', 'supply_date', 'update_document_datetime'])
+    return supply_db.rename(columns=SUPPLY_RENAME)
+
+
+def prepare_wb_supplies(since = None):
+    wb_supplies = load_wb_supplies(since = since)
+    wb_supplies['Статус'] = wb_supplies['Статус'].map(WB_SUPPLY_STATUSES)
+    return format_date_cols(wb_supplies, ["Плановая дата поставки", "Фактическая дата поставки"])
+
+
+def load_sync_state(conn):
+    '''
+    {лист: дата последней успешной выгрузки}
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SYNC_STATE_TABLE} (
+            target TEXT PRIMARY KEY,
+            watermark DATE NOT NULL,
+            synced_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+        cur.execute(f"SELECT target, watermark FROM {SYNC_STATE_TABLE}")
+        state = dict(cur.fetchall())
+    conn.commit()
+    return state
+
+
+def save_sync_state(conn, target, watermark):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {SYNC_STATE_TABLE} (target, watermark) VALUES (%s, %s)
+            ON CONFLICT (target) DO UPDATE SET watermark = EXCLUDED.watermark, synced_at = NOW()
+        """, (target, watermark))
+    conn.commit()
+
+
+def sync_sheet(gs_table, sheet_name, prepare_func, conn, watermark = None, full = False):
+    '''
+    Выгрузка на лист sheet_name таблицы gs_table (заголовки в строке 2, данные с 3-й).
+    Если есть watermark (дата прошлой выгрузки) и заголовки листа совпадают - дописываются только строки,
+    изменённые с watermark - SYNC_LOOKBACK_DAYS, их старые версии и ключи вне окна удаляются одним запросом.
+    Иначе (или при full=True) - полная перезаливка, как раньше.
+    Возвращает дату выгрузки для сохранения в gs_sync_state.
+    '''
+    run_date = datetime.now().date()
+    sh = gs_table.worksheet(sheet_name)
+
+    if watermark and not full:
+        since = watermark - timedelta(days=SYNC_LOOKBACK_DAYS)
+        df = prepare_func(since = since)
+        if sh.row_values(2) == [str(c) for c in df.columns]:
+            valid_keys = [row[0] for row in fetch_db_data_into_list(EXPORT_KEY_QUERIES[sheet_name], conn=conn)]
+            sync_rows_by_key(sh, df.values.tolist(), key_col_num=1, valid_keys=valid_keys, changed_keys=df.iloc[:, 0].tolist())
+            full = False
+        else:
+            logger.warning(f'{sheet_name}: заголовки листа не совпадают с выгрузкой, полная перезаливка')
+            full = True
+    else:
+        full = True
+
+    if full:
+        df = prepare_func()
+        output = [df.columns.tolist()] + df.values.tolist()
+        sh.update(values = output, range_name = 'A2')
+        # строка 1 - дата обновления, данные занимают строки 2..len(output)+1
+        if sh.row_count > len(output) + 1:
+            sh.batch_clear([f"A{len(output) + 2}:{column_number_to_letter(len(df.columns) - 1)}{sh.row_count}"])
+
+    sh.update(
+        values=[[f"Обновлено {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"]],
+        range_name='A1'
+    )
+    logger.info(f'Данные успешно добавлены на лист "{sheet_name}" ({"полная выгрузка" if full else "инкрементально"}, строк: {len(df)})')
+    return run_date
+
+
 if __name__ == "__main__":
-    
-    try:
-        months = None
-        client = init_client()
-        gs_table = client.open(LOCAL_TABLE)
-
-        orders_db = load_orders_data(months = months)
-
-        datetime_cols = ['document_created_at', 'supply_date', 'update_document_datetime',
-                 'created_at', 'expected_receipt_date', 'shipment_date', 'receipt_date']
-
-        for col in datetime_cols:
-            if col in orders_db.columns:
-                orders_db[col] = orders_db[col].replace(['0', '00.00.0000', 0, ''], pd.NA)
-                orders_db[col] = pd.to_datetime(orders_db[col], errors='coerce')
-                orders_db[col] = orders_db[col].dt.strftime('%d.%m.%Y')
-                orders_db[col] = orders_db[col].fillna('')
-
-        orders_renamed = orders_db.rename(columns=ORDERS_RENAME)
-
-        orders_output = [orders_renamed.columns.tolist()] + orders_renamed.values.tolist()
-        orders_sh = gs_table.worksheet('Заказы_поставщиков_1С')
-        orders_sh.update(values = orders_output, range_name = 'A2')
-        orders_sh.update(
-            values=[[f"Обновлено {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"]],
-            range_name='A1'
-        )
-        logger.info('Данные успешно добавлены на лист "Заказы_поставщиков_1С"')
-    except Exception as e:
-        logger.error(f'Ошибка при обновлении листа "Заказы_поставщиков_1С": {e}')
 
-    try:
-        supply_db = load_supply_data(months = months)
-
-        datetime_cols = ['document_created_at', 'supply_date', 'update_document_datetime']
-
-        for col in datetime_cols:
-            if col in supply_db.columns:
-                supply_db[col] = supply_db[col].replace(['0', '00.00.0000', 0, ''], pd.NA)
-                supply_db[col] = pd.to_datetime(supply_db[col], errors='coerce')
-                supply_db[col] = supply_db[col].dt.strftime('%d.%m.%Y')
-                supply_db[col] = supply_db[col].fillna('')
-
-        supply_renamed = supply_db.rename(columns=SUPPLY_RENAME)
-        supply_output = [supply_renamed.columns.tolist()] + supply_renamed.values.tolist()
-        supply_sh = gs_table.worksheet('Приходы_1С')
-        supply_sh.update(values = supply_output, range_name = 'A2')
-        supply_sh.update(
-            values=[[f"Обновлено {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"]],
-            range_name='A1'
-        )
-        logger.info('Данные успешно добавлены на лист "Приходы_1С"')
-
-    except Exception as e:
-        logger.error(f'Ошибка при обновлении листа "Приходы_1С": {e}')
-    
-    try:
-        wb_supplies = load_wb_supplies()
-        wb_supplies['Статус'] = wb_supplies['Статус'].map({
-            1: "Не запланировано",
-            2: "Запланировано",
-            3: "Отгрузка разрешена",
-            4: "Идёт приёмка",
-            5: "Принято",
-            6: "Отгружено на воротах",
-        })
-
-        for col in ["Плановая дата поставки", "Фактическая дата поставки"]:
-            if col in wb_supplies.columns:
-                wb_supplies[col] = wb_supplies[col].replace(['0', '00.00.0000', 0, ''], pd.NA)
-                wb_supplies[col] = pd.to_datetime(wb_supplies[col], errors='coerce')
-                wb_supplies[col] = wb_supplies[col].dt.strftime('%d.%m.%Y')
-                wb_supplies[col] = wb_supplies[col].fillna('')
-
-        wb_output = [wb_supplies.columns.tolist()] + wb_supplies.values.tolist()
-        wb_supplies_sh = gs_table.worksheet('БД_поставки')
-        wb_supplies_sh.update(values = wb_output, range_name = 'A2')
-        wb_supplies_sh.update(
-            values=[[f"Обновлено {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"]],
-            range_name='A1'
-        )
-        logger.info('Данные успешно добавлены на лист "БД_поставки"')
-
-        clean_extra_rows(wb_supplies_sh, wb_output, logger = logger)
-
-    except Exception as e:
-        logger.error(f'Failed to upload data to БД_поставки: {e}')
\ No newline at end of file
+    # python db_data_to_purch_gs.py full - принудительная полная перезаливка листов
+    full = 'full' in sys.argv[1:]
+
+    client = init_client()
+    gs_table = client.open(LOCAL_TABLE)
+    conn = create_connection_w_env()
+    state = load_sync_state(conn)
+    failed = []
+
+    for sheet_name, prepare_func in [
+        ('Заказы_поставщиков_1С', prepare_orders),
+        ('Приходы_1С', prepare_supply),
+        ('БД_поставки', prepare_wb_supplies),
+    ]:
+        target = f'{LOCAL_TABLE}/{sheet_name}'
+        try:
+            run_date = sync_sheet(gs_table, sheet_name, prepare_func, conn, watermark = state.get(target), full = full)
+            save_sync_state(conn, target, run_date)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f'Ошибка при обновлении листа "{sheet_name}": {e}')
+            failed.append(sheet_name)
+
+    conn.close()
+    if failed:
+        sys.exit(f"Не обновлены листы: {', '.join(failed)}")
@@ -12,11 +12,72 @@ from datetime import datetime, timedelta, time
 from utils.my_general import to_iso_z, clean_datetime_from_timezone, save_json
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
+from utils.my_api import get_rate_limiter, wb_url
 from psycopg2.extras import execute_values
 from utils.my_db_functions import create_connection_w_env
 
 logger = setup_logger("deductions_to_db.log")
 
+MEASUREMENTS_URL = wb_url('analytics', "/api/v1/analytics/warehouse-measurements")
+DEDUCTIONS_URL = wb_url('analytics', "/api/analytics/v1/deductions")
+
+# каденс квот на один кабинет (сек. между запросами)
+MEASUREMENTS_INTERVAL = 12
+DEDUCTIONS_INTERVAL = 65
+MAX_RETRIES = 5     # подряд идущих 429 на одну страницу
+
+BACKFILL_TABLE = 'deductions_backfill_progress'
+BACKFILL_WINDOW_DAYS = 31
+BACKFILL_REPORTS = ("penalty", "measurement", "replacements")
+
+PENALTIES_COLS = {
+    "nmId": "nm_id",
+    "subject": "subject",
+    "dimId": "dim_id",
+    "prcOver": "prc_over",
+    "volume": "volume",
+    "width": "width",
+    "length": "length",
+    "height": "height",
+    "volumeSup": "volume_sup",
+    "widthSup": "width_sup",
+    "lengthSup": "length_sup",
+    "heightSup": "height_sup",
+    "photoUrls": "photo_urls",
+    "dtBonus": "dt_bonus",
+    "isValid": "is_valid",
+    "isValidDt": "is_valid_dt",
+    "reversalAmount": "reversal_amount",
+    "penaltyAmount": "penalty_amount"
+}
+
+MEASURES_COLS = {
+    "nmId": "nm_id",
+    "subject": "subject",
+    "dimId": "dim_id",
+    "prcOver": "prc_over",
+    "volume": "volume",
+    "width": "width",
+    "length": "length",
+    "height": "height",
+    "volumeSup": "volume_sup",
+    "widthSup": "width_sup",
+    "lengthSup": "length_sup",
+    "heightSup": "height_sup",
+    "photoUrls": "photo_urls",
+    "dt": "dt",
+    "dateStart": "date_start",
+    "dateEnd": "date_end"
+}
+
+# естественные ключи строк отчетов: повторная выгрузка тех же дней (backfill с другим date_from,
+# backfill поверх ежедневной выгрузки) не создает дублей - вставка идет с ON CONFLICT DO NOTHING
+NATURAL_KEYS = {
+    'deductions_warehouse_penalties': ('nm_id', 'dim_id', 'dt_bonus'),
+    'deductions_measurements': ('nm_id', 'dim_id'),
+    'deductions_replacements': ('account', 'nm_id', 'old_shk_id', 'new_shk_id', 'dt_bonus', 'bonus_type'),
+}
+
 def to_iso(d):
     if isinstance(d, datetime):
         return d.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -37,7 +98,7 @@ def get_wb_measurements(token,
     if tab not in ("penalty", "measurement"):
         raise ValueError(f"Параметр tab должен быть одним из двух - 'penalty' или 'measurement', передано {tab}")
     
-    url = "https://seller-analytics-api.wildberries.ru/api/v1/analytics/warehouse-measurements"
+    url = MEASUREMENTS_URL
     headers = {"Authorization": token}
     params = {
         "dateFrom": to_iso(date_from),
@@ -67,7 +128,7 @@ def get_wb_measurements(token,
     return all_reports
 
 
-def insert_records(table_name, records, column_mapping, conn):
+def insert_records(table_name, records, column_mapping, conn, commit=True):
     """
     Generic insert function for PostgreSQL with rollback on error.
     
@@ -75,6 +136,7 @@ def insert_records(table_name, records, column_mapping, conn):
     :param records: list of dicts
     :param column_mapping: dict, {source_key: db_column_name}
     :param conn: psycopg2 connection
+    :param commit: bool, commit right away (False - the caller commits, e.g. together with progress)
     """
     if not records:
         return
@@ -94,12 +156,14 @@ def insert_records(table_name, records, column_mapping, conn):
     query = f"""
         INSERT INTO {table_name} ({", ".join(db_columns)})
         VALUES %s
+        ON CONFLICT DO NOTHING
     """
 
     try:
         with conn.cursor() as cur:
             execute_values(cur, query, values)
-        conn.commit()
+        if commit:
+            conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
@@ -116,32 +180,11 @@ async def process_measurements_client(client: str, token: str, conn, date_from,
         if not penalties:
             logger.info(f"Нет данных за период {date_from}-{date_to}: Отчет - 'Удержания за занижение габаритов упаковки', Кабинет - {client}")
         else:
-            penalties_cols = {
-                "nmId": "nm_id",
-                "subject": "subject",
-                "dimId": "dim_id",
-                "prcOver": "prc_over",
-                "volume": "volume",
-                "width": "width",
-                "length": "length",
-                "height": "height",
-                "volumeSup": "volume_sup",
-                "widthSup": "width_sup",
-                "lengthSup": "length_sup",
-                "heightSup": "height_sup",
-                "photoUrls": "photo_urls",
-                "dtBonus": "dt_bonus",
-                "isValid": "is_valid",
-                "isValidDt": "is_valid_dt",
-                "reversalAmount": "reversal_amount",
-                "penaltyAmount": "penalty_amount"
-            }
-
             await asyncio.to_thread(
                 insert_records,
                 'deductions_warehouse_penalties',
                 penalties,
-                penalties_cols,
+                PENALTIES_COLS,
                 conn
             )
             logger.info(f"Получены данные за период {date_from}-{date_to}, Внесено строк в БД: {len(penalties)}: Отчет - 'Удержания за занижение габаритов упаковки', Кабинет - {client}")
@@ -158,33 +201,14 @@ async def process_measurements_client(client: str, token: str, conn, date_from,
         if not measures:
             logger.info(f"Нет данных за период {date_from}-{date_to}: Отчет - 'Замеры склада', Кабинет - {client}")
         else:
-            measures_cols = {
-                "nmId": "nm_id",
-                "subject": "subject",
-                "dimId": "dim_id",
-                "prcOver": "prc_over",
-                "volume": "volume",
-                "width": "width",
-                "length": "length",
-                "height": "height",
-                "volumeSup": "volume_sup",
-                "widthSup": "width_sup",
-                "lengthSup": "length_sup",
-                "heightSup": "height_sup",
-                "photoUrls": "photo_urls",
-                "dt": "dt",
-                "dateStart": "date_start",
-                "dateEnd": "date_end"
-            }
-
             await asyncio.to_thread(
                 insert_records,
                 'deductions_measurements',
                 measures,
-                measures_cols,
+                MEASURES_COLS,
                 conn
             )
-            logger.info(f"Получены данные за период {date_from}-{date_to}, Внесено строк в БД: {len(penalties)}: Отчет - 'Замеры склада', Кабинет - {client}")
+            logger.info(f"Получены данные за период {date_from}-{date_to}, Внесено строк в БД: {len(measures)}: Отчет - 'Замеры склада', Кабинет - {client}")
 
     except Exception as e:
         logger.error(f'Encountered an unexpected error while uploading data for client {client}: {e}')
@@ -196,7 +220,7 @@ async def get_deductions_replacements(api_key, date_from, date_to, limit=1000):
     offset = 0
     all_reports = []
 
-    url = "https://seller-analytics-api.wildberries.ru/api/analytics/v1/deductions"
+    url = DEDUCTIONS_URL
 
     date_from = to_iso_z(date_from, t = time(0, 0, 0))
     date_to = to_iso_z(date_to, t = time(23, 59, 59))
@@ -230,12 +254,13 @@ async def get_deductions_replacements(api_key, date_from, date_to, limit=1000):
     return all_reports
 
 
-def insert_deductions_replacements(conn, data, client):
+def insert_deductions_replacements(conn, data, client, commit=True):
     """
     Insert a list of deduction reports into PostgreSQL.
     
     :param conn: psycopg2 connection
     :param data: list of dicts with deduction data
+    :param commit: bool, commit right away (False - the caller commits)
     """
     if not data:
         return
@@ -285,11 +310,13 @@ def insert_deductions_replacements(conn, data, client):
     query = f"""
         INSERT INTO deductions_replacements ({', '.join(columns)})
         VALUES %s
+        ON CONFLICT DO NOTHING
     """
 
     with conn.cursor() as cur:
         execute_values(cur, query, values)
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 
@@ -329,6 +356,213 @@ def first_insert_all_deductions_replacements():
     conn.close()
 
 
+# -------------------------------- BACKFILL --------------------------------
+
+def ensure_natural_keys(conn):
+    """
+    Creates unique indexes on NATURAL_KEYS. Duplicates loaded before the index existed
+    are removed once, right before the index is created.
+    """
+    with conn.cursor() as cur:
+        for table, key in NATURAL_KEYS.items():
+            index = f"{table}_natural_key_idx"
+            cur.execute("SELECT to_regclass(%s)", (index,))
+            if cur.fetchone()[0] is not None:
+                continue
+            cur.execute(f"""
+                DELETE FROM {table} a USING {table} b
+                WHERE a.ctid > b.ctid AND {' AND '.join(f'a.{col} = b.{col}' for col in key)}
+            """)
+            logger.info(f"{table}: удалено дублей перед созданием уникального индекса: {cur.rowcount}")
+            cur.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({', '.join(key)})")
+    conn.commit()
+
+
+def create_backfill_progress_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {BACKFILL_TABLE} (
+            account TEXT NOT NULL,
+            report TEXT NOT NULL,
+            window_start DATE NOT NULL,
+            window_end DATE NOT NULL,
+            next_offset INTEGER NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (account, report, window_start)
+        );
+        """)
+    conn.commit()
+
+
+def load_backfill_progress(conn, account, report):
+    """
+    Returns {window_start: (window_end, next_offset, done)} for one cabinet and report.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT window_start, window_end, next_offset, done FROM {BACKFILL_TABLE} WHERE account = %s AND report = %s",
+            (account, report)
+        )
+        return {row[0]: (row[1], row[2], row[3]) for row in cur.fetchall()}
+
+
+def save_backfill_progress(conn, account, report, window_start, window_end, next_offset, done):
+    """
+    Stores progress without committing - it is committed together with the inserted page.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {BACKFILL_TABLE} (account, report, window_start, window_end, next_offset, done)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (account, report, window_start)
+            DO UPDATE SET window_end = EXCLUDED.window_end,
+                          next_offset = EXCLUDED.next_offset,
+                          done = EXCLUDED.done,
+                          updated_at = NOW()
+        """, (account, report, window_start, window_end, next_offset, done))
+
+
+def backfill_windows(date_from, date_to, days=BACKFILL_WINDOW_DAYS):
+    """
+    Splits [date_from, date_to] into windows of at most `days` days: [(start_date, end_date), ...]
+    """
+    start = date_from.date() if isinstance(date_from, datetime) else date_from
+    end = date_to.date() if isinstance(date_to, datetime) else date_to
+    windows = []
+    while start <= end:
+        window_end = min(start + timedelta(days=days - 1), end)
+        windows.append((start, window_end))
+        start = window_end + timedelta(days=1)
+    return windows
+
+
+async def iter_report_pages(session, token, report, window_start, window_end, offset=0, limit=1000):
+    """
+    Async generator over report pages: yields (next_offset, reports, is_last).
+    Every request waits for the cabinet's quota slot of its endpoint;
+    after MAX_RETRIES 429 responses in a row for the same page the error is raised.
+    """
+    day_start = datetime.combine(window_start, time(0, 0, 0))
+    day_end = datetime.combine(window_end, time(23, 59, 59))
+
+    if report in ("penalty", "measurement"):
+        url = MEASUREMENTS_URL
+        limiter = get_rate_limiter(("warehouse-measurements", token), MEASUREMENTS_INTERVAL)
+        params = {"dateFrom": to_iso(day_start), "dateTo": to_iso(day_end), "tab": report}
+    else:
+        url = DEDUCTIONS_URL
+        limiter = get_rate_limiter(("deductions", token), DEDUCTIONS_INTERVAL)
+        params = {"dateFrom": to_iso_z(day_start, t=time(0, 0, 0)), "dateTo": to_iso_z(day_end, t=time(23, 59, 59))}
+
+    throttled = 0
+    while True:
+        await limiter.wait()
+        async with session.get(url, headers={"Authorization": token},
+                               params={**params, "limit": limit, "offset": offset}) as resp:
+            if resp.status == 429:
+                throttled += 1
+                if throttled >= MAX_RETRIES:
+                    resp.raise_for_status()
+                limiter.penalize(float(resp.headers.get("X-Ratelimit-Retry", limiter.interval)))
+                logger.warning(f"429 Too Many Requests, report {report} - retrying page offset {offset} "
+                               f"(попытка {throttled}/{MAX_RETRIES})")
+                continue
+            resp.raise_for_status()
+            payload = await resp.json()
+        throttled = 0
+
+        reports = (payload.get("data") or {}).get("reports") or []
+        offset += len(reports)
+        is_last = len(reports) < limit
+        yield offset, reports, is_last
+        if is_last:
+            break
+
+
+def insert_report_page(conn, report, client, reports):
+    """
+    Inserts one page of a report without committing.
+    """
+    if report == "penalty":
+        insert_records('deductions_warehouse_penalties', reports, PENALTIES_COLS, conn, commit=False)
+    elif report == "measurement":
+        insert_records('deductions_measurements', reports, MEASURES_COLS, conn, commit=False)
+    else:
+        insert_deductions_replacements(conn, reports, client, commit=False)
+
+
+async def backfill_client_report(client, token, report, date_from, date_to, session):
+    """
+    Backfills one report of one cabinet window by window.
+    Each page is inserted in the same transaction as the saved offset,
+    so an interrupted run continues from the last stored page.
+
+    A window stored with a different end (rerun with another date_to) is first finished
+    with its own end - the saved offset belongs to that query - and the days after it
+    are loaded as a separate window.
+    """
+    conn = create_connection_w_env()
+    try:
+        progress = load_backfill_progress(conn, client, report)
+        windows = backfill_windows(date_from, date_to)
+
+        while windows:
+            window_start, window_end = windows.pop(0)
+            stored_end, offset, done = progress.get(window_start, (window_end, 0, False))
+            if stored_end < window_end:
+                windows.insert(0, (stored_end + timedelta(days=1), window_end))
+            if done:
+                continue
+            window_end = stored_end
+
+            period = f"{window_start}-{window_end}"
+            rows = 0
+            async for next_offset, reports, is_last in iter_report_pages(session, token, report, window_start, window_end, offset):
+                try:
+                    if reports:
+                        insert_report_page(conn, report, client, reports)
+                    save_backfill_progress(conn, client, report, window_start, window_end, next_offset, is_last)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                rows += len(reports)
+
+            logger.info(f"Backfill: отчет {report}, кабинет {client}, период {period} - внесено строк: {rows} (начато с offset {offset})")
+    finally:
+        conn.close()
+
+
+async def run_backfill(date_from, date_to, reports=BACKFILL_REPORTS):
+    """
+    Параллельная дозагрузка отчетов по удержаниям за период.
+    Кабинеты и отчеты обрабатываются одновременно, каждый в своём темпе квоты;
+    прогресс хранится в BACKFILL_TABLE, повторный запуск продолжает с места остановки.
+    Возвращает список прерванных пар (кабинет, отчет).
+    """
+    tokens = load_api_tokens()
+
+    conn = create_connection_w_env()
+    create_backfill_progress_table(conn)
+    ensure_natural_keys(conn)
+    conn.close()
+
+    async with aiohttp.ClientSession() as session:
+        keys = [(client, report) for client in tokens for report in reports]
+        results = await asyncio.gather(
+            *(backfill_client_report(client, tokens[client], report, date_from, date_to, session) for client, report in keys),
+            return_exceptions=True
+        )
+
+    failed = []
+    for (client, report), res in zip(keys, results):
+        if isinstance(res, Exception):
+            logger.error(f"Backfill прерван: отчет {report}, кабинет {client}: {res}. Повторный запуск продолжит с сохранённого места")
+            failed.append((client, report))
+    return failed
+
+
 async def main():
     '''
     Функционал: выгружает три отчета по удержаниям из WB API в БД.
@@ -340,6 +574,7 @@ async def main():
     '''
     tokens = load_api_tokens()
     conn = create_connection_w_env()
+    ensure_natural_keys(conn)
 
     now = datetime.now()
     yesterday = now - timedelta(days=1)
@@ -366,4 +601,10 @@ async def main():
     await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # python deductions_to_db.py backfill 2024-01-01 2025-12-31
+    if len(sys.argv) == 4 and sys.argv[1] == "backfill":
+        failed = asyncio.run(run_backfill(datetime.strptime(sys.argv[2], "%Y-%m-%d"), datetime.strptime(sys.argv[3], "%Y-%m-%d")))
+        if failed:
+            sys.exit(f"Backfill не завершён: {', '.join(f'{client}/{report}' for client, report in failed)}")
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -5,6 +5,7 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 # from utils.env_loader import *
 from dotenv import load_dotenv
 from utils.logger import setup_logger
+from utils.cache import invalidate
 from utils.my_gspread import connect_to_remote_sheet, delete_rows_based_on_values
 
 load_dotenv()
@@ -36,6 +37,7 @@ if __name__ == "__main__":
     logger.info(f"Найдено {len(skus_to_delete)} для удаления: {skus_to_delete}")
 
     # удаление товаров
+    failed = []
     for table in TABLES_LIST:
         try: 
             sh = connect_to_remote_sheet(table["table"], table["spreadsheet"])
@@ -48,3 +50,9 @@ if __name__ == "__main__":
     f"Ошибка при удалении товаров из таблицы {table['table']}: {e}",
     exc_info=True
 )
+            failed.append(table['table'])
+
+    # артикулы удалены из UNIT - сбрасываем кеш артикулов и ЛК
+    invalidate('utils.my_gspread')
+    if failed:
+        sys.exit(f"Не удалось удалить товары из таблиц: {', '.join(failed)}")
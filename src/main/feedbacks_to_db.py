@@ -9,6 +9,7 @@ import json
 from psycopg2.extras import execute_values
 
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_db_functions import create_connection_w_env
 
 
@@ -41,7 +42,7 @@ def get_wb_feedbacks(api_token: str, nm_id: int | None = None, is_answered: bool
         dict: Объединённый JSON с ключом "data" и всеми отзывами.
     """
 
-    url = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks"
+    url = wb_url('feedbacks', "/api/v1/feedbacks")
     headers = {"Authorization": api_token}
     take = 5000
     skip = 0
@@ -115,7 +116,7 @@ def get_wb_feedbacks_batch(
         list: Список отзывов (максимум `take`).
     """
 
-    url = "https://feedbacks-api.wildberries.ru/api/v1/feedbacks"
+    url = wb_url('feedbacks', "/api/v1/feedbacks")
     headers = {"Authorization": api_token}
     
     params = {
@@ -402,4 +403,5 @@ if __name__ == "__main__":
         update_weekly_feedbacks()
         logging.info("=== Успешно завершено ===")
     except Exception as e:
-        logging.error(f"Критическая ошибка при обновлении отзывов: {e}")
\ No newline at end of file
+        logging.error(f"Критическая ошибка при обновлении отзывов: {e}")
+        raise
\ No newline at end of file
@@ -7,7 +7,6 @@ from datetime import datetime
 
 from utils.my_gspread import connect_to_remote_sheet
 from utils.my_db_functions import get_df_from_db
-from utils.env_loader import *
 
 
 # ---- LOGS ----
@@ -0,0 +1,130 @@
+'''
+Реестр регулярных заданий и запуск через оркестратор (utils/orchestrator.py).
+
+В кроне вместо `python main/<script>.py`:
+    python main/jobs.py run autopilot_hourly
+    python main/jobs.py run remains_report_update    # сначала актуализирует wb_stocks, если нужно
+    python main/jobs.py run remains_report_update -- 2025-01-31   # аргументы после -- передаются скрипту
+    python main/jobs.py list
+    python main/jobs.py history autopilot_hourly
+'''
+# ---- IMPORTS ----
+
+# making it work for cron
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+# libraries
+import logging
+import argparse
+
+# my packages
+from utils.orchestrator import Orchestrator, RunHistory, check_registry, job_config, SUCCESS
+
+
+LOGS_PATH = os.getenv("LOGS_PATH", "./logs")
+os.makedirs(LOGS_PATH, exist_ok=True)
+# orchestrator пишет через logging - настраиваем корневой логгер
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler(f"{LOGS_PATH}/jobs.log", encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+)
+
+HOUR = 3600
+
+JOBS = {
+    # ---- каждые полчаса / час ----
+    'autopilot_hourly': {'script': 'main/autopilot_hourly.py', 'timeout': 55 * 60},
+    'wb_chats': {'script': 'main/wb_chats.py', 'timeout': 50 * 60},
+
+    # ---- ежедневные: выгрузки из WB API в БД ----
+    'wb_stocks': {'script': 'main/wb_stocks.py', 'timeout': HOUR, 'retries': 2, 'retry_delay': 120, 'fresh_for': 12 * HOUR},
+    'balance_history': {'script': 'main/balance_history.py', 'timeout': HOUR, 'retries': 1},
+    'feedbacks_to_db': {'script': 'main/feedbacks_to_db.py', 'timeout': 2 * HOUR, 'retries': 2, 'retry_delay': 300, 'fresh_for': 12 * HOUR},
+    'adv_spend': {'script': 'main/adv_spend.py', 'timeout': 2 * HOUR, 'retries': 1, 'retry_delay': 300},
+    'avg_position_to_db': {'script': 'main/avg_position_to_db.py', 'timeout': 2 * HOUR, 'retries': 1, 'retry_delay': 300},
+    'deductions_to_db': {'script': 'main/deductions_to_db.py', 'timeout': HOUR, 'retries': 1},
+    'wb_supplies_to_db': {'script': 'main/wb_supplies_to_db.py', 'timeout': HOUR, 'retries': 1},
+    'new_adv': {'script': 'main/new_adv.py', 'timeout': 2 * HOUR, 'retries': 1, 'retry_delay': 300},
+    'commission_schedule_to_db': {'script': 'main/commission_schedule_to_db.py', 'timeout': 30 * 60, 'retries': 1,
+                                  'fresh_for': 24 * HOUR},
+    'expenses_gs_to_db': {'script': 'main/expenses_gs_to_db.py', 'timeout': 30 * 60},
+    # комиссии берутся из commission_schedule (LATERAL join) - таблицу создаёт и наполняет commission_schedule_to_db
+    'net_profit_from_orders': {'script': 'main/net_profit_from_orders.py', 'timeout': HOUR,
+                               'depends_on': ['commission_schedule_to_db']},
+
+    # ---- ежедневные: отчёты в Google Таблицы ----
+    'remains_report_update': {'script': 'main/remains_report_update.py', 'timeout': HOUR, 'retries': 1,
+                              'depends_on': ['wb_stocks']},
+    'feedbacks_to_gs': {'script': 'main/feedbacks_to_gs.py', 'timeout': HOUR, 'retries': 1,
+                        'depends_on': ['feedbacks_to_db']},
+    'autopilot_daily': {'script': 'main/autopilot_daily.py', 'timeout': 2 * HOUR, 'retries': 1, 'retry_delay': 300},
+    'daily_penalties_to_gs': {'script': 'main/daily_penalties_to_gs.py', 'timeout': HOUR},
+    'db_data_to_purch_gs': {'script': 'main/db_data_to_purch_gs.py', 'timeout': HOUR, 'retries': 1},
+    'make_wb_pay_daily': {'script': 'main/make_wb_pay_daily.py', 'timeout': 30 * 60},
+    'rate_of_return': {'script': 'main/rate_of_return.py', 'timeout': HOUR},
+    'china_buy': {'script': 'main/china_buy.py', 'timeout': HOUR},
+    'purchase_price_update': {'script': 'main/purchase_price_update.py', 'timeout': 30 * 60},
+    'promotions': {'script': 'main/promotions.py', 'timeout': 2 * HOUR},
+
+    # ---- Висячие ----
+    'market_3': {'script': 'main/market_3.py', 'timeout': HOUR},
+    'market_status_from_db': {'script': 'main/market_status_from_db.py', 'timeout': HOUR},
+    'migration_data_to_hang': {'script': 'main/migration_data_to_hang.py', 'timeout': HOUR},
+
+    # ---- по требованию ----
+    'add_new_items': {'script': 'main/add_new_items.py', 'timeout': HOUR},
+    'delete_items': {'script': 'main/delete_items.py', 'timeout': HOUR},
+    'wb_missing_supplies_goods_to_db': {'script': 'main/wb_missing_supplies_goods_to_db.py', 'timeout': 2 * HOUR},
+}
+
+
+def print_history(rows):
+    for job, run_id, attempt, trigger, status, exit_code, started_at, duration, error in rows:
+        duration = f'{float(duration):.0f}s' if duration is not None else '-'
+        print(f"{started_at:%Y-%m-%d %H:%M:%S}  {job:<28} {status:<16} {duration:>7}  "
+              f"#{attempt} {run_id} {trigger or ''} {error or ''}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Запуск заданий из main с блокировками, зависимостями и повторами')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='запустить задание')
+    run_parser.add_argument('job')
+    run_parser.add_argument('--no-deps', action='store_true', help='не проверять зависимости')
+    run_parser.add_argument('--trigger', default='cron')
+    run_parser.add_argument('script_args', nargs=argparse.REMAINDER, help='аргументы скрипта после --')
+    sub.add_parser('list', help='реестр заданий')
+    history_parser = sub.add_parser('history', help='последние запуски')
+    history_parser.add_argument('job', nargs='?')
+    history_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    check_registry(JOBS)
+
+    if args.command == 'list':
+        for name in JOBS:
+            job = job_config(JOBS, name)
+            deps = f" <- {', '.join(job['depends_on'])}" if job['depends_on'] else ''
+            print(f"{name:<32} timeout {job['timeout']:>5}s  retries {job['retries']}{deps}")
+        sys.exit(0)
+
+    history = RunHistory()
+    try:
+        if args.command == 'history':
+            print_history(history.recent(args.job, args.limit))
+            sys.exit(0)
+
+        script_args = args.script_args[1:] if args.script_args[:1] == ['--'] else args.script_args
+        status = Orchestrator(JOBS, history).run(args.job, trigger=args.trigger, extra_args=script_args,
+                                                 with_deps=not args.no_deps)
+        logging.info(f'{args.job}: {status}')
+        sys.exit(0 if status == SUCCESS else 1)
+    finally:
+        history.close()
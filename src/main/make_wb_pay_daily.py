@@ -2,21 +2,26 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-import gspread
 import pandas as pd
+from functools import cache
 from datetime import datetime, date, timedelta
 
 from utils.my_db_functions import get_df_from_db, list_to_sql_select
+from utils.my_gspread import init_client
 from utils.logger import setup_logger
-from dotenv import load_dotenv
-
-load_dotenv
 
 logger = setup_logger("make_wb_pay_daily.log")
 
-CLIENT = gspread.service_account(filename=os.getenv('PRO_CREDS_PATH'))
-# TABLE = CLIENT.open(os.getenv('MAIN_TABLE'))
-TABLE = CLIENT.open(os.getenv('CONDITIONAL_CALCULATION'))
+
+@cache
+def get_table():
+    '''
+    Файл Условного расчета. Авторизация в Google - при первом обращении, а не при импорте
+    '''
+    client = init_client(os.getenv('PRO_CREDS_PATH'))
+    # return client.open(os.getenv('MAIN_TABLE'))
+    return client.open(os.getenv('CONDITIONAL_CALCULATION'))
+
 
 COL_MATCH = {
     'account' : 'Кабинет',
@@ -94,7 +99,7 @@ def process_db_data(db_data):
     return wb_pay
 
 def load_periods():
-    ws = TABLE.worksheet("Дашборд")
+    ws = get_table().worksheet("Дашборд")
     raw = ws.col_values(1)[:70]
     year = date.today().year
 
@@ -142,7 +147,7 @@ def process_daily_report(target_date):
     # append to Google Sheets
     yesterday_str = target_date.strftime('%d.%m.%Y')
     row = [yesterday_str, target_period, calc]
-    output_sh = TABLE.worksheet("ВБ_к_оплате")
+    output_sh = get_table().worksheet("ВБ_к_оплате")
     output_sh.append_row(row)
 
 # PERIODS = load_periods()
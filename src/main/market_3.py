@@ -11,16 +11,17 @@ import pandas as pd
 from datetime import datetime, timedelta
 
 from utils.utils import load_api_tokens
+from utils.my_gspread import init_client
+from utils.my_api import wb_url
 from utils.utils import update_df_in_google
 from utils.logger import setup_logger
-from utils.env_loader import *
 
 logger = setup_logger("market_3.log")
 
 CREDS_PATH = os.getenv("PRO_CREDS_PATH")
 
 def supply_info(account, api_token, begin, end):
-    url = 'https://marketplace-api.wildberries.ru/api/v3/orders'
+    url = wb_url('marketplace', '/api/v3/orders')
     next_value = 0
     limit = 1000
     full_data = []
@@ -61,7 +62,7 @@ def supply_info(account, api_token, begin, end):
 
 
 async def supply_info(account, api_token, begin, end):
-    url = 'https://marketplace-api.wildberries.ru/api/v3/orders'
+    url = wb_url('marketplace', '/api/v3/orders')
     next_value = 0
     limit = 1000
     full_data = []
@@ -130,6 +131,7 @@ if __name__ == "__main__":
 
     except Exception as e:
         logger.error(f'Ошибка при загрузке данных: {e}')
+        raise
             
 
     try:
@@ -160,11 +162,12 @@ if __name__ == "__main__":
 
     except Exception as e:
         logger.error(f'Ошибка при обработке данных: {e}')
+        raise
 
 
     try:
         # Доступ к гугл таблице
-        gc = gspread.service_account(filename=CREDS_PATH)
+        gc = init_client(CREDS_PATH)
         table = gc.open('Для расчетов БД')
         task_sheet = table.worksheet('БД 2 ( ТЕСТ )')
 
@@ -172,6 +175,7 @@ if __name__ == "__main__":
         logger.info('Данные успешно добавлены в гугл')
     except Exception as e:
         logger.error(f'Ошибка при добавлении данных в гугл: {e}')
+        raise
 
 
     # # Путь к файлу
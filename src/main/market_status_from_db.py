@@ -6,9 +6,9 @@ import gspread
 import pandas as pd
 
 from utils.utils import execute_read_query, update_df_in_google
+from utils.my_gspread import init_client
 from utils.my_db_functions import create_connection_w_env
 from utils.logger import setup_logger
-from utils.env_loader import *
 
 logger = setup_logger("market_status_from_db.log")
 
@@ -41,7 +41,7 @@ if __name__ == "__main__":
         connection.close()
 
         # Дает права на взаимодействие с гугл-таблицами
-        gc = gspread.service_account(filename=CREDS_PATH)
+        gc = init_client(CREDS_PATH)
         table_tasks = gc.open('Для расчетов БД')
         sheet_tasks = table_tasks.worksheet('БД 2 ( ТЕСТ )').get_all_values()
 
@@ -59,4 +59,5 @@ if __name__ == "__main__":
         logger.info('Данные успешно добавлены в гугл')
 
     except Exception as e:
-        logger.error(str(e))
\ No newline at end of file
+        logger.error(str(e))
+        raise
\ No newline at end of file
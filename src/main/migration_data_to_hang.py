@@ -6,8 +6,8 @@ import pandas as pd
 import gspread
 
 from utils.utils import update_df_in_google
+from utils.my_gspread import init_client
 from utils.logger import setup_logger
-from utils.env_loader import *
 
 logger = setup_logger("migration_data_to_hang.log")
 
@@ -18,7 +18,7 @@ if __name__ == "__main__":
     try: 
 
         # Дает права на взаимодействие с гугл-таблицами
-        gc = gspread.service_account(filename=CREDS_PATH)
+        gc = init_client(CREDS_PATH)
 
         # Таблица из которой берем данные
         table_from = gc.open("Для расчетов БД")
@@ -39,4 +39,5 @@ if __name__ == "__main__":
         
     except Exception as e:
 
-        logger.error(str(e))
\ No newline at end of file
+        logger.error(str(e))
+        raise
\ No newline at end of file
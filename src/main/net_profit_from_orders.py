@@ -2,31 +2,30 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import pandas as pd
 import numpy as np
 
-from utils.my_db_functions import create_db_table, insert_new_rows, get_df_from_db, get_purchase_price_from_db
-from utils.my_gspread import connect_to_remote_sheet
+from utils.my_db_functions import create_db_table, insert_new_rows, upsert_rows, get_df_from_db, get_purchase_price_from_db
 from utils.logger import setup_logger
 
 
 logger = setup_logger("net_profit_from_orders.log")
 
-COMMON_COMMISSION = 26
+DB_TABLE = 'net_profit_from_orders'
+COMMISSION_TABLE = 'commission_schedule'   # заполняется commission_schedule_to_db.py
+TAX = 6
+
+OUTPUT_COLUMNS = ['date', 'warehouse_type', 'article_id', 'supplier_article', 'subject',
+                  'order_count', 'orders_revenue', 'commission', 'purchase_price', 'tax', 'result_net_profit']
 
 def reset_net_profit_from_orders():
     '''
     Функция берёт ВСЕ строки из orders и добавляет их в net_profit_from_orders
     ! Применялась разово, в основной логике скрипта не используется !
     '''
-    df = get_data(False) # False - загружает данные из БД, True - из файла (для тестов)
-
-    df['date'] = pd.to_datetime(df['date'])
-    df = df[['date', 'warehouse_type', 'article_id', 'supplier_article', 'subject',
-       'order_count', 'total_sales', 'commission', 'purchase_price', 'tax']]
-    
-    insert_new_rows("net_profit_from_orders", df)
+    df = get_data(date(2024, 1, 1), date.today() - timedelta(days=1))
+    insert_new_rows(DB_TABLE, df)
 
 
 def create_net_profit_from_orders():
@@ -112,109 +111,141 @@ def create_net_profit_from_orders():
 
 
 
-def load_orders(local = True):
+def load_orders(date_from, date_to):
+    '''
+    Загрузка заказов из таблицы orders за период (включительно), сгруппированных по дню, артикулу и типу склада.
+    Комиссия берётся из commission_schedule - последняя версия, действовавшая на дату заказа;
+    при одинаковой дате конкретный предмет / тип склада важнее '*'. С 2026-01-01 действует единая ставка,
+    пока ставку предмета не поменяют в UNIT (правка попадает в таблицу версией с датой синхронизации).
     '''
-    Загрузка данных из таблицы orders в БД
+    db_table = 'orders'
+    query = f'''
+    WITH o AS (
+        SELECT 
+            date,
+            warehouse_type,
+            article_id,
+            supplier_article,
+            subject,
+            COUNT(price_with_disc) AS order_count,
+            SUM(price_with_disc) AS total_sales
+        FROM {db_table}
+        WHERE is_cancel = False
+        AND date BETWEEN '{date_from}' AND '{date_to}'
+        GROUP BY 
+            date,
+            article_id,
+            warehouse_type,
+            supplier_article,
+            subject
+    )
+    SELECT o.*, c.commission
+    FROM o
+    LEFT JOIN LATERAL (
+        SELECT commission
+        FROM {COMMISSION_TABLE} cs
+        WHERE cs.subject IN (o.subject, '*')
+        AND cs.warehouse_type IN (o.warehouse_type, '*')
+        AND cs.valid_from <= o.date
+        ORDER BY cs.valid_from DESC, (cs.subject = '*'), (cs.warehouse_type = '*')
+        LIMIT 1
+    ) c ON TRUE
     '''
-    if local:
-        df = pd.read_csv('orders_data_db.csv')
+    try:
+        df = get_df_from_db(query)
+        df['article_id'] = df['article_id'].astype(int)
         df['date'] = pd.to_datetime(df['date']).dt.date
-    else:
-        try:
-
-            db_table = 'orders'
-            query = f'''
-            SELECT 
-                date,
-                warehouse_type,
-                article_id,
-                supplier_article,
-                subject,
-                COUNT(price_with_disc) AS order_count,
-                SUM(price_with_disc) AS total_sales
-            FROM {db_table}
-            WHERE is_cancel = False
-            GROUP BY 
-                date,
-                article_id,
-                warehouse_type,
-                supplier_article,
-                subject
-            '''
-
-            df = get_df_from_db(query)
-            df['article_id'] = df['article_id'].astype(int)
-            df['date'] = pd.to_datetime(df['date']).dt.date
-        except Exception as e:
-            logger.error(f'Ошибка при попытке выгрузки данных из БД таблицы {db_table}:\n{e}')
+    except Exception as e:
+        logger.error(f'Ошибка при попытке выгрузки данных из БД таблицы {db_table}:\n{e}')
+        raise
     return df
 
 
-def load_commissions():
+def load_purchase_price_history(date_to):
     '''
-    Загрузка данных по комиссии с листа "Комиссия с июля" таблицы UNIT 
+    История закупочных цен по wild из supply_to_sellers_warehouse: одна цена на (wild, дата поставки).
+    Для валютных поставок берётся planned_cost, как в purchase_price_update.
     '''
-    sh = connect_to_remote_sheet('UNIT 2.0 (tested)', 'Комиссия с июля')
-    sh_values = sh.get_all_values()
-    com = pd.DataFrame(sh_values[1:], columns=sh_values[0])
-    clean_com = com.drop(columns = ['FBO\nКомиссия общая', 'FBS\nКомиссия общая'])
-    clean_com = clean_com.rename(columns={'FBO ИУ\nс июля': 'FBO', 'FBS ИУ\nс июля':'FBS', 'Предыдущая комиссия ИУ': 'BeforeJuly'})
-    return clean_com
+    query = f'''
+    SELECT DISTINCT ON (local_vendor_code, supply_date::date)
+        local_vendor_code AS wild,
+        supply_date::date AS price_date,
+        CASE
+            WHEN currency IS NOT NULL AND currency != '643' THEN planned_cost
+            ELSE ROUND(amount_with_vat / quantity, 2)
+        END AS purchase_price
+    FROM supply_to_sellers_warehouse
+    WHERE is_valid = TRUE
+    AND local_vendor_code LIKE 'wild%'
+    AND supplier_name != 'РВБ ООО'
+    AND quantity != 0
+    AND supply_date::date <= '{date_to}'
+    ORDER BY local_vendor_code, supply_date::date, update_document_datetime DESC
+    '''
+    df = get_df_from_db(query)
+    df['price_date'] = pd.to_datetime(df['price_date'])
+    df['purchase_price'] = df['purchase_price'].astype(float)
+    return df[df['purchase_price'] > 0]
 
 
-def get_data():
+def normalize_wild(supplier_article):
     '''
-    Оформляет данные (orders, комиссии, цена закупки) в единый df
+    wild1234d, wild1234d1, wild1234-d --> wild1234 (как в remains_report_update)
     '''
+    return (supplier_article.astype(str)
+            .str.replace(r'(\d+)([dD].*)?$', r'\1', regex=True)
+            .str.replace(r'-d$', '', case=False, regex=True))
 
-    # 1. загрузка данных
-    df = load_yesterday_orders() # данные за вчера
-
-    yesterday = date.today() - timedelta(days=1)
-    target_date = date(2026, 1, 1)
-
-    if yesterday < target_date:
-        # старая логика для обработки комиссий до 1 января 2026 г. (по категориям)
-        # 2. склеиваем данные по типу склада и дате
-        clean_com = load_commissions()
 
-        com_change_date = pd.to_datetime('2025-07-01').date()
-
-        com_indexed = clean_com.set_index('Наименование предмета')
-        FBO_com = com_indexed['FBO']
-        FBS_com = com_indexed['FBS']
-        prev_com = com_indexed['BeforeJuly']
-
-        conditions = [
-            (df['warehouse_type'] == 'Склад WB') & (df['date'] >= com_change_date),
-            (df['warehouse_type'] == 'Склад продавца') & (df['date'] >= com_change_date)
-        ]
-
-        choices = [
-            df['subject'].map(FBO_com),
-            df['subject'].map(FBS_com)
-        ]
+def add_purchase_price(df, price_history):
+    '''
+    As-of join: каждому заказу - цена последней поставки wild не позже даты заказа.
+    Если поставок до даты заказа нет, берётся текущая цена по артикулу из orders_articles_analyze.
+    '''
+    orders = df.copy()
+    orders['wild'] = normalize_wild(orders['supplier_article'])
+    orders['order_dt'] = pd.to_datetime(orders['date'])
+    orders = orders.sort_values('order_dt')
 
-        df['commission'] = np.select(conditions, choices, default=df['subject'].map(prev_com))
+    merged = pd.merge_asof(orders,
+                           price_history.sort_values('price_date'),
+                           left_on='order_dt',
+                           right_on='price_date',
+                           by='wild',
+                           direction='backward')
 
-    else:
-        df['commission'] = COMMON_COMMISSION
+    missing = merged['purchase_price'].isna()
+    if missing.any():
+        current_price = get_purchase_price_from_db()
+        merged.loc[missing, 'purchase_price'] = merged.loc[missing, 'article_id'].map(current_price)
+        logger.info(f'Нет поставок до даты заказа для {missing.sum()} строк, использована текущая цена закупки')
 
+    return merged.drop(columns=['wild', 'order_dt', 'price_date'])
 
-    # 3. добавляем цену закупки и налог
 
-    tax = 6
+def calculate_net_profit(df):
+    '''
+    Векторный расчёт чистой прибыли (та же формула, что в триггере calculate_net_profit):
+    (выручка - комиссия) * (1 - налог) - кол-во * цена закупки
+    '''
+    after_commission = df['orders_revenue'] * (1 - df['commission'] / 100)
+    after_tax = after_commission * (1 - df['tax'] / 100)
+    return (after_tax - df['order_count'] * df['purchase_price']).round(2)
 
-    purch_price = get_purchase_price_from_db()
-    df['purchase_price'] = df['article_id'].map(purch_price)
-    df['tax'] = tax
 
-    if yesterday < target_date:
-        df['commission'] = (df['commission'].str.replace(',', '.').astype(float))
+def get_data(date_from = None, date_to = None):
+    '''
+    Оформляет данные (orders, комиссии, цена закупки на дату заказа) в единый df за период.
+    По умолчанию - за вчера.
+    '''
+    yesterday = date.today() - timedelta(days=1)
+    date_from = date_from or yesterday
+    date_to = date_to or date_from
 
-    for column in ['purchase_price', 'commission', 'tax', 'total_sales']:
-        df[column] = df[column].astype(float)
-    df['order_count'] = df['order_count'].astype(int)
+    # 1. загрузка данных
+    df = load_orders(date_from, date_to)
+    if df.empty:
+        return pd.DataFrame(columns=OUTPUT_COLUMNS)
 
     # убираем дубликаты
     df['supplier_article'] = df['supplier_article'].replace('wild167', 'wild172d')
@@ -223,54 +254,56 @@ def get_data():
         'subject': 'first',
         'order_count': 'sum',
         'total_sales': 'sum',
-        'commission': 'first',
-        'purchase_price': 'first',
-        'tax': 'first'
+        'commission': 'first'
     }).reset_index()
+    df = df.rename(columns = {'total_sales':'orders_revenue'})
 
-    return df
+    missing_commission = df['commission'].isna()
+    if missing_commission.any():
+        logger.warning(f"Нет комиссии в {COMMISSION_TABLE} для предметов: {set(df.loc[missing_commission, 'subject'])}")
+
+    # 2. цена закупки, действовавшая на дату заказа
+    df = add_purchase_price(df, load_purchase_price_history(date_to))
+    df['tax'] = TAX
+
+    for column in ['purchase_price', 'commission', 'tax', 'orders_revenue']:
+        df[column] = df[column].astype(float)
+    df['order_count'] = df['order_count'].astype(int)
+
+    # 3. чистая прибыль
+    df['result_net_profit'] = calculate_net_profit(df)
+
+    return df[OUTPUT_COLUMNS]
 
 
 def load_yesterday_orders():
     '''
     Выгружает данные по заказам за предыдущий день
     '''
-    try:
-        db_table = 'orders'
-        query = f'''
-        SELECT 
-            date,
-            warehouse_type,
-            article_id,
-            supplier_article,
-            subject,
-            COUNT(price_with_disc) AS order_count,
-            SUM(price_with_disc) AS total_sales
-        FROM {db_table}
-        WHERE is_cancel = False
-        AND date = CURRENT_DATE - INTERVAL '1 day' -- yesterday
-        GROUP BY 
-            date,
-            article_id,
-            warehouse_type,
-            supplier_article,
-            subject
-        '''
+    yesterday = date.today() - timedelta(days=1)
+    return load_orders(yesterday, yesterday)
 
-        df = get_df_from_db(query)
-        df['article_id'] = df['article_id'].astype(int)
-        df['date'] = pd.to_datetime(df['date']).dt.date
 
-    except Exception as e:
-        logger.error(f'Ошибка при попытке выгрузки данных из БД таблицы {db_table}:\n{e}')
-    
-    return df
-    
+def update_net_profit(date_from = None, date_to = None):
+    '''
+    Пересчитывает чистую прибыль за период и перезаписывает строки в net_profit_from_orders.
+    Подходит и для ежедневного запуска (вчера), и для пересчёта месяца после исправления цены
+    (при пересчёте периода кеш текущих цен закупки сбрасывается, чтобы взять исправленные).
+    '''
+    if date_from is not None:
+        get_purchase_price_from_db.cache_clear()
+    df = get_data(date_from, date_to)
+    if df.empty:
+        logger.warning(f'Нет заказов за период {date_from} - {date_to}')
+        return
+    upsert_rows(DB_TABLE, df, ['date', 'article_id', 'warehouse_type'])
+    logger.info(f'Пересчитана чистая прибыль за {df["date"].min()} - {df["date"].max()}: {len(df)} строк')
 
 
 if __name__ == "__main__":
-    df = get_data() # выгружаем данные за вчера
-    df = df[['date', 'warehouse_type', 'article_id', 'supplier_article', 'subject',
-       'order_count', 'total_sales', 'commission', 'purchase_price', 'tax']]
-    df = df.rename(columns = {'total_sales':'orders_revenue'})
-    insert_new_rows("net_profit_from_orders", df)
\ No newline at end of file
+    # python net_profit_from_orders.py 2025-09-01 2025-09-30 - пересчёт периода, без аргументов - вчера
+    if len(sys.argv) == 3:
+        update_net_profit(datetime.strptime(sys.argv[1], '%Y-%m-%d').date(),
+                          datetime.strptime(sys.argv[2], '%Y-%m-%d').date())
+    else:
+        update_net_profit()
@@ -1,93 +1,101 @@
-import requests
+import sys
 import json
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
 import itertools
 import asyncio
 import aiohttp
 import logging
 
+from psycopg2.extras import execute_values
+
 from utils.utils import batchify, load_api_tokens
+from utils.my_api import get_rate_limiter, wb_url
+from utils.my_db_functions import create_connection_w_env
+
+
+FULLSTATS_URL = wb_url('advert', "/adv/v3/fullstats")
+# квота /adv/v3/fullstats: 3 запроса в минуту на аккаунт, интервал 20 сек, всплеск 1
+FULLSTATS_INTERVAL = 20
+FULLSTATS_BATCH = 50
+MAX_RETRIES = 5
+
+ACTIVE_STATUS = 9
+PAUSED_STATUS = 11
 
+ADV_STATS_TABLE = 'adv_stats_daily'
+# дни, за которые статистика ещё может меняться и перезапрашивается каждый запуск
+ADV_STATS_REFRESH_DAYS = 2
+ADV_STATS_METRICS = ['views', 'clicks', 'sum', 'atbs', 'orders', 'shks', 'sum_price', 'canceled']
 
-async def adv_stat_async(campaign_ids: list, date_from: str, date_to: str, api_token: str, account: str):
+
+async def adv_stat_async(campaign_ids: list, date_from: str, date_to: str, api_token: str, account: str, session: aiohttp.ClientSession = None):
     """
     Получение статистики по списку ID кампаний за указанный период.
+    Все запросы с одним токеном проходят через общий лимитер квоты fullstats.
 
     :param campaign_ids: список ID кампаний
     :param date_from: дата начала периода в формате YYYY-MM-DD
     :param date_to: дата окончания периода в формате YYYY-MM-DD
     :param api_token: токен для API WB
     :param account: название аккаунта
+    :param session: открытая сессия aiohttp (если None, создаётся новая)
     """
-    semaphore = asyncio.Semaphore(10)
-    url = "https://advert-api.wildberries.ru/adv/v3/fullstats"
-    headers = {"Authorization": api_token}
-    batches = list(batchify(campaign_ids, 50))
+    if session is None:
+        async with aiohttp.ClientSession(headers={"Authorization": api_token}) as own_session:
+            return await adv_stat_async(campaign_ids, date_from, date_to, api_token, account, own_session)
+
+    limiter = get_rate_limiter(("fullstats", api_token), FULLSTATS_INTERVAL)
     data = []
-    async with semaphore:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            for batch in batches:
-                ids_str = ",".join(str(c) for c in batch)
-                params = {"ids": ids_str, "beginDate": date_from, "endDate": date_to}
-
-                # print(f"Запрос для {account}: {params}")
-
-                retry_count = 0
-                while retry_count < 5:
-                    try:
-                        async with session.get(url, params=params) as response:
-                            logging.info(f"HTTP статус: {response.status}")
-
-                            if response.status == 400:
-                                err = await response.json()
-                                logging.error(f"Ошибка 400 {account}: {err.get('message') or err}")
-                                # retry_count += 1
-                                # await asyncio.sleep(60)
-                                continue
-
-                            if response.status == 429:
-                                logging.error("429 Too Many Requests — ждём минуту")
-                                retry_count += 1
-                                await asyncio.sleep(60)
-                                continue
-
-                            response.raise_for_status()
-                            batch_data = await response.json()
-
-                            # добавляем поле account в каждый элемент
-                            for item in batch_data or []:
-                                item["account"] = account
-                                item["date"] = date_from
-                            data.extend(batch_data or [])
-                            break
-
-                    except aiohttp.ClientError as e:
-                        logging.error(f"Сетевая ошибка для {account}: {e}")
-                        retry_count += 1
-                        await asyncio.sleep(30)
-
-                # WB ограничивает 1 запрос/мин → ждём после каждого батча
-                await asyncio.sleep(60)
-
-        return data
-    
-
-def camp_list(api_token: str, account: str):
-    url = 'https://advert-api.wildberries.ru/adv/v1/promotion/adverts'
+    for batch in batchify(campaign_ids, FULLSTATS_BATCH):
+        params = {"ids": ",".join(str(c) for c in batch), "beginDate": date_from, "endDate": date_to}
+
+        for attempt in range(1, MAX_RETRIES + 1):
+            await limiter.wait()
+            try:
+                async with session.get(FULLSTATS_URL, params=params) as response:
+                    if response.status == 400:
+                        # некорректный запрос не исправится повтором - пропускаем батч
+                        err = await response.json(content_type=None)
+                        logging.error(f"Ошибка 400 {account}: {(err or {}).get('message') or err}")
+                        break
+
+                    if response.status == 429:
+                        retry_after = float(response.headers.get("X-Ratelimit-Retry", FULLSTATS_INTERVAL))
+                        logging.warning(f"429 Too Many Requests {account} — попытка {attempt}/{MAX_RETRIES}, ждём {retry_after} сек.")
+                        limiter.penalize(retry_after)
+                        continue
+
+                    response.raise_for_status()
+                    batch_data = await response.json()
+
+                    # добавляем поле account в каждый элемент
+                    for item in batch_data or []:
+                        item["account"] = account
+                        item["date"] = date_from
+                    data.extend(batch_data or [])
+                    break
+
+            except aiohttp.ClientError as e:
+                logging.error(f"Сетевая ошибка для {account} (попытка {attempt}/{MAX_RETRIES}): {e}")
+        else:
+            logging.error(f"Не удалось получить статистику {account} по {len(batch)} кампаниям после {MAX_RETRIES} попыток")
+
+    return data
+
+
+async def camp_list(session: aiohttp.ClientSession, account: str):
+    url = wb_url('advert', '/adv/v1/promotion/adverts')
     camps = []
-    campaign_statuses = [9, 11]
-    headers = {'Authorization': api_token}
-    for status_id in campaign_statuses:
+    for status_id in (ACTIVE_STATUS, PAUSED_STATUS):
         params = {
         'status': status_id,
         'order': 'id'
                 }
-        payload = []
         try:
-            res = requests.post(url, headers=headers, params=params, json=payload)
-            res.raise_for_status()
-            data = res.json()
+            async with session.post(url, params=params, json=[]) as res:
+                res.raise_for_status()
+                data = await res.json(content_type=None)
         except Exception as e:
             logging.error(f"Error loading adverts: {e}")
             data = []
@@ -100,48 +108,80 @@ def camp_list(api_token: str, account: str):
     return camps
 
 
-def camp_list_manual(api_token: str, account: str):
-    url = 'https://advert-api.wildberries.ru/adv/v0/auction/adverts'
+async def camp_list_manual(session: aiohttp.ClientSession, account: str):
+    url = wb_url('advert', '/adv/v0/auction/adverts')
     camps = []
-    campaign_statuses = [9, 11]
-    headers = {'Authorization': api_token}
-    for status_id in campaign_statuses:
+    for status_id in (ACTIVE_STATUS, PAUSED_STATUS):
         params = {
         'status': status_id
                 }
         try:
-            res = requests.get(url, headers=headers, params=params)
-            res.raise_for_status()
-            data = res.json()
+            async with session.get(url, params=params) as res:
+                res.raise_for_status()
+                data = await res.json(content_type=None)
         except Exception as e:
             logging.error(f"Error loading adverts manually: {e}")
-            data = []
+            data = {}
 
-        if data:
+        if data and data.get('adverts'):
                 # Добавляем информацию о кабинете в данные
                 for item in data['adverts']:
                     item['account'] = account
                 camps.append(data['adverts'])
     return camps
 
-async def get_all_adv_data():
-    all_adv_data = []
-    tasks = []
-    for account, api_token in load_api_tokens().items():
-        camps_list = camp_list(api_token, account)
+
+def is_active_in_window(campaign: dict, date_from: str) -> bool:
+    """
+    Активные кампании берём всегда. Кампания на паузе могла крутиться в окне,
+    только если её статус менялся не раньше начала окна (changeTime / timestamps.updated).
+    """
+    if campaign.get('status') == ACTIVE_STATUS:
+        return True
+    change_time = campaign.get('changeTime') or (campaign.get('timestamps') or {}).get('updated')
+    if not change_time:
+        return True
+    return str(change_time)[:10] >= date_from
+
+
+async def get_account_adv_data(account: str, api_token: str, date_from: str, date_to: str):
+    """
+    Собирает список кампаний кабинета и их статистику за период.
+    """
+    async with aiohttp.ClientSession(headers={"Authorization": api_token}) as session:
+        camps_list, camps_list_2 = await asyncio.gather(camp_list(session, account),
+                                                        camp_list_manual(session, account))
         campaigns = list(itertools.chain(*camps_list))
-        campaign_ids = [c['advertId'] for c in campaigns]
-        camps_list_2 = camp_list_manual(api_token, account)
-        campaigns_2 = list(itertools.chain(*camps_list_2))
-        campaign_ids_2 = [c['id'] for c in campaigns_2 if c['status'] in (9, 11)]
-        campaign_ids.extend(campaign_ids_2)
-        campaign_ids = list(set(campaign_ids))
-
-        date_from = date_to = date.today().strftime("%Y-%m-%d")
-        logging.info(f"Получаем данные за {date_from} по ЛК {account}")
-        tasks.append(adv_stat_async(campaign_ids, date_from, date_to, api_token, account))
-    stats = await asyncio.gather(*tasks)
-    for stat in stats:
+        campaigns_2 = [c for c in itertools.chain(*camps_list_2) if c['status'] in (ACTIVE_STATUS, PAUSED_STATUS)]
+
+        campaign_ids = {c['advertId'] for c in campaigns if is_active_in_window(c, date_from)}
+        campaign_ids |= {c['id'] for c in campaigns_2 if is_active_in_window(c, date_from)}
+        total = len({c['advertId'] for c in campaigns} | {c['id'] for c in campaigns_2})
+
+        logging.info(f"Получаем данные за {date_from} - {date_to} по ЛК {account}: {len(campaign_ids)} из {total} кампаний")
+        return await adv_stat_async(sorted(campaign_ids), date_from, date_to, api_token, account, session)
+
+
+async def get_all_adv_data(date_from: str = None, date_to: str = None, failed: list = None):
+    """
+    Статистика по всем кабинетам, кабинеты обрабатываются параллельно.
+    По умолчанию - за сегодня. Кабинеты с ошибкой пропускаются и дописываются в failed, если он передан.
+    """
+    date_from = date_from or date.today().strftime("%Y-%m-%d")
+    date_to = date_to or date_from
+
+    tokens = load_api_tokens()
+    tasks = [get_account_adv_data(account, api_token, date_from, date_to)
+             for account, api_token in tokens.items()]
+    stats = await asyncio.gather(*tasks, return_exceptions=True)
+
+    all_adv_data = []
+    for account, stat in zip(tokens, stats):
+        if isinstance(stat, Exception):
+            logging.error(f"Ошибка при сборе рекламной статистики {account}: {stat}")
+            if failed is not None:
+                failed.append(account)
+            continue
         all_adv_data.extend(stat)
     return all_adv_data
 
@@ -213,8 +253,111 @@ def processed_adv_data(adv_data):
         processed_data.append(camp)
     return processed_data
 
+def flatten_adv_stats(adv_data):
+    """
+    Разворачивает ответ fullstats (days -> apps -> nms) в строки
+    по ключу (кампания, артикул, день, appType).
+    """
+    rows = []
+    for camp in adv_data:
+        for day in camp.get('days') or []:
+            day_date = str(day['date'])[:10]
+            for app in day.get('apps') or []:
+                for nm in app.get('nms') or []:
+                    row = {
+                        'advert_id': camp['advertId'],
+                        'nm_id': nm['nmId'],
+                        'date': day_date,
+                        'app_type': app['appType'],
+                        'account': camp.get('account'),
+                    }
+                    row.update({metric: nm.get(metric) or 0 for metric in ADV_STATS_METRICS})
+                    rows.append(row)
+    return rows
+
+
+def create_adv_stats_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ADV_STATS_TABLE} (
+            advert_id BIGINT NOT NULL,
+            nm_id BIGINT NOT NULL,
+            date DATE NOT NULL,
+            app_type INTEGER NOT NULL,
+            account TEXT,
+            views INTEGER,
+            clicks INTEGER,
+            sum NUMERIC(14,2),
+            atbs INTEGER,
+            orders INTEGER,
+            shks INTEGER,
+            sum_price NUMERIC(14,2),
+            canceled INTEGER,
+            updated_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (advert_id, nm_id, date, app_type)
+        );
+        CREATE INDEX IF NOT EXISTS {ADV_STATS_TABLE}_nm_id_date_idx ON {ADV_STATS_TABLE} (nm_id, date);
+        """)
+    conn.commit()
+
+
+def upsert_adv_stats(rows, conn):
+    """
+    Вставляет строки статистики, перезаписывая метрики уже сохранённых дней.
+    """
+    if not rows:
+        return
+
+    columns = ['advert_id', 'nm_id', 'date', 'app_type', 'account'] + ADV_STATS_METRICS
+    updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in ['account'] + ADV_STATS_METRICS)
+    sql = f"""
+        INSERT INTO {ADV_STATS_TABLE} ({', '.join(columns)})
+        VALUES %s
+        ON CONFLICT (advert_id, nm_id, date, app_type)
+        DO UPDATE SET {updates}, updated_at = NOW()
+    """
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, sql, [[row[col] for col in columns] for row in rows], page_size=1000)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+
+
+def update_adv_stats_store(conn = None):
+    """
+    Перезапрашивает статистику только за вчера и сегодня и сохраняет её в ADV_STATS_TABLE.
+    Более ранние дни берутся из БД. Возвращает развёрнутые строки за обновлённый период.
+    """
+    date_to = date.today()
+    date_from = date_to - timedelta(days=ADV_STATS_REFRESH_DAYS - 1)
+
+    raw_data = asyncio.run(get_all_adv_data(date_from.strftime("%Y-%m-%d"), date_to.strftime("%Y-%m-%d")))
+    rows = flatten_adv_stats(raw_data)
+
+    own_conn = conn is None
+    try:
+        if own_conn:
+            conn = create_connection_w_env()
+        create_adv_stats_table(conn)
+        upsert_adv_stats(rows, conn)
+        logging.info(f"В {ADV_STATS_TABLE} сохранено {len(rows)} строк за {date_from} - {date_to}")
+    except Exception as e:
+        # статистика всё равно возвращается, чтобы не ломать выгрузку в таблицы
+        logging.error(f"Не удалось сохранить рекламную статистику в {ADV_STATS_TABLE}: {e}")
+    finally:
+        if own_conn and conn:
+            conn.close()
+
+    return rows
+
+
 if __name__ == "__main__":
-    data = asyncio.run(get_all_adv_data())
+    failed = []
+    data = asyncio.run(get_all_adv_data(failed=failed))
     ready_data = processed_adv_data(data)
     with open('final_adv_data_example.json', "w", encoding="utf-8") as f:
-        json.dump(ready_data, f, ensure_ascii=False, indent=4) 
\ No newline at end of file
+        json.dump(ready_data, f, ensure_ascii=False, indent=4)
+    if failed:
+        sys.exit(f"Не получена рекламная статистика по кабинетам: {', '.join(failed)}") 
\ No newline at end of file
@@ -6,20 +6,16 @@ import re
 import json
 import asyncio
 import requests
+from difflib import SequenceMatcher
 import pandas as pd
 from psycopg2.extras import execute_values
 from datetime import time, datetime, timedelta
 
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_db_functions import create_connection_w_env
 from utils.my_general import to_iso_z, save_json, date_from_now
-from utils.logger import *
-
-# AI
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage
-from azure.core.credentials import AzureKeyCredential
 
 logger = setup_logger("promotions.log")
 
@@ -30,6 +26,15 @@ MONTHS_RU = [
 
 API_TIME_DIFF = 3   # добавляем +3 часа ко всем данным из API
 
+# мэтчинг названий акций ЛК -> API
+PROMO_MAPPING_TABLE = 'promo_name_mapping'
+PROMO_MATCH_THRESHOLD = 0.9     # минимальная похожесть для мэтча без модели
+PROMO_MATCH_MARGIN = 0.05       # насколько лучший кандидат должен обходить второго
+PROMO_LLM_BATCH = 20            # названий ЛК в одном запросе к модели
+PROMO_PREFIXES_RE = re.compile(   # служебные префиксы в названиях файлов из ЛК
+    r'^(товары для исключения из|товары для|исключение из|исключения из)(\s+акци[иея])?[\s:_-]*'
+)
+
 
 def format_promo(promo: dict) -> str:
     '''
@@ -101,7 +106,7 @@ def get_promotions(api_key, start_dt, end_dt, all_promo=False, limit=1000, offse
     start_dt = to_iso_z(start_dt, time(0, 0, 0))
     end_dt = to_iso_z(end_dt, time(23, 59, 59))
 
-    url = "https://dp-calendar-api.wildberries.ru/api/v1/calendar/promotions"
+    url = wb_url('calendar', "/api/v1/calendar/promotions")
     headers = {"Authorization": api_key}
     params = {
         "startDateTime": start_dt,
@@ -141,19 +146,70 @@ def get_promotion_details(api_key, promotion_ids):
         api_key (str): API ключ
         promotion_ids (list[int]): Список ID акций
     """
-    url = "https://dp-calendar-api.wildberries.ru/api/v1/calendar/promotions/details"
+    url = wb_url('calendar', "/api/v1/calendar/promotions/details")
     headers = {"Authorization": api_key}
     params = [("promotionIDs", str(pid)) for pid in promotion_ids]
     response = requests.get(url, headers=headers, params=params)
     return response.json()
 
 
-def match_promo_names(promo_names_lk, promo_names_api):
+def normalize_promo_name(name: str) -> str:
+    '''
+    Название акции для сравнения: нижний регистр, ё -> е, без служебных префиксов ЛК
+    ("Товары для исключения из акции ...") и без знаков препинания
+    '''
+    name = str(name).lower().replace('ё', 'е')
+    name = PROMO_PREFIXES_RE.sub('', name)
+    name = re.sub(r'[^\w%]+', ' ', name)
+    return ' '.join(name.split())
+
+
+def promo_similarity(name_lk: str, name_api: str) -> float:
+    '''
+    Похожесть названий 0..1; название из API целиком внутри названия из ЛК - 0.95
+    '''
+    lk, api = normalize_promo_name(name_lk), normalize_promo_name(name_api)
+    if not lk or not api:
+        return 0.0
+    if lk == api:
+        return 1.0
+    ratio = SequenceMatcher(None, lk, api).ratio()
+    if f' {api} ' in f' {lk} ':
+        ratio = max(ratio, 0.95)
+    return round(ratio, 4)
+
+
+def prematch_promo_names(promo_names_lk, promo_names_api, threshold = PROMO_MATCH_THRESHOLD, margin = PROMO_MATCH_MARGIN):
+    '''
+    Детерминированный мэтч по похожести названий: берём лучшее название из API,
+    если оно не ниже threshold и заметно (margin) лучше второго
+
+    Result:
+        {lk_name : (api_name, confidence)}, [не сопоставленные lk_name]
+    '''
+    matched, unresolved = {}, []
+    for name_lk in promo_names_lk:
+        scores = sorted(((promo_similarity(name_lk, name_api), name_api) for name_api in promo_names_api), reverse=True)
+        best_score, best_name = scores[0] if scores else (0.0, None)
+        second_score = scores[1][0] if len(scores) > 1 else 0.0
+        if best_score >= threshold and best_score - second_score >= margin:
+            matched[name_lk] = (best_name, best_score)
+        else:
+            unresolved.append(name_lk)
+    return matched, unresolved
+
+
+def ask_model(promo_names_lk, promo_names_api):
     '''
     Запрос к нейросетке (chatgpt через github models).
-    Мэтчит названия акций из ЛК с чистыми названиями этих же акций из API.
+    Мэтчит названия акций из ЛК с чистыми названиями этих же акций из API, возвращает ответ модели как строку.
     Нет, использовать для других мэтчей нельзя, потому что промпт под акции :)
     '''
+    # azure SDK нужен только здесь - не грузим его при каждом запуске скрипта
+    from azure.ai.inference import ChatCompletionsClient
+    from azure.ai.inference.models import SystemMessage, UserMessage
+    from azure.core.credentials import AzureKeyCredential
+
     token = os.environ["GITHUB_TOKEN"]
     endpoint = "https://models.inference.ai.azure.com"
     
@@ -172,18 +228,150 @@ def match_promo_names(promo_names_lk, promo_names_api):
                 "RULES:\n"
                 "1. Match List 1 items to List 2 by identifying the shared campaign title, ignoring prefixes like 'Товары для...' or 'Исключение из...'.\n"
                 "2. Return ONLY a valid JSON object. No prose.\n"
-                "3. Format: {\"list1_item\": \"list2_item\"}.\n"
-                "4. If no logical match exists (even with fuzzy matching), return: {\"error\": \"Detailed reason\"}."
+                "3. Format: {\"list1_item\": \"list2_item\"}. Copy both names exactly as given.\n"
+                "4. Leave out List 1 items that have no logical match (even with fuzzy matching)."
             )),
-            UserMessage(content=f"List 1: {promo_names_lk}\nList 2: {promo_names_api}")
+            UserMessage(content=f"List 1: {json.dumps(promo_names_lk, ensure_ascii=False)}\n"
+                                f"List 2: {json.dumps(promo_names_api, ensure_ascii=False)}")
         ],
         model="gpt-4o-mini",
-        temperature=0.1 # Low temperature ensures more consistent, "robotic" output
+        temperature=0 # мэтч должен быть воспроизводимым
     )    
 
     return response.choices[0].message.content
 
 
+def parse_model_answer(answer, promo_names_lk, promo_names_api):
+    '''
+    Разбирает ответ модели и оставляет только пары, где оба названия есть в исходных списках
+
+    Result:
+        {lk_name : api_name}
+    '''
+    answer = re.sub(r'^```(?:json)?|```$', '', answer.strip()).strip()
+    try:
+        pairs = json.loads(answer)
+    except ValueError:
+        logger.error(f'Модель вернула не JSON: {answer[:500]}')
+        return {}
+    if not isinstance(pairs, dict):
+        logger.error(f'Модель вернула не объект: {answer[:500]}')
+        return {}
+
+    lk_set, api_set = set(promo_names_lk), set(promo_names_api)
+    valid = {}
+    for name_lk, name_api in pairs.items():
+        if name_lk in lk_set and isinstance(name_api, str) and name_api in api_set:
+            valid[name_lk] = name_api
+        else:
+            logger.warning(f'Отброшен ответ модели: {name_lk!r} -> {name_api!r}')
+    return valid
+
+
+def create_mapping_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            CREATE TABLE IF NOT EXISTS {PROMO_MAPPING_TABLE} (
+                lk_name text PRIMARY KEY,
+                promo_name text NOT NULL,
+                promo_id bigint,
+                confidence numeric,
+                method text NOT NULL,
+                created_at timestamp NOT NULL DEFAULT NOW(),
+                updated_at timestamp NOT NULL DEFAULT NOW()
+            )
+        ''')
+    conn.commit()
+
+
+def load_promo_mapping(conn):
+    '''
+    Result:
+        {lk_name : promo_name} - сохранённые мэтчи
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f'SELECT lk_name, promo_name FROM {PROMO_MAPPING_TABLE}')
+        return dict(cur.fetchall())
+
+
+def save_promo_mapping(conn, rows):
+    '''
+    rows: [(lk_name, promo_name, promo_id, confidence, method)]. Ручные правки (method = 'manual') не перезаписываются
+    '''
+    if not rows:
+        return
+    query = f'''
+        INSERT INTO {PROMO_MAPPING_TABLE} (lk_name, promo_name, promo_id, confidence, method)
+        VALUES %s
+        ON CONFLICT (lk_name) DO UPDATE SET
+            promo_name = EXCLUDED.promo_name,
+            promo_id = EXCLUDED.promo_id,
+            confidence = EXCLUDED.confidence,
+            method = EXCLUDED.method,
+            updated_at = NOW()
+        WHERE {PROMO_MAPPING_TABLE}.method != 'manual'
+    '''
+    with conn.cursor() as cur:
+        execute_values(cur, query, rows)
+    conn.commit()
+
+
+def match_promo_names(promo_names_lk, promo_names_api, promo_ids = None, conn = None):
+    '''
+    Мэтчит названия акций из ЛК с названиями из API:
+    1. сохранённые мэтчи из таблицы PROMO_MAPPING_TABLE (если акция с таким названием есть в API сейчас);
+    2. похожесть нормализованных названий;
+    3. оставшиеся - нейросетка, пачками по PROMO_LLM_BATCH, ответ проверяется.
+    Новые мэтчи сохраняются в таблицу, так что повторные запуски в модель не ходят.
+
+    Arguments:
+        promo_ids: {promo_name : promo_id} - для записи в таблицу
+
+    Result:
+        {lk_name : api_name} - несопоставленных названий в результате нет
+    '''
+    own_conn = conn is None
+    if own_conn:
+        conn = create_connection_w_env()
+    promo_ids = promo_ids or {}
+    api_set = set(promo_names_api)
+
+    try:
+        create_mapping_table(conn)
+        stored = load_promo_mapping(conn)
+        result = {lk: api for lk, api in stored.items() if lk in promo_names_lk and api in api_set}
+        logger.info(f'Из таблицы сопоставлено {len(result)} из {len(promo_names_lk)} акций')
+
+        new_rows = []
+        pending = [name for name in promo_names_lk if name not in result]
+        matched, unresolved = prematch_promo_names(pending, promo_names_api)
+        for name_lk, (name_api, score) in matched.items():
+            result[name_lk] = name_api
+            new_rows.append((name_lk, name_api, promo_ids.get(name_api), score, 'similarity'))
+        logger.info(f'По похожести сопоставлено {len(matched)}, в модель уходит {len(unresolved)}')
+
+        for i in range(0, len(unresolved), PROMO_LLM_BATCH):
+            batch = unresolved[i:i + PROMO_LLM_BATCH]
+            try:
+                answer = ask_model(batch, promo_names_api)
+            except Exception as e:
+                logger.error(f'Ошибка запроса к модели: {e}')
+                continue
+            for name_lk, name_api in parse_model_answer(answer, batch, promo_names_api).items():
+                result[name_lk] = name_api
+                new_rows.append((name_lk, name_api, promo_ids.get(name_api), promo_similarity(name_lk, name_api), 'llm'))
+
+        save_promo_mapping(conn, new_rows)
+
+        missing = [name for name in promo_names_lk if name not in result]
+        if missing:
+            logger.warning(f'Не сопоставлены акции: {missing}')
+        return result
+    finally:
+        if own_conn:
+            conn.close()
+
+
 def insert_promotions(api_df):
     """
     Insert pandas DataFrame into the promotions table with column order:
@@ -248,8 +436,8 @@ def main(folder = None):
 
     # 2. load lk data
     if folder is None:
-        logging.info(f'Название папки не указано, выгружаю данные из папки {datetime.now().strftime('%d.%m')}')
         folder = datetime.now().strftime('%d.%m')
+        logger.info(f'Название папки не указано, выгружаю данные из папки {folder}')
 
     path = f'/Users/margaretko/Desktop/IT/Start/акции/{folder}' # TODO: put to the .env
     df = merge_excels(path)
@@ -257,13 +445,14 @@ def main(folder = None):
     logger.info('lk data is loaded')
 
 
-    # 3. match promo names from lk and api (AI)
-    matched_lk_api_promo = json.loads(match_promo_names(
+    # 3. match promo names from lk and api (saved mapping -> similarity -> AI)
+    matched_lk_api_promo = match_promo_names(
         promo_names_lk = promo_names_lk,
-        promo_names_api = promo_names_api
-    ))
+        promo_names_api = promo_names_api,
+        promo_ids = {i['name'] : i['id'] for i in api_data}
+    )
 
-    logger.info(f'AI-matched promo: {matched_lk_api_promo}')
+    logger.info(f'Matched promo: {matched_lk_api_promo}')
 
     # match time by name, add both to the promo name and as separate columns
     formatted_api_names = {i['name'] : format_promo(i) for i in api_data}
@@ -8,7 +8,7 @@ from datetime import datetime
 
 import utils.my_gspread as gs
 from utils.my_pandas import process_decimal
-from utils.my_db_functions import get_df_from_db
+from utils.my_db_functions import get_df_from_db, get_purchase_price_from_db
 from utils.logger import setup_logger
 from dotenv import load_dotenv
 
@@ -190,7 +190,7 @@ def process_data(sh, round_price=False):
     return cut_data, unit_articles
 
 
-def update_purchase_price_sopost(sh, data):
+def update_purchase_price_sopost(sh, data, unit_articles):
     '''
     Изменение закупочной цены для конкретных СКЮ в таблице Сопост.
     Не перезаливает колонку полностью, а точечно изменяет закупочную стоимость у СКЮ, у которых изменилась цена.
@@ -198,6 +198,8 @@ def update_purchase_price_sopost(sh, data):
     Номер строки берёт из листа с артикулами, спарсенного из таблицы.
     Перед проставлением новой цены проверяет, что в соседней ячейке именно этот артикул.
     Если артикулы в скрипте и ячейке не совпадают, новая цена не проставляется.
+
+    Колонки wild и цены читаются одним batch_get, все изменённые ячейки пишутся одним batch_update.
     '''
     # create a dict {local_vendor_code : purchase_price}
     new_purchase_price_per_item = data.set_index('local_vendor_code')['price_per_item'].to_dict()
@@ -210,24 +212,38 @@ def update_purchase_price_sopost(sh, data):
     target_skus = list(data['local_vendor_code'])
     logger.info(f'\nКоличество позиций с изменённой ценой: {len(target_skus)}\n')
 
+    # актуальные значения колонок на момент записи (строки с 2-й)
+    wild_values, price_values = sh.batch_get([f'{sku_col_letter}2:{sku_col_letter}', f'{purchase_price_col_letter}2:{purchase_price_col_letter}'])
+    sheet_wilds = [row[0] if row else '' for row in wild_values]
+    sheet_prices = [row[0] if row else '' for row in price_values]
+
+    updates = []
     for sku in target_skus:
         new_price = new_purchase_price_per_item[sku]
         target_row_num = unit_articles.index(sku) + 2
 
         unit_wild_cell = f'{sku_col_letter}{target_row_num}'
-        unit_wild = sh.get_values(range_name = unit_wild_cell)[0][0]
+        row_idx = target_row_num - 2
+        unit_wild = sheet_wilds[row_idx] if row_idx < len(sheet_wilds) else ''
 
         # дополнительно проверяем, что вилд совпадает
         if unit_wild == sku:
-            try:
-                target_cell = f'{purchase_price_col_letter}{target_row_num}'
-                sh.update(values = [[new_price]], range_name=target_cell)
-                logger.info(f'Данные для {sku} в ячейке {target_cell} успешно обновлены: Старая цена - {old_purchase_price_per_item[sku]}, Новая цена - {new_price}\n')
-            except Exception as e:
-                logger.error(f'Ошибка при добавлении {sku} в {target_cell}:\n{e}\n')
+            target_cell = f'{purchase_price_col_letter}{target_row_num}'
+            updates.append({'range': target_cell, 'values': [[new_price]]})
+            current_price = sheet_prices[row_idx] if row_idx < len(sheet_prices) else ''
+            logger.info(f'Данные для {sku} в ячейке {target_cell} будут обновлены: Старая цена - {old_purchase_price_per_item[sku]} (в ячейке {current_price}), Новая цена - {new_price}\n')
         else:
             logger.error(f'Возможно, диапазон для {sku} определён неверно, в ячейке {unit_wild_cell} другое значение - {unit_wild}')
 
+    if not updates:
+        return
+
+    try:
+        sh.batch_update(updates)
+        logger.info(f'Закупочная цена обновлена в {len(updates)} ячейках одним запросом')
+    except Exception as e:
+        logger.error(f'Ошибка при обновлении цен в ячейках {[u["range"] for u in updates]}:\n{e}\n')
+
 
 def send_report(data):
     '''
@@ -280,10 +296,14 @@ if __name__ == "__main__":
             raise ValueError('Не найдены СКЮ с изменённой ценой')
 
         # update data in Сопост 
-        update_purchase_price_sopost(sh, data)   
+        update_purchase_price_sopost(sh, data, unit_articles)
 
         # add report to Изменение закупочной цены
         send_report(data)
 
+        # цены закупки изменились - закешированный справочник цен больше не актуален
+        get_purchase_price_from_db.cache_clear()
+
     except Exception as e:
-        logger.error(f'Failed to update purchase price:\n{e}')
\ No newline at end of file
+        logger.error(f'Failed to update purchase price:\n{e}')
+        raise
\ No newline at end of file
@@ -0,0 +1,415 @@
+# ---- IMPORTS ----
+
+# making it work for cron
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import re
+import ast
+import json
+import argparse
+import psycopg2
+
+from utils.logger import setup_logger
+
+
+# ---- LOGS ----
+logger = setup_logger("query_plan_advisor.log")
+
+
+SRC_PATH = os.path.dirname(os.path.dirname(__file__))
+
+LARGE_TABLE_ROWS = 10_000   # Seq Scan / Sort по стольким строкам и больше считается подозрительным
+DEFAULT_SCALE = 200_000     # строк в самых больших синтетических таблицах
+
+# Реестр тяжёлых запросов: SQL берётся прямо из исходника функции (без импорта модуля),
+# поля f-строк подставляются из params. match - фрагмент, по которому выбирается строка,
+# если в функции несколько запросов. max_cost - бюджет планировщика (Total Cost) на синтетике DEFAULT_SCALE,
+# обновляется через --calibrate после добавления индексов.
+QUERY_REGISTRY = {
+    'get_basic_info': {
+        'file': 'utils/my_db_functions.py',
+        'function': 'get_basic_info',
+        'params': {'columns': 'article_id,  local_vendor_code, subject_name, manager, parent_name'},
+        'max_cost': 30_000,
+    },
+    'load_wild_managers': {
+        'file': 'utils/my_queries.py',
+        'function': 'load_wild_managers',
+        'max_cost': 30_000,
+    },
+    'purchase_price_update.load_data_from_db': {
+        'file': 'main/purchase_price_update.py',
+        'function': 'load_data_from_db',
+        'params': {'days_count': 2},
+        'max_cost': 5_000,
+    },
+    'spp_history.hour_check': {
+        'file': 'main/autopilot_hourly.py',
+        'function': 'insert_spp_data_to_db',
+        'match': 'LIMIT 1',
+        'max_cost': 1_000,
+    },
+    'daily_penalties_to_gs.load_db_data': {
+        'file': 'main/daily_penalties_to_gs.py',
+        'function': 'load_db_data',
+        'params': {'DB_DAILY_FIN': os.getenv('DB_DAILY_FIN', 'daily_fin_reports')},
+        'max_cost': 60_000,
+    },
+}
+
+
+# Синтетическая схема: только колонки, которые используют запросы из реестра.
+# {scale} - DEFAULT_SCALE или --scale, мелкие справочники масштабируются от него.
+SYNTHETIC_SCHEMA = '''
+CREATE TABLE orders_articles_analyze AS
+SELECT
+    CURRENT_DATE - (g % 120) AS date,
+    100000 + g % ({scale} / 120 + 1) AS article_id,
+    'wild' || (g % ({scale} / 120 + 1)) AS local_vendor_code,
+    'subject_' || g % 50 AS subject_name,
+    'manager_' || g % 10 AS manager,
+    'parent_' || g % 20 AS parent_name,
+    g % 7 AS orders_count,
+    g % 100 AS total_quantity,
+    g % 30 AS stock_fbs
+FROM generate_series(1, {scale}) g;
+
+CREATE TABLE spp_history AS
+SELECT
+    g AS id,
+    100000 + g % ({scale} / 200 + 1) AS nm_id,
+    (1000 + g % 500)::numeric AS full_price,
+    (g % 30)::numeric AS spp_percent,
+    (800 + g % 400)::numeric AS spp_price,
+    NOW() - make_interval(hours => g % 2000) AS created_at
+FROM generate_series(1, {scale}) g;
+
+CREATE TABLE assembly_task_status_model AS
+SELECT
+    g % ({scale} / 4 + 1) AS id,
+    (ARRAY['new', 'confirm', 'complete', 'cancel'])[g % 4 + 1] AS supplier_status,
+    (ARRAY['waiting', 'sorted', 'sold', 'canceled'])[g % 4 + 1] AS wb_status,
+    'WB-GI-' || g % 1000 AS supply_id,
+    NOW() - make_interval(mins => g % 100000) AS created_at_db
+FROM generate_series(1, {scale}) g;
+
+CREATE TABLE supply_to_sellers_warehouse AS
+SELECT
+    CURRENT_DATE - (g % 365) AS supply_date,
+    md5(g::text) AS guid,
+    'DOC-' || g AS document_number,
+    'wild' || g % 2000 AS local_vendor_code,
+    'product ' || g % 2000 AS product_name,
+    'Проведён' AS event_status,
+    (g % 1000 + 100)::numeric AS amount_with_vat,
+    g % 20 + 1 AS quantity,
+    CASE WHEN g % 10 = 0 THEN '156' ELSE '643' END AS currency,
+    (g % 500)::numeric AS planned_cost,
+    g % 50 != 0 AS is_valid,
+    CASE WHEN g % 25 = 0 THEN 'РВБ ООО' ELSE 'supplier_' || g % 40 END AS supplier_name
+FROM generate_series(1, {scale} / 4) g;
+
+CREATE TABLE orders AS
+SELECT
+    'srid_' || g AS srid,
+    CASE WHEN g % 3 = 0 THEN 'Склад продавца' ELSE 'Склад WB' END AS warehouse_type,
+    CURRENT_DATE - (g % 120) AS date
+FROM generate_series(1, {scale}) g;
+
+CREATE TABLE article AS
+SELECT 100000 + g AS nm_id, 'wild' || g AS local_vendor_code
+FROM generate_series(0, {scale} / 120) g;
+
+CREATE TABLE {daily_fin} AS
+SELECT
+    CURRENT_DATE - (g % 60) AS date_from,
+    CURRENT_DATE - (g % 60) AS sale_dt,
+    CASE WHEN g % 20 = 0 THEN (g % 500)::numeric ELSE 0 END AS penalty,
+    'bonus_' || g % 5 AS bonus_type_name,
+    100000 + g % ({scale} / 120 + 1) AS nm_id,
+    'subject_' || g % 50 AS subject_name,
+    'account_' || g % 6 AS account,
+    'srid_' || g AS srid,
+    g AS shk_id,
+    g % ({scale} / 4 + 1) AS assembly_id
+FROM generate_series(1, {scale}) g;
+'''
+
+SYNTHETIC_TABLES = ['orders_articles_analyze', 'spp_history', 'assembly_task_status_model',
+                    'supply_to_sellers_warehouse', 'orders', 'article']
+
+
+# -------------------------------- ИЗВЛЕЧЕНИЕ SQL --------------------------------
+
+def _string_from_node(node, params):
+    '''
+    Текст строкового литерала / f-строки, поля f-строки подставляются из params
+    '''
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            else:
+                field = ast.unparse(value.value)
+                if field not in params:
+                    raise KeyError(f'No value for f-string field {{{field}}}')
+                parts.append(str(params[field]))
+        return ''.join(parts)
+    return None
+
+
+def extract_sql(file, function, params = None, match = None):
+    '''
+    Находит в функции function файла file строку с SQL (SELECT ... FROM) и возвращает её текст.
+    '''
+    params = params or {}
+    with open(os.path.join(SRC_PATH, file), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == function:
+            # куски f-строк обходятся ast.walk отдельно - берём только f-строку целиком
+            fragments = {id(v) for sub in ast.walk(node) if isinstance(sub, ast.JoinedStr) for v in sub.values}
+            for sub in ast.walk(node):
+                if not isinstance(sub, (ast.Constant, ast.JoinedStr)) or id(sub) in fragments:
+                    continue
+                text = _string_from_node(sub, params)
+                if text is None or not re.search(r'\bselect\b.*\bfrom\b', text, re.I | re.S):
+                    continue
+                if match and match not in text:
+                    continue
+                return text.strip().rstrip(';')
+    raise LookupError(f'SQL not found in {file}:{function}' + (f' (match={match!r})' if match else ''))
+
+
+def collect_queries(names = None):
+    '''
+    {name: sql} для зарегистрированных запросов
+    '''
+    queries = {}
+    for name, entry in QUERY_REGISTRY.items():
+        if names and name not in names:
+            continue
+        queries[name] = extract_sql(entry['file'], entry['function'], entry.get('params'), entry.get('match'))
+    return queries
+
+
+# -------------------------------- EXPLAIN --------------------------------
+
+def explain(conn, sql, analyze = True):
+    '''
+    План запроса в JSON. Запрос выполняется внутри транзакции, которая откатывается.
+    '''
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'EXPLAIN ({options}) {sql}')
+            plan = cur.fetchone()[0]
+    finally:
+        conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]
+
+
+def walk_plan(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+
+def table_columns(conn, table):
+    with conn.cursor() as cur:
+        cur.execute('SELECT column_name FROM information_schema.columns WHERE table_name = %s', (table,))
+        columns = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return columns
+
+
+def find_problems(plan):
+    '''
+    Seq Scan и Sort по большим наборам строк, фильтры с функцией над колонкой (индекс не используется).
+    Returns: [{'node': ..., 'relation': ..., 'rows': ..., 'detail': ...}]
+    '''
+    problems = []
+    for node in walk_plan(plan['Plan']):
+        rows = max(node.get('Actual Rows', 0) * node.get('Actual Loops', 1), node.get('Plan Rows', 0))
+        node_type = node['Node Type']
+
+        if node_type == 'Seq Scan':
+            scanned = rows + node.get('Rows Removed by Filter', 0)
+            if scanned >= LARGE_TABLE_ROWS:
+                problems.append({
+                    'node': node_type,
+                    'relation': node.get('Relation Name'),
+                    'rows': scanned,
+                    'filter': node.get('Filter'),
+                    'detail': f"Seq Scan on {node.get('Relation Name')}: {scanned} rows read, filter: {node.get('Filter')}",
+                })
+
+        elif node_type in ('Sort', 'Incremental Sort') and rows >= LARGE_TABLE_ROWS:
+            problems.append({
+                'node': node_type,
+                'relation': None,
+                'rows': rows,
+                'sort_key': node.get('Sort Key'),
+                'detail': f"{node_type} of {rows} rows by {node.get('Sort Key')} ({node.get('Sort Method', '?')}, {node.get('Sort Space Used', '?')} kB)",
+            })
+    return problems
+
+
+# -------------------------------- ИНДЕКСЫ --------------------------------
+
+def _clean_col(expr):
+    # "o.date DESC" --> ("date", "DESC")
+    expr = expr.strip()
+    desc = ' DESC' if re.search(r'\bdesc\b', expr, re.I) else ''
+    col = re.sub(r'\b(asc|desc)\b', '', expr, flags=re.I).strip().split('.')[-1].strip('"')
+    return col, desc
+
+
+def suggest_distinct_on_indexes(sql):
+    '''
+    DISTINCT ON (a) ... FROM t ... ORDER BY a, b DESC --> покрывающий индекс t (a, b DESC) INCLUDE (выбранные колонки)
+    '''
+    suggestions = []
+    pattern = re.compile(
+        r'DISTINCT\s+ON\s*\((?P<on>[^)]*)\)(?P<select>.*?)\bFROM\s+(?:public\.)?(?P<table>\w+)(?P<rest>.*?)\bORDER\s+BY\s+(?P<order>[^;\n)]+)',
+        re.I | re.S)
+    for m in pattern.finditer(sql):
+        table = m.group('table')
+        key = [_clean_col(c) for c in m.group('order').split(',') if c.strip()]
+        key_cols = [c for c, _ in key]
+        selected = []
+        for item in m.group('select').split(','):
+            item = item.strip()
+            if re.fullmatch(r'(\w+\.)?"?\w+"?', item):
+                col = _clean_col(item)[0]
+                if col not in key_cols and col not in selected:
+                    selected.append(col)
+        where_cols = re.findall(r'\b(\w+)\s*(?:=|!=|<>|>=|<=|>|<|LIKE)\s', m.group('rest'), re.I)
+        name = f"{table}_{'_'.join(key_cols)}_idx"
+        include = f" INCLUDE ({', '.join(selected)})" if selected else ''
+        predicate = ''
+        if re.search(r"local_vendor_code\s+LIKE\s+'wild%'", m.group('rest'), re.I):
+            predicate = " WHERE local_vendor_code LIKE 'wild%'"
+        suggestions.append(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(c + d for c, d in key)}){include}{predicate};"
+            + (f"  -- filter columns: {', '.join(sorted(set(where_cols)))}" if where_cols else '')
+        )
+    return suggestions
+
+
+def suggest_filter_indexes(conn, problems):
+    '''
+    Для Seq Scan с фильтром: индекс по колонкам таблицы, упомянутым в фильтре.
+    Функция над колонкой (date(created_at), date_part(...)) делает фильтр несаргабельным - предлагаем диапазон.
+    '''
+    suggestions = []
+    for p in problems:
+        if p['node'] != 'Seq Scan' or not p.get('filter'):
+            continue
+        table = p['relation']
+        columns = table_columns(conn, table)
+        used = [c for c in columns if re.search(rf'\b{re.escape(c)}\b', p['filter'])]
+        if not used:
+            continue
+        wrapped = re.findall(r'\b(date|date_part|date_trunc|lower|upper)\((?:[^()]*,\s*)?\(?(\w+)', p['filter'])
+        for func, col in wrapped:
+            suggestions.append(f"-- {table}: {func}({col}) in filter is not index-friendly, "
+                               f"use a range: {col} >= <start> AND {col} < <end>")
+        suggestions.append(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(used[:3])}_idx ON {table} ({', '.join(used[:3])});")
+    return suggestions
+
+
+# -------------------------------- ЗАПУСК --------------------------------
+
+def seed_synthetic_data(conn, scale = DEFAULT_SCALE):
+    '''
+    Пересоздаёт синтетические таблицы для запросов из реестра. Только для локальной БД.
+    '''
+    daily_fin = QUERY_REGISTRY['daily_penalties_to_gs.load_db_data']['params']['DB_DAILY_FIN']
+    with conn.cursor() as cur:
+        for table in SYNTHETIC_TABLES + [daily_fin]:
+            cur.execute(f'DROP TABLE IF EXISTS {table} CASCADE')
+        cur.execute(SYNTHETIC_SCHEMA.format(scale=int(scale), daily_fin=daily_fin))
+        for table in SYNTHETIC_TABLES + [daily_fin]:
+            cur.execute(f'ANALYZE {table}')
+    conn.commit()
+    logger.info(f'Synthetic data loaded, scale {scale}')
+
+
+def analyze_queries(conn, names = None, analyze = True):
+    '''
+    Returns: [{'name', 'cost', 'budget', 'time_ms', 'buffers', 'problems', 'suggestions', 'over_budget'}]
+    '''
+    report = []
+    for name, sql in collect_queries(names).items():
+        plan = explain(conn, sql, analyze=analyze)
+        root = plan['Plan']
+        problems = find_problems(plan)
+        suggestions = suggest_distinct_on_indexes(sql) if problems else []
+        suggestions += suggest_filter_indexes(conn, problems)
+        budget = QUERY_REGISTRY[name].get('max_cost')
+        report.append({
+            'name': name,
+            'cost': root['Total Cost'],
+            'budget': budget,
+            'time_ms': plan.get('Execution Time'),
+            'buffers': {k: root.get(k) for k in ('Shared Hit Blocks', 'Shared Read Blocks') if k in root},
+            'problems': problems,
+            'suggestions': list(dict.fromkeys(suggestions)),
+            'over_budget': budget is not None and root['Total Cost'] > budget,
+        })
+    return report
+
+
+def print_report(report):
+    for r in report:
+        status = 'OVER BUDGET' if r['over_budget'] else 'ok'
+        print(f"\n=== {r['name']}: cost {r['cost']:.0f} / budget {r['budget']} [{status}]"
+              + (f", {r['time_ms']:.1f} ms" if r['time_ms'] is not None else '') + f" {r['buffers']}")
+        for p in r['problems']:
+            print(f"  ! {p['detail']}")
+        for s in r['suggestions']:
+            print(f"  + {s}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='EXPLAIN-советчик по индексам для запросов из QUERY_REGISTRY')
+    # EXPLAIN ANALYZE выполняет запросы, поэтому БД из .env (прод) не подставляется - только явный --dsn
+    parser.add_argument('--dsn', required=True, help='локальная/тестовая БД (postgresql://...)')
+    parser.add_argument('--seed', action='store_true', help='залить синтетические данные')
+    parser.add_argument('--scale', type=int, default=DEFAULT_SCALE)
+    parser.add_argument('--query', action='append', help='имя запроса из реестра (можно несколько раз)')
+    parser.add_argument('--no-analyze', action='store_true', help='только EXPLAIN без выполнения запросов')
+    parser.add_argument('--check', action='store_true', help='код выхода 1, если запрос превысил max_cost')
+    parser.add_argument('--calibrate', action='store_true', help='вывести max_cost = текущая стоимость * 1.2')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.seed:
+            seed_synthetic_data(conn, args.scale)
+
+        report = analyze_queries(conn, args.query, analyze=not args.no_analyze)
+        print_report(report)
+
+        if args.calibrate:
+            print('\n# calibrated budgets')
+            for r in report:
+                print(f"{r['name']}: max_cost = {int(r['cost'] * 1.2)}")
+
+        over = [r['name'] for r in report if r['over_budget']]
+        if over:
+            logger.error(f'Queries over cost budget: {over}')
+            if args.check:
+                sys.exit(1)
+    finally:
+        conn.close()
@@ -12,9 +12,8 @@ import pandas as pd
 from datetime import datetime
 
 # my packages
-from utils.env_loader import *
 from utils.my_gspread import connect_to_local_sheet
-from utils.my_db_functions import fetch_db_data_into_dict
+from utils.snapshots import load_snapshot
 
 
 # ---- LOGS ----
@@ -32,60 +31,58 @@ logging.basicConfig(
 )
 
 
-def load_db_data(date_start = '2025-07-16'):
-    query_curr = f'''
+# прибыль и заказы по предметам за день - снапшот (utils/snapshots.py), из БД догружаются только последние дни
+QUERY_DAILY = '''
     SELECT
         date,
         subject_name,
-        manager,
-        SUM(profit_by_cond_orders - adv_spend) AS ЧП_РК,
-        SUM(orders_sum_rub) AS orders_sum_rub,
-        CASE 
-            WHEN SUM(orders_sum_rub) = 0 THEN NULL 
-            ELSE ROUND(SUM(profit_by_cond_orders - adv_spend) / SUM(orders_sum_rub), 4)
-        END as Рентабельность
-    FROM (
-        SELECT 
-            date,
-            subject_name,
-            FIRST_VALUE(manager) OVER (
-                PARTITION BY subject_name 
-                ORDER BY date DESC, date DESC
-            ) as manager,
-            profit_by_cond_orders,
-            adv_spend,
-            orders_sum_rub
-        FROM orders_articles_analyze
-        WHERE date >= '{date_start}'
-    ) subquery
-    GROUP BY date, subject_name, manager
-    '''
-    data = fetch_db_data_into_dict(query_curr)
-    # data = process_decimal_in_dict(data)
-    return data
+        MAX(manager) AS manager,
+        SUM(profit_by_cond_orders - adv_spend)::float8 AS ЧП_РК,
+        SUM(orders_sum_rub)::float8 AS orders_sum_rub
+    FROM orders_articles_analyze
+    WHERE date BETWEEN {date_from} AND {date_to}
+    GROUP BY date, subject_name
+'''
 
-def load_ror_by_day(date_start = '2025-07-16'):
 
-    query = f'''
-    SELECT
-        date,
-        CASE 
-            WHEN SUM(orders_sum_rub) = 0 THEN NULL
-            ELSE ROUND(SUM(profit_by_cond_orders - adv_spend) / SUM(orders_sum_rub), 4)
-        END AS Рентабельность
-    FROM orders_articles_analyze
-    WHERE date >= DATE '{date_start}'
-    GROUP BY date;
+def ror(profit, orders_sum):
+    '''
+    Рентабельность = ЧП_РК / сумма заказов (None при нулевых заказах)
     '''
+    return (profit / orders_sum.where(orders_sum != 0)).round(4).astype(object).where(orders_sum != 0, None)
+
 
-    return fetch_db_data_into_dict(query)
+def load_daily(date_start = '2025-07-16'):
+    return load_snapshot('ror_subject_daily', QUERY_DAILY, date_from=date_start)
+
+
+def load_db_data(date_start = '2025-07-16', daily = None):
+    '''
+    Рентабельность по предметам и дням; manager - последний менеджер предмета
+    '''
+    df = load_daily(date_start) if daily is None else daily.copy()
+    # менеджер предмета - из последнего дня, в котором предмет встречается
+    latest = df.sort_values('date').groupby('subject_name', dropna=False)['manager'].last()
+    df['manager'] = df['subject_name'].map(latest)
+    df['Рентабельность'] = ror(df['ЧП_РК'], df['orders_sum_rub'])
+    return df[['date', 'subject_name', 'manager', 'ЧП_РК', 'orders_sum_rub', 'Рентабельность']].to_dict('records')
+
+def load_ror_by_day(date_start = '2025-07-16', daily = None):
+    '''
+    Общая рентабельность по дням
+    '''
+    df = load_daily(date_start) if daily is None else daily
+    by_day = df.groupby('date')[['ЧП_РК', 'orders_sum_rub']].sum().sort_index()
+    by_day['Рентабельность'] = ror(by_day['ЧП_РК'], by_day['orders_sum_rub'])
+    return by_day.reset_index()[['date', 'Рентабельность']].to_dict('records')
 
 
 if __name__ == "__main__":
 
     try: 
         # load data
-        data = load_db_data()
+        daily = load_daily()
+        data = load_db_data(daily=daily)
         df = pd.DataFrame(data)
 
         # gather managers' names to add to the final df later
@@ -111,7 +108,7 @@ if __name__ == "__main__":
         raise
 
     try: 
-        mean_data = load_ror_by_day()
+        mean_data = load_ror_by_day(daily=daily)
         output_mean = [i['Рентабельность'] for i in mean_data]
         sh.update([output_mean], range_name = 'C1')
     except Exception as e:
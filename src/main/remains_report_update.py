@@ -11,11 +11,24 @@ from datetime import datetime, timedelta
 
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
-from utils.my_db_functions import fetch_db_data_into_dict
+from utils.my_api import wb_url
+from psycopg2.extras import execute_values
+from utils.my_db_functions import fetch_db_data_into_dict, fetch_db_data_into_list, get_df_from_db, create_connection_w_env
 from utils.my_gspread import connect_to_local_sheet, connect_to_remote_sheet, clean_number, column_number_to_letter
 
 logger = setup_logger("remains_report_update.log")
 
+SNAPSHOT_TABLE = 'wb_stocks_snapshot'
+PRODUCT_DIM_TABLE = 'product_dim'
+
+# метрики остатков WB: колонка снапшота --> заголовок в отчёте (в порядке вывода)
+STOCK_METRICS = {
+    'in_way_from_client': 'Возвращаются на склад',
+    'in_way_to_client': 'Едут к клиенту',
+    'quantity': 'Остатки на складах WB',
+}
+INFO_COLUMNS = ['Название', 'Категория', 'Себестоимость', 'Остаток факт склад']
+
 def get_wb_remains(api_token, date):
     '''
     Arguments:
@@ -23,7 +36,7 @@ def get_wb_remains(api_token, date):
     Result:
         Full json from WB API method supplier/stocks
     '''
-    url = 'https://statistics-api.wildberries.ru/api/v1/supplier/stocks'
+    url = wb_url('statistics', '/api/v1/supplier/stocks')
     headers = {'Authorization': api_token}
     params = {'dateFrom': date}
     response = requests.get(url, params=params, headers=headers)
@@ -107,106 +120,216 @@ async def get_wb_remains_for_clients(tokens: dict, date: str) -> list:
     return full_data
 
 
+def create_remains_tables(conn):
+    '''
+    Снапшот остатков WB по кабинетам (wild считается в БД из supplier_article)
+    и справочник товаров из листа Сопост
+    '''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SNAPSHOT_TABLE} (
+            snapshot_date DATE NOT NULL,
+            client TEXT NOT NULL,
+            warehouse_name TEXT,
+            supplier_article TEXT NOT NULL,
+            nm_id BIGINT,
+            barcode TEXT,
+            quantity INTEGER DEFAULT 0,
+            in_way_to_client INTEGER DEFAULT 0,
+            in_way_from_client INTEGER DEFAULT 0,
+            wild TEXT GENERATED ALWAYS AS (
+                regexp_replace(regexp_replace(supplier_article, '(\\d+)([dD].*)?$', '\\1'), '-d$', '', 'i')
+            ) STORED
+        );
+        CREATE INDEX IF NOT EXISTS {SNAPSHOT_TABLE}_date_client_idx ON {SNAPSHOT_TABLE} (snapshot_date, client);
+        CREATE INDEX IF NOT EXISTS {SNAPSHOT_TABLE}_date_wild_idx ON {SNAPSHOT_TABLE} (snapshot_date, wild);
+
+        CREATE TABLE IF NOT EXISTS {PRODUCT_DIM_TABLE} (
+            wild TEXT PRIMARY KEY,
+            name TEXT,
+            category TEXT,
+            purchase_price NUMERIC(12,2) DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+    conn.commit()
+
+
+def save_stocks_snapshot(conn, full_data, snapshot_date):
+    '''
+    Перезаписывает снапшот остатков за snapshot_date по кабинетам, которые пришли в full_data
+    '''
+    clients = sorted({item['client'] for item in full_data})
+    if not clients:
+        return
+
+    records = [(
+        snapshot_date,
+        item['client'],
+        item.get('warehouseName'),
+        item.get('supplierArticle') or '',
+        item.get('nmId'),
+        item.get('barcode'),
+        item.get('quantity') or 0,
+        item.get('inWayToClient') or 0,
+        item.get('inWayFromClient') or 0,
+    ) for item in full_data]
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DELETE FROM {SNAPSHOT_TABLE} WHERE snapshot_date = %s AND client = ANY(%s)", (snapshot_date, clients))
+            execute_values(cur, f"""
+                INSERT INTO {SNAPSHOT_TABLE} (snapshot_date, client, warehouse_name, supplier_article, nm_id,
+                    barcode, quantity, in_way_to_client, in_way_from_client)
+                VALUES %s
+            """, records, page_size=5000)
+        conn.commit()
+        logger.info(f'{SNAPSHOT_TABLE}: сохранено {len(records)} строк за {snapshot_date}')
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def sync_product_dim(conn):
+    '''
+    Обновляет справочник товаров (название, категория, себестоимость) из листа Сопост
+    '''
+    unit_data = load_data_from_sopost().drop_duplicates('item')
+    unit_data = unit_data[unit_data['item'].notna() & (unit_data['item'] != '')]
+    rows = [(r.item, r.name, r.category, r.purchase_price) for r in unit_data.itertuples(index=False)]
+
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, f"""
+                INSERT INTO {PRODUCT_DIM_TABLE} (wild, name, category, purchase_price)
+                VALUES %s
+                ON CONFLICT (wild) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    category = EXCLUDED.category,
+                    purchase_price = EXCLUDED.purchase_price,
+                    updated_at = NOW()
+            """, rows)
+        conn.commit()
+        logger.info(f'{PRODUCT_DIM_TABLE}: обновлено {len(rows)} товаров')
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def load_remains_pivot(snapshot_date, conn = None):
+    '''
+    Сводная wild x кабинет за snapshot_date одним запросом.
+    Колонки: wild, Название, Категория, Себестоимость, Остаток факт склад, затем по кабинетам
+    метрики STOCK_METRICS с именами "<кабинет>|<метрика>".
+    Wild-ы из справочника без остатков WB идут в конце с нулями.
+    '''
+    clients = [row[0] for row in fetch_db_data_into_list(
+        f"SELECT DISTINCT client FROM {SNAPSHOT_TABLE} WHERE snapshot_date = '{snapshot_date}' ORDER BY client", conn=conn)]
+
+    client_cols = ',\n'.join(
+        f'COALESCE(SUM(s.{col}) FILTER (WHERE s.client = {sql_literal(client)}), 0) AS {col}_{i}'
+        for i, client in enumerate(clients) for col in STOCK_METRICS
+    )
+    # длинные кириллические имена не влезают в 63 байта идентификатора Postgres - переименовываем после запроса
+    client_titles = [f'{client}|{title}' for client in clients for title in STOCK_METRICS.values()]
+
+    query = f'''
+    WITH stock AS (
+        SELECT wild, client, quantity, in_way_to_client, in_way_from_client
+        FROM {SNAPSHOT_TABLE}
+        WHERE snapshot_date = '{snapshot_date}'
+    ),
+    balances AS (
+        SELECT product_id AS wild, SUM(physical_quantity) AS full_quantity
+        FROM current_balances
+        WHERE product_id LIKE 'wild%'
+        GROUP BY product_id
+    ),
+    wilds AS (
+        SELECT wild, TRUE AS in_wb FROM stock GROUP BY wild
+        UNION ALL
+        SELECT p.wild, FALSE FROM {PRODUCT_DIM_TABLE} p
+        WHERE NOT EXISTS (SELECT 1 FROM stock s WHERE s.wild = p.wild)
+    )
+    SELECT
+        w.wild,
+        COALESCE(MAX(p.name), '0') AS "Название",
+        COALESCE(MAX(p.category), '0') AS "Категория",
+        COALESCE(MAX(p.purchase_price), 0) AS "Себестоимость",
+        COALESCE(MAX(b.full_quantity), 0) AS "Остаток факт склад"{',' if client_cols else ''}
+        {client_cols}
+    FROM wilds w
+    LEFT JOIN stock s ON s.wild = w.wild
+    LEFT JOIN {PRODUCT_DIM_TABLE} p ON p.wild = w.wild
+    LEFT JOIN balances b ON b.wild = w.wild
+    GROUP BY w.wild, w.in_wb
+    ORDER BY w.in_wb DESC, w.wild
+    '''
+    df = get_df_from_db(query, conn=conn)
+    df.columns = ['wild'] + INFO_COLUMNS + client_titles
+    return df
+
+
+def pivot_to_sheet_values(df):
+    '''
+    Две строки заголовков (кабинет / метрика) + данные, как раньше давал MultiIndex pivot_table
+    '''
+    header_row_1, header_row_2 = [], []
+    for col in df.columns:
+        client, _, metric = col.partition('|')
+        if col == 'wild' or col in INFO_COLUMNS:
+            header_row_1.append(col)
+            header_row_2.append('')
+        else:
+            header_row_1.append(client)
+            header_row_2.append(metric)
+    return [header_row_1, header_row_2] + df.values.tolist()
+
+
+def update_remains_report(snapshot_date, fetch_from_api = True):
+    '''
+    Обновляет лист "Стоимость остатков"/"Таблица". При fetch_from_api=False отчёт
+    пересобирается из сохранённого снапшота (в т.ч. за прошлые даты).
+    '''
+    conn = create_connection_w_env()
+    try:
+        create_remains_tables(conn)
+
+        if fetch_from_api:
+            tokens = load_api_tokens()
+            full_data = asyncio.run(get_wb_remains_for_clients(tokens, snapshot_date))
+            logger.info(f"Total records: {len(full_data)}")
+            save_stocks_snapshot(conn, full_data, snapshot_date)
+
+        sync_product_dim(conn)
+        final_df = load_remains_pivot(snapshot_date, conn=conn)
+    finally:
+        conn.close()
+
+    values = pivot_to_sheet_values(final_df)
+
+    sh = connect_to_remote_sheet('Стоимость остатков', 'Таблица')
+    letter_range_end = column_number_to_letter(len(final_df.columns))
+    output_range = f"A3:{letter_range_end}{len(final_df) + 4}"
+
+    sh.update(values, range_name=output_range)
+    sh.update([[f'Актуализировано на {datetime.now().strftime("%d.%m.%Y %H:%M")}']], range_name = 'B1')
+
+
 if __name__ == "__main__":
 
     try:
+        # python remains_report_update.py [YYYY-MM-DD] - пересобрать отчёт из снапшота за дату
+        if len(sys.argv) > 1:
+            update_remains_report(sys.argv[1], fetch_from_api=False)
+        else:
+            date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            update_remains_report(date)
 
-        # 1. load data from api
-        tokens = load_api_tokens()
-        date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-
-        full_data = asyncio.run(get_wb_remains_for_clients(tokens, date))
-        print(f"Total records: {len(full_data)}")
-
-        wb_data = pd.DataFrame(full_data)
-        short_df = wb_data.drop(columns = ['lastChangeDate', 'warehouseName', 'nmId', 'barcode', 'brand', 'techSize', 'Price', 'Discount', 'isSupply', 'isRealization', 'SCCode', 'quantityFull'])
-        short_df.rename(columns={'item_base' : 'wild',
-                                'quantity': 'Остатки на складах WB',
-                                'inWayToClient': 'Едут к клиенту',
-                                'inWayFromClient': 'Возвращаются на склад'}, inplace=True)
-        short_df['wild'] = short_df['supplierArticle'].str.replace(r'(\d+)([dD].*)?$', r'\1', regex=True) # process wild1234d, wild1234d1
-        short_df['wild'] = short_df['wild'].str.replace(r'-d$', '', case=False, regex=True) # process wild1234-d
-        
-        final_df = short_df.drop(columns=['supplierArticle', 'category', 'subject']) \
-        .pivot_table(columns='client', index='wild', aggfunc='sum') \
-        .swaplevel(axis=1) \
-        .sort_index(axis=1).fillna(0)
-
-        # 2. load data from unit
-        unit_data = load_data_from_sopost()
-        unit_data = unit_data.drop_duplicates('item')
-        unit_data = unit_data.rename(columns = {'item': 'wild',
-                                            'name': 'Название',
-                                            'category': 'Категория', 
-                                            'purchase_price': 'Себестоимость'})
-
-        # 3. map
-        info_dict = unit_data.set_index('wild')[['Название', 'Категория', 'Себестоимость']].to_dict('index')
-
-        for col in ['Название', 'Категория', 'Себестоимость']:
-            final_df[col] = final_df.index.map(lambda x: info_dict.get(x, {}).get(col))
-
-
-        # add logic with current_balances
-        current_balances = load_current_balances()
-        final_df[('Остаток факт склад', '')] = final_df.index.map(lambda x: current_balances.get(x, 0))
-
-       # --- 3b. add unit-only wilds that are missing from final_df ---
-        missing_wilds = list(set(unit_data['wild']) - set(final_df.index))
-
-        if missing_wilds:
-            # create a DataFrame with same columns as final_df
-            extra_rows = pd.DataFrame(
-                0,
-                index=missing_wilds,
-                columns=final_df.columns
-            )
-            
-            # fill unit info columns (with correct MultiIndex tuples)
-            for col in [('Название',''), ('Категория',''), ('Себестоимость','')]:
-                extra_rows[col] = extra_rows.index.map(lambda x: info_dict.get(x, {}).get(col[0]))
-            
-            # fill current balances column
-            extra_rows[('Остаток факт склад','')] = extra_rows.index.map(lambda x: current_balances.get(x, 0))
-            
-            # append to final_df
-            final_df = pd.concat([final_df, extra_rows], axis=0)
-
-
-        # 4. reorder
-        cols_to_front = [
-            ('Название', ''),
-            ('Категория', ''),
-            ('Себестоимость', ''),
-            ('Остаток факт склад', '')
-        ]
-
-        remaining_cols = [col for col in final_df.columns if col not in cols_to_front]
-        final_df = final_df[cols_to_front + remaining_cols]
-
-
-        final_df = final_df.fillna(0)
-        final_df_reset = final_df.reset_index()
-        final_df_reset = final_df.reset_index().rename(columns={'index': 'wild'})
-
-        # final_df_reset.to_excel('test.xlsx')
-
-        # 5. upload to gs
-        level0 = final_df_reset.columns.get_level_values(0).tolist()  # e.g., 'Вектор', 'Даниелян', ...
-        level1 = final_df_reset.columns.get_level_values(1).tolist()  # e.g., 'Едут к клиенту', ...
-        header_row_1 = level0
-        header_row_2 = level1
-        data_rows = final_df_reset.values.tolist()
-        values = [header_row_1, header_row_2] + data_rows
-
-        sh = connect_to_remote_sheet('Стоимость остатков', 'Таблица')
-        letter_range_end = column_number_to_letter(len(final_df.columns))
-        output_range = f"A3:{letter_range_end}{len(final_df) + 4}"
-
-        sh.update(values, range_name=output_range)
-        sh.update([[f'Актуализировано на {datetime.now().strftime("%d.%m.%Y %H:%M")}']], range_name = 'B1')
-
-        # logger.info('Successfully updated the gs table')
-    
     except Exception as e:
-        logger.error(str(e))
\ No newline at end of file
+        logger.error(str(e))
+        raise
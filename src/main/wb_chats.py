@@ -9,6 +9,7 @@ from datetime import datetime
 from typing import Dict, Any
 
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.logger import setup_logger
 from utils.my_db_functions import create_connection_w_env
 
@@ -22,7 +23,7 @@ async def fetch_events_page(
     next_timestamp: int
 ) -> Dict[str, Any]:
     """Выполняет один запрос к API Wildberries и возвращает события."""
-    url = f"https://buyer-chat-api.wildberries.ru/api/v1/seller/events?next={next_timestamp}"
+    url = wb_url('chat', f"/api/v1/seller/events?next={next_timestamp}")
     headers = {"Authorization": token, "Content-Type": "application/json"}
 
     try:
@@ -8,6 +8,7 @@ import time
 # from utils.env_loader import *
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_db_functions import create_connection_w_env
 from dotenv import load_dotenv
 
@@ -28,7 +29,7 @@ def get_wb_stocks(api_token: str, date_from: str = "2019-06-20T00:00:00") -> lis
         list: Список всех записей остатков.
     """
 
-    url = "https://statistics-api.wildberries.ru/api/v1/supplier/stocks"
+    url = wb_url('statistics', "/api/v1/supplier/stocks")
     headers = {"Authorization": api_token}
     all_stocks = []
     current_date = date_from
@@ -117,6 +118,7 @@ if __name__ == "__main__":
     
     tokens = load_api_tokens()
     conn = create_connection_w_env()
+    failed = []
 
     for client, token in tokens.items():
         try:
@@ -131,6 +133,11 @@ if __name__ == "__main__":
 
         except Exception as e:
             logger.error(f"Ошибка обработки клиента {client}: {e}")
+            failed.append(client)
             continue
 
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+    # остальные кабинеты обработаны, но прогон неуспешный - оркестратор повторит его и не посчитает остатки свежими
+    if failed:
+        sys.exit(f"Не обновлены остатки по кабинетам: {', '.join(failed)}")
\ No newline at end of file
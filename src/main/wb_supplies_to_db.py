@@ -13,6 +13,7 @@ from psycopg2.extras import execute_values
 
 from utils.logger import setup_logger
 from utils.utils import load_api_tokens
+from utils.my_api import wb_url
 from utils.my_db_functions import create_connection_w_env, fetch_db_data_into_list
 
 # ---- LOGS ----
@@ -24,7 +25,7 @@ def get_supplies_paginated(token, limit=1000):
     Отдает номера поставок и заказов по одному клиенту.
     В БД не хранится, т.к. все отдаваемые данные есть в другом методе
     '''
-    base_url = "https://supplies-api.wildberries.ru/api/v1/supplies"
+    base_url = wb_url('supplies', "/api/v1/supplies")
 
     headers = {
         "Authorization": token,
@@ -70,7 +71,7 @@ def get_supply_by_id(ID: int, token: str, is_preorder: bool = False) -> dict:
     """
     Fetches a single supply by ID.
     """
-    url = f"https://supplies-api.wildberries.ru/api/v1/supplies/{ID}"
+    url = wb_url('supplies', f"/api/v1/supplies/{ID}")
     headers = {
         "Authorization": token,
         "Content-Type": "application/json"
@@ -116,7 +117,7 @@ def get_supply_goods(ID: int, token: str, limit: int = 1000, is_preorder: bool =
     Fetch all goods for a single supply ID, handling pagination (offset).
     Returns a list of dictionaries, each with 'ID' added.
     """
-    url = f"https://supplies-api.wildberries.ru/api/v1/supplies/{ID}/goods"
+    url = wb_url('supplies', f"/api/v1/supplies/{ID}/goods")
     headers = {
         "Authorization": token,
         "Content-Type": "application/json"
@@ -0,0 +1,5 @@
+# .env загружается один раз при первом импорте utils: скрипты из main читают os.getenv на уровне модуля.
+# Остальные модули utils при импорте ничего не читают и тяжёлые библиотеки подгружают по мере надобности
+from .env import load_env
+
+load_env()
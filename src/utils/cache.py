@@ -0,0 +1,202 @@
+'''
+Кеш для медленных и редко меняющихся справочников (артикулы/ЛК из UNIT, закупочные цены, менеджеры).
+
+    @cached(ttl=6 * 3600, disk=True)
+    def get_purchase_price_from_db(): ...
+
+Два уровня:
+    - в памяти процесса (cachetools.TTLCache) - повторные вызовы в одном прогоне;
+    - на диске (SQLite в CACHE_DIR, по умолчанию data/cache) - общий для всех процессов из крона, с тем же сроком жизни.
+Ключ - имя функции + аргументы (открытый лист gspread - по id таблицы и листа). Результат отдаётся копией,
+так что правка результата кеш не портит.
+
+Сброс:
+    get_purchase_price_from_db.cache_clear()       # одна функция, оба уровня
+    invalidate('utils.my_gspread')                 # все функции с этим префиксом
+    python -m utils.cache clear [префикс]          # из консоли / после ручной правки таблиц
+    python -m utils.cache list
+CACHE_DISABLED=1 отключает кеш целиком (например, для отладки).
+'''
+import os
+import sys
+import copy
+import time
+import pickle
+import sqlite3
+import logging
+import inspect
+import threading
+from functools import wraps
+
+from cachetools import TTLCache
+
+from .env import BASE_DIR
+
+
+_registry = {}   # имя функции -> обёртка (для invalidate и CLI)
+
+
+def cache_disabled():
+    return os.getenv('CACHE_DISABLED', '').lower() in ('1', 'true', 'yes')
+
+
+# -------------------------------- диск --------------------------------
+
+class DiskCache:
+    '''
+    SQLite-файл с pickle-значениями и временем истечения. Безопасен для нескольких процессов (WAL + busy timeout)
+    '''
+
+    def __init__(self, path = None):
+        self.path = path or os.path.join(os.getenv('CACHE_DIR') or BASE_DIR / 'data' / 'cache', 'cache.sqlite')
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    func TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute('SELECT value, expires_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return pickle.loads(row[0])
+
+    def set(self, key, func, value, ttl):
+        now = time.time()
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache (key, func, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+            (key, func, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now + ttl))
+
+    def delete(self, func_prefix = ''):
+        cur = self._conn().execute('DELETE FROM cache WHERE func LIKE ? OR expires_at < ?',
+                                   (func_prefix + '%', time.time()))
+        return cur.rowcount
+
+    def entries(self):
+        return self._conn().execute('''
+            SELECT func, COUNT(*), SUM(LENGTH(value)), MIN(created_at), MAX(expires_at)
+            FROM cache GROUP BY func ORDER BY func
+        ''').fetchall()
+
+
+_disk = None
+
+
+def disk_cache():
+    global _disk
+    if _disk is None:
+        _disk = DiskCache()
+    return _disk
+
+
+# -------------------------------- декоратор --------------------------------
+
+def key_value(value):
+    '''
+    Значение аргумента для ключа: лист gspread - по id таблицы и листа, остальное - как есть
+    '''
+    if hasattr(value, 'spreadsheet_id') and hasattr(value, 'id'):
+        return f'<worksheet {value.spreadsheet_id}/{value.id}>'
+    return value
+
+
+def cached(ttl, disk = False, maxsize = 128, bypass_args = ()):
+    '''
+    ttl - срок жизни в секундах; disk - хранить ещё и в общем файле (результат должен пиклиться и не содержать секретов);
+    bypass_args - аргументы, при передаче которых (не None) кеш не используется,
+    например уже открытый лист sh: данные могут быть из другой таблицы
+    '''
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        signature = inspect.signature(func)
+        memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        lock = threading.Lock()
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if any(bound.arguments.get(arg) is not None for arg in bypass_args):
+                return None
+            return f'{name}:{ {arg: key_value(value) for arg, value in bound.arguments.items()}!r}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = None if cache_disabled() else make_key(args, kwargs)
+            if key is None:
+                return func(*args, **kwargs)
+
+            with lock:
+                if key in memory:
+                    return copy.deepcopy(memory[key])
+
+            value = None
+            if disk:
+                try:
+                    value = disk_cache().get(key)
+                except (sqlite3.Error, pickle.UnpicklingError, OSError) as e:
+                    logging.warning(f'Кеш {name}: не удалось прочитать с диска: {e}')
+            if value is None:
+                value = func(*args, **kwargs)
+                if disk and value is not None:
+                    try:
+                        disk_cache().set(key, name, value, ttl)
+                    except (sqlite3.Error, pickle.PicklingError, OSError) as e:
+                        logging.warning(f'Кеш {name}: не удалось сохранить на диск: {e}')
+
+            with lock:
+                memory[key] = value
+            return copy.deepcopy(value)
+
+        def cache_clear():
+            with lock:
+                memory.clear()
+            if disk:
+                disk_cache().delete(name)
+
+        wrapper.cache_clear = cache_clear
+        _registry[name] = wrapper
+        return wrapper
+
+    return decorator
+
+
+def invalidate(prefix = ''):
+    '''
+    Сбрасывает кеш функций, чьё полное имя (модуль.функция) начинается с prefix; '' - весь кеш
+    '''
+    for name, wrapper in _registry.items():
+        if name.startswith(prefix):
+            wrapper.cache_clear()
+    try:
+        return disk_cache().delete(prefix)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f'Не удалось очистить кеш на диске: {e}')
+        return 0
+
+
+if __name__ == "__main__":
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if command == 'clear':
+        prefix = sys.argv[2] if len(sys.argv) > 2 else ''
+        print(f'Удалено записей: {invalidate(prefix)}')
+    elif command == 'list':
+        for func, count, size, created, expires in disk_cache().entries():
+            print(f"{func:<55} {count:>4} шт. {size / 1024:>8.1f} KB  "
+                  f"до {time.strftime('%Y-%m-%d %H:%M', time.localtime(expires))}")
+    else:
+        sys.exit('usage: python -m utils.cache [list | clear [prefix]]')
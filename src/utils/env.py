@@ -0,0 +1,41 @@
+'''
+Переменные окружения и пути к файлам с доступами.
+
+.env читается один раз на процесс (load_env), пути к creds/tokens считаются при обращении,
+а не при импорте - чтобы импорт utils не падал без CREDS_DIR и ничего не читал с диска зря.
+'''
+import os
+from pathlib import Path
+from functools import cache
+
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+
+
+@cache
+def load_env():
+    '''
+    Загружает .env (уже заданные переменные окружения не перезаписываются). Повторные вызовы ничего не делают
+    '''
+    from dotenv import load_dotenv
+    load_dotenv()
+    return True
+
+
+def env_path(dir_var, file_var):
+    '''
+    BASE_DIR / $dir_var / $file_var (абсолютный путь в переменной тоже работает)
+    '''
+    load_env()
+    directory, filename = os.getenv(dir_var), os.getenv(file_var)
+    if not directory or not filename:
+        raise RuntimeError(f'Не заданы переменные окружения {dir_var} / {file_var}')
+    return BASE_DIR / directory / filename
+
+
+def tokens_path():
+    return env_path('CREDS_DIR', 'TOKENS_FILE')
+
+
+def creds_path():
+    return env_path('CREDS_DIR', 'CREDS_FILE')
@@ -0,0 +1,739 @@
+'''
+Фейковый Google Sheets / Drive для офлайн-проверки и замеров кода на gspread.
+
+Ячейки хранятся в памяти (FakeSheetsBackend). Поддерживаются values.get / batchGet / update / batchUpdate /
+clear / batchClear / append, spreadsheets.get и spreadsheets.batchUpdate (deleteDimension, insertDimension,
+appendDimension, updateSheetProperties, addSheet, deleteSheet; форматирование принимается и игнорируется),
+поиск и создание таблиц через Drive. Запросы считаются (в т.ч. пик за минуту), можно включить квоты
+на чтение/запись в минуту и подмешивать 429.
+
+В одном процессе:
+    backend = FakeSheetsBackend()
+    backend.add_spreadsheet('UNIT 2.0 (tested)', {'MAIN (tested)': [['Артикул', 'Мар'], [123, 10]]})
+    gc = fake_client(backend)                       # gspread.Client без сети и авторизации
+
+Отдельным сервером (для скриптов из main, см. my_gspread.init_client):
+    python -m utils.fake_gspread --port 8090 --seed-file sheets.json
+    GSHEETS_FAKE_URL=http://127.0.0.1:8090 python main/autopilot_hourly.py
+'''
+import re
+import json
+import time
+import uuid
+import argparse
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import gspread
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+
+SHEETS_PREFIX = '/v4/spreadsheets'
+DRIVE_PREFIX = '/drive/v3/files'
+GOOGLE_HOSTS = ('sheets.googleapis.com', 'www.googleapis.com')
+
+DEFAULT_ROWS = 1000
+DEFAULT_COLS = 26
+
+CELL_RE = re.compile(r'^([A-Za-z]*)(\d*)(?::([A-Za-z]*)(\d*))?$')
+NUMBER_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+
+class FakeSheetsError(Exception):
+
+    def __init__(self, status, message, reason = 'INVALID_ARGUMENT'):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.reason = reason
+
+
+# -------------------------------- A1 --------------------------------
+
+def col_to_num(letters):
+    num = 0
+    for ch in letters.upper():
+        num = num * 26 + ord(ch) - 64
+    return num
+
+
+def num_to_col(num):
+    letters = ''
+    while num:
+        num, rem = divmod(num - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def quote_title(title):
+    if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', title) and not re.fullmatch(r'[A-Za-z]{1,3}\d+', title):
+        return title
+    return "'" + title.replace("'", "''") + "'"
+
+
+def split_range(range_name):
+    '''
+    "'Лист 1'!A2:C" -> ("Лист 1", "A2:C"); "A1:B2" -> (None, "A1:B2"); "Лист1" -> ("Лист1", None)
+    '''
+    if '!' in range_name:
+        sheet, cells = range_name.rsplit('!', 1)
+    elif CELL_RE.match(range_name) and range_name:
+        return None, range_name
+    else:
+        sheet, cells = range_name, None
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, cells
+
+
+def parse_cells(cells, rows, cols):
+    '''
+    A1-диапазон -> (r1, c1, r2, c2, single) в 0-based с исключающими концами; открытые края - до конца сетки
+    '''
+    if not cells:
+        return 0, 0, rows, cols, False
+    m = CELL_RE.match(cells)
+    if not m:
+        raise FakeSheetsError(400, f'Unable to parse range: {cells}')
+    col1, row1, col2, row2 = m.groups()
+    single = ':' not in cells
+    if single:
+        col2, row2 = col1, row1
+    r1 = int(row1) - 1 if row1 else 0
+    c1 = col_to_num(col1) - 1 if col1 else 0
+    r2 = int(row2) if row2 else rows
+    c2 = col_to_num(col2) if col2 else cols
+    return r1, c1, r2, c2, single and bool(col1 and row1)
+
+
+def a1(r1, c1, r2, c2):
+    start = f'{num_to_col(c1 + 1)}{r1 + 1}'
+    end = f'{num_to_col(c2)}{r2}'
+    return start if start == end else f'{start}:{end}'
+
+
+# -------------------------------- значения --------------------------------
+
+def parse_user_entered(value):
+    if isinstance(value, str) and NUMBER_RE.match(value.strip()):
+        number = float(value)
+        return int(number) if number.is_integer() and '.' not in value and 'e' not in value.lower() else number
+    if isinstance(value, str) and value.upper() in ('TRUE', 'FALSE'):
+        return value.upper() == 'TRUE'
+    return value
+
+
+def render(value, option):
+    if value is None or value == '':
+        return ''
+    if option in ('UNFORMATTED_VALUE', 'FORMULA'):
+        return value
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+def trim(rows):
+    '''
+    Как настоящий API: без пустых хвостов в строках и без пустых строк в конце
+    '''
+    out = []
+    for row in rows:
+        while row and row[-1] == '':
+            row = row[:-1]
+        out.append(row)
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+
+class FakeSheet:
+
+    def __init__(self, sheet_id, title, index, rows = DEFAULT_ROWS, cols = DEFAULT_COLS):
+        self.sheet_id = sheet_id
+        self.title = title
+        self.index = index
+        self.rows = rows
+        self.cols = cols
+        self.cells = {}   # (row, col) -> value, 0-based
+
+    def properties(self):
+        return {'sheetId': self.sheet_id, 'title': self.title, 'index': self.index, 'sheetType': 'GRID',
+                'gridProperties': {'rowCount': self.rows, 'columnCount': self.cols}}
+
+    def read(self, r1, c1, r2, c2, option = 'FORMATTED_VALUE', major = 'ROWS'):
+        r2, c2 = min(r2, self.rows), min(c2, self.cols)
+        rows = [[render(self.cells.get((r, c)), option) for c in range(c1, c2)] for r in range(r1, r2)]
+        if major == 'COLUMNS':
+            rows = [list(col) for col in zip(*rows)] if rows else []
+        return trim(rows)
+
+    def write(self, r1, c1, values, user_entered):
+        if r1 + len(values) > self.rows or c1 + max((len(v) for v in values), default=0) > self.cols:
+            raise FakeSheetsError(400, f"Range ('{self.title}'!{num_to_col(c1 + 1)}{r1 + len(values)}) exceeds grid limits. "
+                                       f"Max rows: {self.rows}, max columns: {self.cols}")
+        written = 0
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                if value is None:
+                    continue   # null пропускается, как в API
+                value = parse_user_entered(value) if user_entered else value
+                if value == '':
+                    self.cells.pop((r1 + i, c1 + j), None)
+                else:
+                    self.cells[(r1 + i, c1 + j)] = value
+                written += 1
+        return written
+
+    def clear(self, r1, c1, r2, c2):
+        for key in [k for k in self.cells if r1 <= k[0] < r2 and c1 <= k[1] < c2]:
+            del self.cells[key]
+
+    def last_row(self, c1, c2):
+        rows = [r for r, c in self.cells if c1 <= c < c2]
+        return max(rows) + 1 if rows else 0
+
+    def delete_dimension(self, dimension, start, end):
+        axis = 0 if dimension == 'ROWS' else 1
+        count = end - start
+        moved = {}
+        for key, value in self.cells.items():
+            pos = key[axis]
+            if start <= pos < end:
+                continue
+            if pos >= end:
+                key = (key[0] - count, key[1]) if axis == 0 else (key[0], key[1] - count)
+            moved[key] = value
+        self.cells = moved
+        if axis == 0:
+            self.rows -= count
+        else:
+            self.cols -= count
+
+    def insert_dimension(self, dimension, start, end):
+        axis = 0 if dimension == 'ROWS' else 1
+        count = end - start
+        moved = {}
+        for key, value in self.cells.items():
+            if key[axis] >= start:
+                key = (key[0] + count, key[1]) if axis == 0 else (key[0], key[1] + count)
+            moved[key] = value
+        self.cells = moved
+        if axis == 0:
+            self.rows += count
+        else:
+            self.cols += count
+
+    def resize(self, rows = None, cols = None):
+        if rows is not None:
+            self.rows = rows
+        if cols is not None:
+            self.cols = cols
+        self.cells = {k: v for k, v in self.cells.items() if k[0] < self.rows and k[1] < self.cols}
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, spreadsheet_id, title):
+        self.id = spreadsheet_id
+        self.title = title
+        self.sheets = []
+        self.created = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+
+    def add_sheet(self, title, rows = DEFAULT_ROWS, cols = DEFAULT_COLS, sheet_id = None):
+        if any(s.title == title for s in self.sheets):
+            raise FakeSheetsError(400, f'A sheet with the name "{title}" already exists.')
+        if sheet_id is None:
+            sheet_id = 0 if not self.sheets else max(s.sheet_id for s in self.sheets) + 1
+        sheet = FakeSheet(sheet_id, title, len(self.sheets), rows, cols)
+        self.sheets.append(sheet)
+        return sheet
+
+    def sheet(self, title = None, sheet_id = None):
+        if title is None and sheet_id is None:
+            return self.sheets[0]
+        for s in self.sheets:
+            if (title is not None and s.title == title) or (sheet_id is not None and s.sheet_id == sheet_id):
+                return s
+        raise FakeSheetsError(400, f'Unable to parse range: {title if title is not None else sheet_id}')
+
+    def metadata(self):
+        return {'spreadsheetId': self.id,
+                'properties': {'title': self.title, 'locale': 'ru_RU', 'timeZone': 'Europe/Moscow'},
+                'sheets': [{'properties': s.properties()} for s in self.sheets],
+                'spreadsheetUrl': f'https://docs.google.com/spreadsheets/d/{self.id}/edit'}
+
+
+# -------------------------------- backend --------------------------------
+
+class FakeSheetsBackend:
+    '''
+    Таблицы в памяти + счётчики запросов и квоты.
+    read_quota / write_quota - запросов в минуту (None - без ограничения), как пользовательская квота Sheets API.
+    '''
+
+    def __init__(self, read_quota = None, write_quota = None):
+        self.spreadsheets = {}
+        self.read_quota = read_quota
+        self.write_quota = write_quota
+        self._injected = deque()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests_count = 0
+        self.reads = 0
+        self.writes = 0
+        self.cells_written = 0
+        self.throttled_count = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.by_method = {}
+        self.peak_per_minute = 0
+        self._recent = {'all': deque(), 'read': deque(), 'write': deque()}
+
+    def stats(self):
+        return {'requests': self.requests_count, 'reads': self.reads, 'writes': self.writes,
+                'cells_written': self.cells_written, 'throttled': self.throttled_count,
+                'peak_per_minute': self.peak_per_minute, 'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent, 'by_method': dict(self.by_method)}
+
+    def inject_errors(self, count = 1, status = 429):
+        '''
+        Следующие count запросов получат ошибку status (по умолчанию 429 RESOURCE_EXHAUSTED)
+        '''
+        self._injected.extend([status] * count)
+
+    # ---- данные ----
+
+    def add_spreadsheet(self, title, sheets = None, rows = DEFAULT_ROWS, cols = DEFAULT_COLS, spreadsheet_id = None):
+        '''
+        sheets: {название листа: значения (список строк)}. Returns id таблицы
+        '''
+        spreadsheet = FakeSpreadsheet(spreadsheet_id or uuid.uuid4().hex, title)
+        for name, values in (sheets or {'Sheet1': []}).items():
+            values = values or []
+            sheet = spreadsheet.add_sheet(name, max(rows, len(values)), max(cols, max((len(v) for v in values), default=0)))
+            sheet.write(0, 0, values, user_entered=False)
+        self.spreadsheets[spreadsheet.id] = spreadsheet
+        return spreadsheet.id
+
+    def by_title(self, title):
+        return [s for s in self.spreadsheets.values() if s.title == title]
+
+    def values(self, title, sheet_name = None, option = 'FORMATTED_VALUE'):
+        '''
+        Все значения листа (для проверок в тестах)
+        '''
+        sheet = self.by_title(title)[0].sheet(sheet_name)
+        return sheet.read(0, 0, sheet.rows, sheet.cols, option)
+
+    def _spreadsheet(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets:
+            raise FakeSheetsError(404, 'Requested entity was not found.', 'NOT_FOUND')
+        return self.spreadsheets[spreadsheet_id]
+
+    def _resolve(self, spreadsheet, range_name):
+        title, cells = split_range(range_name)
+        if title is None and any(s.title == cells for s in spreadsheet.sheets):
+            title, cells = cells, None   # "Sheet1" - имя листа, а не ячейка
+        sheet = spreadsheet.sheet(title)
+        r1, c1, r2, c2, single = parse_cells(cells, sheet.rows, sheet.cols)
+        return sheet, r1, c1, r2, c2, single
+
+    # ---- учёт запросов ----
+
+    def _account(self, kind):
+        now = time.monotonic()
+        for key in ('all', kind):
+            window = self._recent[key]
+            while window and now - window[0] > 60:
+                window.popleft()
+        if self._injected:
+            self.throttled_count += 1
+            status = self._injected.popleft()
+            raise FakeSheetsError(status, 'Injected error', 'RESOURCE_EXHAUSTED' if status == 429 else 'UNAVAILABLE')
+        quota = self.read_quota if kind == 'read' else self.write_quota
+        if quota is not None and len(self._recent[kind]) >= quota:
+            self.throttled_count += 1
+            metric = 'Read requests' if kind == 'read' else 'Write requests'
+            raise FakeSheetsError(429, f"Quota exceeded for quota metric '{metric}' and limit '{metric} per minute per user'",
+                                  'RESOURCE_EXHAUSTED')
+        for key in ('all', kind):
+            self._recent[key].append(now)
+        self.peak_per_minute = max(self.peak_per_minute, len(self._recent['all']))
+        self.requests_count += 1
+        if kind == 'read':
+            self.reads += 1
+        else:
+            self.writes += 1
+
+    def handle(self, method, path, params = None, body = None):
+        '''
+        Обработка одного запроса к Sheets/Drive API. params - {ключ: [значения]} как из parse_qs.
+        Returns (HTTP статус, JSON-ответ)
+        '''
+        params = params or {}
+        method = method.upper()
+        try:
+            name, handler, args = self._route(method, unquote(path))
+            self.by_method[name] = self.by_method.get(name, 0) + 1
+            self._account('read' if method == 'GET' else 'write')
+            return 200, handler(*args, params=params, body=body or {})
+        except FakeSheetsError as e:
+            return e.status, {'error': {'code': e.status, 'message': e.message, 'status': e.reason}}
+
+    def _route(self, method, path):
+        if path.startswith(DRIVE_PREFIX):
+            file_id = path[len(DRIVE_PREFIX):].strip('/')
+            if method == 'GET' and not file_id:
+                return 'drive.files.list', self._drive_list, ()
+            if method == 'POST' and not file_id:
+                return 'drive.files.create', self._drive_create, ()
+            if method == 'DELETE' and file_id:
+                return 'drive.files.delete', self._drive_delete, (file_id,)
+        elif path.startswith(SHEETS_PREFIX + '/'):
+            rest = path[len(SHEETS_PREFIX) + 1:]
+            spreadsheet_id, _, tail = rest.partition('/')
+            if ':' in spreadsheet_id and not tail:
+                spreadsheet_id, action = spreadsheet_id.split(':', 1)
+                if method == 'POST' and action == 'batchUpdate':
+                    return 'batchUpdate', self._batch_update, (spreadsheet_id,)
+            elif not tail and method == 'GET':
+                return 'get', self._metadata, (spreadsheet_id,)
+            elif tail.startswith('values:'):
+                action = tail[len('values:'):]
+                if method == 'GET' and action == 'batchGet':
+                    return 'values.batchGet', self._values_batch_get, (spreadsheet_id,)
+                if method == 'POST' and action == 'batchUpdate':
+                    return 'values.batchUpdate', self._values_batch_update, (spreadsheet_id,)
+                if method == 'POST' and action == 'batchClear':
+                    return 'values.batchClear', self._values_batch_clear, (spreadsheet_id,)
+            elif tail.startswith('values/'):
+                range_name = tail[len('values/'):]
+                action = None
+                m = re.search(r':(append|clear)$', range_name)
+                if m:
+                    range_name, action = range_name[:m.start()], m.group(1)
+                if method == 'GET' and action is None:
+                    return 'values.get', self._values_get, (spreadsheet_id, range_name)
+                if method == 'PUT' and action is None:
+                    return 'values.update', self._values_update, (spreadsheet_id, range_name)
+                if method == 'POST' and action == 'append':
+                    return 'values.append', self._values_append, (spreadsheet_id, range_name)
+                if method == 'POST' and action == 'clear':
+                    return 'values.clear', self._values_clear, (spreadsheet_id, range_name)
+        raise FakeSheetsError(404, f'Method {method} {path} is not implemented in fake', 'NOT_FOUND')
+
+    # ---- Drive ----
+
+    def _drive_list(self, params, body):
+        query = params.get('q', [''])[0]
+        m = re.search(r'''name\s*=\s*(["'])(.*?)\1''', query)
+        files = [s for s in self.spreadsheets.values() if not m or s.title == m.group(2)]
+        return {'kind': 'drive#fileList',
+                'files': [{'id': s.id, 'name': s.title, 'createdTime': s.created, 'modifiedTime': s.created} for s in files]}
+
+    def _drive_create(self, params, body):
+        spreadsheet_id = self.add_spreadsheet(body.get('name', 'Untitled'))
+        return {'kind': 'drive#file', 'id': spreadsheet_id, 'name': body.get('name', 'Untitled'),
+                'mimeType': body.get('mimeType')}
+
+    def _drive_delete(self, file_id, params, body):
+        self._spreadsheet(file_id)
+        del self.spreadsheets[file_id]
+        return {}
+
+    # ---- spreadsheets ----
+
+    def _metadata(self, spreadsheet_id, params, body):
+        return self._spreadsheet(spreadsheet_id).metadata()
+
+    def _value_range(self, spreadsheet, range_name, params):
+        sheet, r1, c1, r2, c2, _ = self._resolve(spreadsheet, range_name)
+        option = params.get('valueRenderOption', ['FORMATTED_VALUE'])[0]
+        major = params.get('majorDimension', ['ROWS'])[0]
+        r2, c2 = min(r2, sheet.rows), min(c2, sheet.cols)
+        result = {'range': f'{quote_title(sheet.title)}!{a1(r1, c1, r2, c2)}', 'majorDimension': major}
+        values = sheet.read(r1, c1, r2, c2, option, major)
+        if values:
+            result['values'] = values
+        return result
+
+    def _values_get(self, spreadsheet_id, range_name, params, body):
+        return self._value_range(self._spreadsheet(spreadsheet_id), range_name, params)
+
+    def _values_batch_get(self, spreadsheet_id, params, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        return {'spreadsheetId': spreadsheet_id,
+                'valueRanges': [self._value_range(spreadsheet, r, params) for r in params.get('ranges', [])]}
+
+    def _write(self, spreadsheet, range_name, values, user_entered, major = 'ROWS'):
+        sheet, r1, c1, r2, c2, single = self._resolve(spreadsheet, range_name)
+        values = values or []
+        if major == 'COLUMNS':
+            values = [list(row) for row in zip(*values)]
+        width = max((len(v) for v in values), default=0)
+        if not single and (len(values) > r2 - r1 or width > c2 - c1):
+            raise FakeSheetsError(400, f"Requested writing within range [{range_name}], but tried writing to "
+                                       f"row [{r1 + len(values)}] / column [{num_to_col(c1 + width)}]")
+        cells = sheet.write(r1, c1, values, user_entered)
+        self.cells_written += cells
+        return {'spreadsheetId': spreadsheet.id,
+                'updatedRange': f'{quote_title(sheet.title)}!{a1(r1, c1, r1 + max(len(values), 1), c1 + max(width, 1))}',
+                'updatedRows': len(values), 'updatedColumns': width, 'updatedCells': cells}
+
+    def _values_update(self, spreadsheet_id, range_name, params, body):
+        user_entered = params.get('valueInputOption', ['RAW'])[0] == 'USER_ENTERED'
+        return self._write(self._spreadsheet(spreadsheet_id), range_name, body.get('values'), user_entered,
+                           body.get('majorDimension', 'ROWS'))
+
+    def _values_batch_update(self, spreadsheet_id, params, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        user_entered = body.get('valueInputOption', 'RAW') == 'USER_ENTERED'
+        responses = [self._write(spreadsheet, d['range'], d.get('values'), user_entered, d.get('majorDimension', 'ROWS'))
+                     for d in body.get('data', [])]
+        return {'spreadsheetId': spreadsheet_id,
+                'totalUpdatedRows': sum(r['updatedRows'] for r in responses),
+                'totalUpdatedColumns': sum(r['updatedColumns'] for r in responses),
+                'totalUpdatedCells': sum(r['updatedCells'] for r in responses),
+                'totalUpdatedSheets': len({r['updatedRange'].rsplit('!', 1)[0] for r in responses}),
+                'responses': responses}
+
+    def _clear(self, spreadsheet, range_name):
+        sheet, r1, c1, r2, c2, _ = self._resolve(spreadsheet, range_name)
+        sheet.clear(r1, c1, r2, c2)
+        return f'{quote_title(sheet.title)}!{a1(r1, c1, min(r2, sheet.rows), min(c2, sheet.cols))}'
+
+    def _values_clear(self, spreadsheet_id, range_name, params, body):
+        return {'spreadsheetId': spreadsheet_id, 'clearedRange': self._clear(self._spreadsheet(spreadsheet_id), range_name)}
+
+    def _values_batch_clear(self, spreadsheet_id, params, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        return {'spreadsheetId': spreadsheet_id, 'clearedRanges': [self._clear(spreadsheet, r) for r in body.get('ranges', [])]}
+
+    def _values_append(self, spreadsheet_id, range_name, params, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        sheet, r1, c1, r2, c2, _ = self._resolve(spreadsheet, range_name)
+        values = body.get('values') or []
+        width = max((len(v) for v in values), default=0)
+        start = max(sheet.last_row(c1, max(c2, c1 + width)), r1)
+        if params.get('insertDataOption', ['OVERWRITE'])[0] == 'INSERT_ROWS':
+            sheet.insert_dimension('ROWS', start, start + len(values))
+        elif start + len(values) > sheet.rows:
+            sheet.resize(rows=start + len(values))
+        if c1 + width > sheet.cols:
+            sheet.resize(cols=c1 + width)
+        user_entered = params.get('valueInputOption', ['RAW'])[0] == 'USER_ENTERED'
+        update = self._write(spreadsheet, f"{quote_title(sheet.title)}!{num_to_col(c1 + 1)}{start + 1}", values, user_entered)
+        return {'spreadsheetId': spreadsheet_id, 'tableRange': f'{quote_title(sheet.title)}!{a1(r1, c1, max(start, r1 + 1), c2)}',
+                'updates': update}
+
+    def _batch_update(self, spreadsheet_id, params, body):
+        spreadsheet = self._spreadsheet(spreadsheet_id)
+        replies = []
+        for request in body.get('requests', []):
+            (kind, payload), = request.items()
+            replies.append(self._apply_request(spreadsheet, kind, payload))
+        return {'spreadsheetId': spreadsheet_id, 'replies': replies}
+
+    def _apply_request(self, spreadsheet, kind, payload):
+        if kind in ('deleteDimension', 'insertDimension'):
+            rng = payload['range']
+            sheet = spreadsheet.sheet(sheet_id=rng.get('sheetId', 0))
+            limit = sheet.rows if rng['dimension'] == 'ROWS' else sheet.cols
+            start, end = rng.get('startIndex', 0), rng.get('endIndex', limit)
+            if kind == 'deleteDimension':
+                if start < 0 or end > limit or start >= end:
+                    raise FakeSheetsError(400, f'Invalid requests[0].deleteDimension: range [{start}, {end}) out of grid')
+                sheet.delete_dimension(rng['dimension'], start, end)
+            else:
+                sheet.insert_dimension(rng['dimension'], start, end)
+            return {}
+        if kind == 'appendDimension':
+            sheet = spreadsheet.sheet(sheet_id=payload.get('sheetId', 0))
+            if payload['dimension'] == 'ROWS':
+                sheet.resize(rows=sheet.rows + payload['length'])
+            else:
+                sheet.resize(cols=sheet.cols + payload['length'])
+            return {}
+        if kind == 'updateSheetProperties':
+            props = payload['properties']
+            sheet = spreadsheet.sheet(sheet_id=props.get('sheetId', 0))
+            grid = props.get('gridProperties', {})
+            fields = payload.get('fields', '')
+            if 'title' in props and 'title' in fields:
+                sheet.title = props['title']
+            sheet.resize(rows=grid['rowCount'] if 'rowCount' in grid else None,
+                         cols=grid['columnCount'] if 'columnCount' in grid else None)
+            return {}
+        if kind == 'addSheet':
+            props = payload.get('properties', {})
+            grid = props.get('gridProperties', {})
+            sheet = spreadsheet.add_sheet(props.get('title', f'Sheet{len(spreadsheet.sheets) + 1}'),
+                                          grid.get('rowCount', DEFAULT_ROWS), grid.get('columnCount', DEFAULT_COLS),
+                                          props.get('sheetId'))
+            return {'addSheet': {'properties': sheet.properties()}}
+        if kind == 'deleteSheet':
+            sheet = spreadsheet.sheet(sheet_id=payload['sheetId'])
+            spreadsheet.sheets.remove(sheet)
+            return {}
+        # форматирование, защита диапазонов и т.п. на значения не влияют
+        self.by_method[f'batchUpdate.{kind}'] = self.by_method.get(f'batchUpdate.{kind}', 0) + 1
+        return {}
+
+
+# -------------------------------- транспорт для gspread --------------------------------
+
+class FakeSheetsAdapter(BaseAdapter):
+    '''
+    Транспорт requests, отвечающий из FakeSheetsBackend вместо googleapis.com
+    '''
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        params = parse_qs(url.query, keep_blank_values=True)
+        raw = request.body or b''
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        body = json.loads(raw) if raw else None
+        status, payload = self.backend.handle(request.method, url.path, params, body)
+        content = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.backend.bytes_received += len(raw)
+        self.backend.bytes_sent += len(content)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = 'OK' if status == 200 else 'Error'
+        response._content = content
+        response.headers['Content-Type'] = 'application/json; charset=UTF-8'
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class RedirectAdapter(HTTPAdapter):
+    '''
+    Переписывает запросы к googleapis.com на адрес фейкового сервера
+    '''
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        if url.hostname in GOOGLE_HOSTS:
+            request.url = self.base_url + url.path + (f'?{url.query}' if url.query else '')
+        return super().send(request, **kwargs)
+
+
+def fake_client(backend):
+    '''
+    gspread.Client, работающий с backend в памяти
+    '''
+    session = requests.Session()
+    session.mount('https://', FakeSheetsAdapter(backend))
+    return gspread.Client(None, session=session)
+
+
+def redirected_client(base_url):
+    '''
+    gspread.Client, отправляющий все запросы на фейковый сервер base_url
+    '''
+    session = requests.Session()
+    session.mount('https://', RedirectAdapter(base_url))
+    return gspread.Client(None, session=session)
+
+
+# -------------------------------- HTTP-сервер --------------------------------
+
+def create_app(backend = None):
+    '''
+    aiohttp-приложение поверх backend. Служебные методы:
+    GET /_fake/stats, POST /_fake/reset, POST /_fake/spreadsheets {title, sheets}, POST /_fake/inject {count, status}
+    '''
+    from aiohttp import web
+
+    backend = backend or FakeSheetsBackend()
+
+    async def api(request):
+        raw = await request.read()
+        body = json.loads(raw) if raw else None
+        status, payload = backend.handle(request.method, request.path, parse_qs(request.query_string, keep_blank_values=True), body)
+        response = web.json_response(payload, status=status)
+        backend.bytes_received += len(raw)
+        backend.bytes_sent += len(response.body)
+        return response
+
+    async def stats(request):
+        return web.json_response(backend.stats())
+
+    async def reset(request):
+        backend.reset_stats()
+        return web.json_response({'ok': True})
+
+    async def add_spreadsheet(request):
+        data = await request.json()
+        spreadsheet_id = backend.add_spreadsheet(data['title'], data.get('sheets'), data.get('rows', DEFAULT_ROWS),
+                                                 data.get('cols', DEFAULT_COLS), data.get('id'))
+        return web.json_response({'id': spreadsheet_id})
+
+    async def inject(request):
+        data = await request.json()
+        backend.inject_errors(data.get('count', 1), data.get('status', 429))
+        return web.json_response({'ok': True})
+
+    app = web.Application()
+    app['backend'] = backend
+    app.add_routes([
+        web.get('/_fake/stats', stats),
+        web.post('/_fake/reset', reset),
+        web.post('/_fake/spreadsheets', add_spreadsheet),
+        web.post('/_fake/inject', inject),
+        web.route('*', '/{tail:.*}', api),
+    ])
+    return app
+
+
+async def start_fake_server(backend = None, host = '127.0.0.1', port = 0):
+    '''
+    Запускает фейк в текущем event loop. Returns (runner, base_url)
+    '''
+    from aiohttp import web
+
+    runner = web.AppRunner(create_app(backend))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    real_port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{real_port}'
+
+
+if __name__ == "__main__":
+    from aiohttp import web
+
+    parser = argparse.ArgumentParser(description='Фейковый Google Sheets API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--seed-file', help='JSON {таблица: {лист: [[...], ...]}}')
+    parser.add_argument('--read-quota', type=int, help='чтений в минуту')
+    parser.add_argument('--write-quota', type=int, help='записей в минуту')
+    args = parser.parse_args()
+
+    backend = FakeSheetsBackend(read_quota=args.read_quota, write_quota=args.write_quota)
+    if args.seed_file:
+        with open(args.seed_file, encoding='utf-8') as f:
+            for title, sheets in json.load(f).items():
+                backend.add_spreadsheet(title, sheets)
+    web.run_app(create_app(backend), host=args.host, port=args.port)
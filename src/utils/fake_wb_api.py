@@ -0,0 +1,750 @@
+'''
+Локальный фейковый сервер WB API для офлайн-тестов и замеров скорости загрузчиков.
+
+Реализует используемые в src/main методы с их настоящей пагинацией
+(offset/limit, skip/take, next, lastChangeDate, курсор updatedAt+nmID), детерминированно
+генерирует данные по токену и seed и ограничивает частоту запросов на токен с ответом 429
+и заголовком X-Ratelimit-Retry, как настоящий WB.
+
+Запуск (из src):
+    python -m utils.fake_wb_api --port 8080 --rate-scale 0.01
+
+Скрипты переключаются на фейк переменной окружения WB_API_BASE_URL=http://127.0.0.1:8080
+(или WB_<SERVICE>_URL для отдельного сервиса, см. utils.my_api.wb_url).
+'''
+import time
+import random
+import argparse
+from datetime import datetime, date, timedelta
+
+from aiohttp import web
+
+
+# интервал между запросами одного токена к группе методов, сек (примерно как квоты WB)
+DEFAULT_RATE_LIMITS = {
+    'statistics': 60,
+    'feedbacks': 0.34,
+    'supplies': 2,
+    'advert_list': 0.2,
+    'fullstats': 20,
+    'upd': 1,
+    'search_report': 20,
+    'measurements': 12,
+    'deductions': 65,
+    'marketplace': 0.2,
+    'content': 0.6,
+    'sales_funnel': 20,
+    'prices': 0.6,
+}
+
+# размеры синтетического кабинета
+DEFAULT_SIZES = {
+    'products': 300,
+    'warehouses': 4,
+    'orders': 5000,
+    'feedbacks': 3000,
+    'supplies': 40,
+    'adverts': 30,
+    'fbs_orders': 2000,
+    'history_days': 90,
+    'stocks_page': 60000,
+}
+
+WAREHOUSES = ['Коледино', 'Электросталь', 'Казань', 'Краснодар', 'Екатеринбург', 'Новосибирск']
+SUBJECTS = ['Держатели', 'Кабели', 'Чехлы', 'Наушники', 'Зарядные устройства']
+REGIONS = ['Москва', 'Московская область', 'Санкт-Петербург', 'Краснодарский край', 'Республика Татарстан', 'Минская область']
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _parse_dt(value, default = None):
+    if not value:
+        return default
+    value = str(value).replace('Z', '')
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value))
+    return datetime.fromisoformat(value[:19])
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _error(status, detail):
+    return web.json_response({'title': 'error', 'detail': detail, 'status': status}, status=status)
+
+
+class FakeWB:
+    '''
+    Состояние фейкового API: сгенерированные кабинеты (по токену) и лимитер запросов.
+    '''
+
+    def __init__(self, seed = 0, rate_scale = 1.0, rate_limits = None, sizes = None, today = None):
+        self.seed = seed
+        self.rate_scale = rate_scale
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.sizes = {**DEFAULT_SIZES, **(sizes or {})}
+        self.today = today or date.today()
+        self._cabinets = {}
+        self._next_allowed = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.requests_count = 0
+        self.throttled_count = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.by_path = {}
+
+    # ---- rate limit ----
+
+    def throttle(self, token, group):
+        '''
+        None, если запрос разрешён, иначе ответ 429
+        '''
+        interval = self.rate_limits.get(group, 0) * self.rate_scale
+        now = time.monotonic()
+        key = (token, group)
+        next_allowed = self._next_allowed.get(key, 0)
+        if now < next_allowed:
+            self.throttled_count += 1
+            retry = next_allowed - now
+            return web.json_response(
+                {'title': 'too many requests', 'detail': f'limited by {group}', 'status': 429},
+                status=429,
+                headers={'X-Ratelimit-Retry': f'{retry:.3f}', 'X-Ratelimit-Limit': '1',
+                         'X-Ratelimit-Reset': f'{retry:.3f}'})
+        self._next_allowed[key] = now + interval
+        return None
+
+    # ---- данные ----
+
+    def rng(self, token, *parts):
+        return random.Random(':'.join(str(p) for p in (self.seed, token) + parts))
+
+    def cabinet(self, token):
+        if token not in self._cabinets:
+            self._cabinets[token] = self._generate_cabinet(token)
+        return self._cabinets[token]
+
+    def _generate_cabinet(self, token):
+        rng = self.rng(token, 'cabinet')
+        sizes = self.sizes
+        start = datetime.combine(self.today - timedelta(days=sizes['history_days']), datetime.min.time())
+        span = sizes['history_days'] * 86400
+
+        def moment():
+            return start + timedelta(seconds=rng.randrange(span))
+
+        base_nm = 100_000_000 + rng.randrange(1_000_000) * 1000
+        products = []
+        for i in range(sizes['products']):
+            wild = f'wild{rng.randrange(100, 3000)}'
+            products.append({
+                'nmID': base_nm + i,
+                'vendorCode': wild + rng.choice(['', '', '', 'd', 'd1', '-d']),
+                'subjectName': rng.choice(SUBJECTS),
+                'brand': 'Fake',
+                'barcode': str(2_000_000_000_000 + base_nm + i),
+                'price': rng.randrange(300, 5000),
+                'updatedAt': moment(),
+            })
+
+        stocks = []
+        for p in products:
+            for wh in rng.sample(WAREHOUSES, k=min(sizes['warehouses'], len(WAREHOUSES))):
+                stocks.append({
+                    'lastChangeDate': _iso(moment()),
+                    'warehouseName': wh,
+                    'supplierArticle': p['vendorCode'],
+                    'nmId': p['nmID'],
+                    'barcode': p['barcode'],
+                    'quantity': rng.randrange(0, 200),
+                    'inWayToClient': rng.randrange(0, 20),
+                    'inWayFromClient': rng.randrange(0, 5),
+                    'quantityFull': rng.randrange(0, 250),
+                    'category': 'Электроника',
+                    'subject': p['subjectName'],
+                    'brand': p['brand'],
+                    'techSize': '0',
+                    'Price': p['price'],
+                    'Discount': rng.randrange(0, 60),
+                    'isSupply': True,
+                    'isRealization': False,
+                    'SCCode': 'Tech',
+                })
+        stocks.sort(key=lambda s: s['lastChangeDate'])
+
+        orders = []
+        for i in range(sizes['orders']):
+            p = rng.choice(products)
+            created = moment()
+            orders.append({
+                'date': _iso(created),
+                'lastChangeDate': _iso(created + timedelta(minutes=rng.randrange(1, 600))),
+                'warehouseName': rng.choice(WAREHOUSES),
+                'warehouseType': rng.choice(['Склад WB', 'Склад продавца']),
+                'regionName': rng.choice(REGIONS),
+                'supplierArticle': p['vendorCode'],
+                'nmId': p['nmID'],
+                'barcode': p['barcode'],
+                'subject': p['subjectName'],
+                'totalPrice': p['price'],
+                'discountPercent': rng.randrange(0, 60),
+                'finishedPrice': round(p['price'] * rng.uniform(0.4, 0.9), 2),
+                'isCancel': rng.random() < 0.1,
+                'srid': f'{token[-4:]}.{i}.{rng.randrange(10**9)}',
+            })
+        orders.sort(key=lambda o: o['lastChangeDate'])
+
+        feedbacks = []
+        for i in range(sizes['feedbacks']):
+            p = rng.choice(products)
+            answered = rng.random() < 0.8
+            feedbacks.append({
+                'id': f'fb{token[-4:]}{i:07d}',
+                'text': rng.choice(['Отлично', 'Нормально', 'Не понравилось', '']),
+                'pros': '', 'cons': '',
+                'productValuation': rng.randrange(1, 6),
+                'createdDate': _iso(moment()) + 'Z',
+                'answer': {'text': 'Спасибо за отзыв!', 'state': 'wbRu', 'editable': False} if answered else None,
+                'productDetails': {'nmId': p['nmID'], 'supplierArticle': p['vendorCode'],
+                                   'productName': p['subjectName'], 'brandName': p['brand']},
+                'photoLinks': None, 'video': None, 'wasViewed': True, 'userName': 'Покупатель',
+                'matchingSize': '', 'isAbleSupplierFeedbackValuation': False, 'supplierFeedbackValuation': 0,
+                'isAbleSupplierProductValuation': False, 'supplierProductValuation': 0,
+                'isAbleReturnProductOrders': False, 'returnProductOrdersDate': None, 'bables': [],
+                'lastOrderShkId': rng.randrange(10**10), 'lastOrderCreatedAt': _iso(moment()) + 'Z',
+                'parentFeedbackId': None, 'childFeedbackId': None,
+                '_answered': answered,
+            })
+        feedbacks.sort(key=lambda f: f['createdDate'])
+
+        supplies = []
+        for i in range(sizes['supplies']):
+            created = moment()
+            supply_id = 30_000_000 + rng.randrange(10**6) * 100 + i
+            goods = [{
+                'barcode': p['barcode'], 'vendorCode': p['vendorCode'], 'nmID': p['nmID'], 'needKiz': False,
+                'tnved': None, 'techSize': '0', 'color': None, 'supplierBoxAmount': rng.randrange(1, 50),
+                'quantity': (q := rng.randrange(1, 300)), 'readyForSaleQuantity': q, 'acceptedQuantity': q,
+                'unloadingQuantity': 0, 'depersonalizedQuantity': 0,
+            } for p in rng.sample(products, k=min(len(products), rng.randrange(5, 50)))]
+            supplies.append({
+                'supplyID': supply_id, 'preorderID': supply_id + 1, 'phone': '+7 999 *** ** **',
+                'createDate': created.strftime('%Y-%m-%dT%H:%M:%S+03:00'),
+                'supplyDate': (created + timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%S+03:00'),
+                'factDate': (created + timedelta(days=4)).strftime('%Y-%m-%dT%H:%M:%S+03:00'),
+                'updatedDate': (created + timedelta(days=4)).strftime('%Y-%m-%dT%H:%M:%S+03:00'),
+                'statusID': rng.randrange(1, 7), 'boxTypeID': rng.choice([2, 5]),
+                'warehouseID': rng.randrange(100, 999), 'warehouseName': rng.choice(WAREHOUSES),
+                'actualWarehouseID': None, 'actualWarehouseName': None,
+                'transitWarehouseID': None, 'transitWarehouseName': None,
+                'acceptanceCost': rng.randrange(0, 5000), 'paidAcceptanceCoefficient': 1,
+                'rejectReason': None, 'supplierAssignName': 'Fake', 'storageCoef': '1', 'deliveryCoef': '1',
+                '_goods': goods,
+            })
+
+        adverts = []
+        for i in range(sizes['adverts']):
+            adverts.append({
+                'advertId': 20_000_000 + rng.randrange(10**6) * 10 + i,
+                'type': rng.choice([8, 9]),
+                'status': rng.choice([9, 9, 11, 7]),
+                'changeTime': _iso(moment()) + '+03:00',
+                'nms': [p['nmID'] for p in rng.sample(products, k=rng.randrange(1, 4))],
+                'name': f'Кампания {i}',
+            })
+
+        fbs_orders = []
+        for i in range(sizes['fbs_orders']):
+            p = rng.choice(products)
+            created = moment()
+            fbs_orders.append({
+                'id': 3_000_000_000 + i, 'rid': f'rid{i}', 'createdAt': _iso(created) + 'Z',
+                'article': p['vendorCode'], 'nmId': p['nmID'], 'skus': [p['barcode']],
+                'price': p['price'] * 100, 'convertedPrice': p['price'] * 100, 'warehouseId': rng.randrange(100, 999),
+                'supplyId': f'WB-GI-{rng.randrange(10**6)}', 'deliveryType': 'fbs', 'cargoType': 1,
+                '_ts': int(created.timestamp()),
+            })
+        fbs_orders.sort(key=lambda o: o['id'])
+
+        cards = sorted(products, key=lambda p: (p['updatedAt'], p['nmID']))
+
+        return {'products': products, 'stocks': stocks, 'orders': orders, 'feedbacks': feedbacks,
+                'supplies': supplies, 'adverts': adverts, 'fbs_orders': fbs_orders, 'cards': cards}
+
+
+# -------------------------------- HANDLERS --------------------------------
+
+def limited(group):
+    '''
+    Авторизация по заголовку Authorization + лимит запросов группы group на токен
+    '''
+    def decorator(handler):
+        async def wrapper(request):
+            fake = request.app['fake']
+            token = request.headers.get('Authorization')
+            if not token:
+                return _error(401, 'empty Authorization header')
+            throttled = fake.throttle(token, group)
+            if throttled is not None:
+                return throttled
+            return await handler(request, fake, token)
+        return wrapper
+    return decorator
+
+
+@limited('statistics')
+async def supplier_stocks(request, fake, token):
+    # пагинация по lastChangeDate: следующий запрос - с lastChangeDate последней строки
+    date_from = _parse_dt(request.query.get('dateFrom'))
+    if date_from is None:
+        return _error(400, 'dateFrom is required')
+    rows = [s for s in fake.cabinet(token)['stocks'] if _parse_dt(s['lastChangeDate']) > date_from]
+    return web.json_response(rows[:fake.sizes['stocks_page']])
+
+
+@limited('statistics')
+async def supplier_orders(request, fake, token):
+    date_from = _parse_dt(request.query.get('dateFrom'))
+    if date_from is None:
+        return _error(400, 'dateFrom is required')
+    orders = fake.cabinet(token)['orders']
+    if request.query.get('flag') == '1':
+        rows = [o for o in orders if o['date'][:10] == date_from.strftime('%Y-%m-%d')]
+    else:
+        rows = [o for o in orders if _parse_dt(o['lastChangeDate']) >= date_from][:80000]
+    return web.json_response(rows)
+
+
+@limited('feedbacks')
+async def feedbacks(request, fake, token):
+    # skip/take
+    q = request.query
+    take, skip = _int(q.get('take'), 0), _int(q.get('skip'), 0)
+    if not 0 < take <= 5000 or skip + take > 199990:
+        return _error(400, 'take must be 1..5000 and skip + take <= 199990')
+    answered = q.get('isAnswered', 'true').lower() == 'true'
+    rows = [f for f in fake.cabinet(token)['feedbacks'] if f['_answered'] == answered]
+    if q.get('nmId'):
+        rows = [f for f in rows if f['productDetails']['nmId'] == _int(q['nmId'], 0)]
+    date_from, date_to = _parse_dt(q.get('dateFrom')), _parse_dt(q.get('dateTo'))
+    if date_from:
+        rows = [f for f in rows if _parse_dt(f['createdDate']) >= date_from]
+    if date_to:
+        rows = [f for f in rows if _parse_dt(f['createdDate']) <= date_to]
+    if q.get('order') == 'dateDesc':
+        rows = rows[::-1]
+    all_rows = fake.cabinet(token)['feedbacks']
+    page = [{k: v for k, v in f.items() if not k.startswith('_')} for f in rows[skip:skip + take]]
+    return web.json_response({
+        'data': {'countUnanswered': sum(not f['_answered'] for f in all_rows),
+                 'countArchive': sum(f['_answered'] for f in all_rows),
+                 'feedbacks': page},
+        'error': False, 'errorText': '', 'additionalErrors': None,
+    })
+
+
+def _public(item):
+    return {k: v for k, v in item.items() if not k.startswith('_')}
+
+
+@limited('supplies')
+async def supplies_list(request, fake, token):
+    # offset/limit
+    limit, offset = _int(request.query.get('limit'), 1000), _int(request.query.get('offset'), 0)
+    if not 0 < limit <= 1000:
+        return _error(400, 'limit must be 1..1000')
+    rows = fake.cabinet(token)['supplies'][offset:offset + limit]
+    return web.json_response([{k: r[k] for k in ('supplyID', 'preorderID', 'phone', 'createDate', 'supplyDate',
+                                                  'factDate', 'updatedDate', 'statusID', 'boxTypeID')} for r in rows])
+
+
+def _find_supply(fake, token, supply_id):
+    for s in fake.cabinet(token)['supplies']:
+        if str(s['supplyID']) == supply_id or str(s['preorderID']) == supply_id:
+            return s
+    return None
+
+
+@limited('supplies')
+async def supply_details(request, fake, token):
+    supply = _find_supply(fake, token, request.match_info['supply_id'])
+    if supply is None:
+        return _error(404, 'supply not found')
+    return web.json_response(_public(supply))
+
+
+@limited('supplies')
+async def supply_goods(request, fake, token):
+    supply = _find_supply(fake, token, request.match_info['supply_id'])
+    if supply is None:
+        return _error(404, 'supply not found')
+    limit, offset = _int(request.query.get('limit'), 100), _int(request.query.get('offset'), 0)
+    return web.json_response(supply['_goods'][offset:offset + limit])
+
+
+@limited('advert_list')
+async def promotion_adverts(request, fake, token):
+    status = _int(request.query.get('status'), None)
+    rows = [a for a in fake.cabinet(token)['adverts'] if status is None or a['status'] == status]
+    return web.json_response([{k: a[k] for k in ('advertId', 'type', 'status', 'changeTime', 'name')} for a in rows])
+
+
+@limited('advert_list')
+async def auction_adverts(request, fake, token):
+    status = _int(request.query.get('status'), None)
+    rows = [a for a in fake.cabinet(token)['adverts'] if status is None or a['status'] == status]
+    return web.json_response({'adverts': [
+        {'id': a['advertId'], 'status': a['status'], 'bid_type': 'manual',
+         'timestamps': {'updated': a['changeTime'], 'created': a['changeTime']},
+         'nm_settings': [{'nm_id': nm} for nm in a['nms']]}
+        for a in rows]})
+
+
+def _days(date_from, date_to):
+    day = date_from
+    while day <= date_to:
+        yield day
+        day += timedelta(days=1)
+
+
+@limited('fullstats')
+async def fullstats(request, fake, token):
+    ids = [i for i in request.query.get('ids', '').split(',') if i]
+    if not ids or len(ids) > 50:
+        return _error(400, 'ids: from 1 to 50 campaigns')
+    begin, end = _parse_dt(request.query.get('beginDate')), _parse_dt(request.query.get('endDate'))
+    if begin is None or end is None or (end - begin).days > 31:
+        return _error(400, 'beginDate/endDate: period up to 31 days')
+    adverts = {str(a['advertId']): a for a in fake.cabinet(token)['adverts']}
+    result = []
+    for advert_id in ids:
+        advert = adverts.get(advert_id)
+        if advert is None:
+            continue
+        days = []
+        for day in _days(begin.date(), end.date()):
+            apps = []
+            for app_type in (1, 32, 64):
+                rng = fake.rng(token, 'fullstats', advert_id, day, app_type)
+                nms = []
+                for nm in advert['nms']:
+                    views = rng.randrange(0, 3000)
+                    clicks = rng.randrange(0, max(views // 20, 1))
+                    orders = rng.randrange(0, max(clicks // 10, 1))
+                    nms.append({'nmId': nm, 'name': '', 'views': views, 'clicks': clicks,
+                                'sum': round(views * rng.uniform(0.1, 0.4), 2), 'atbs': rng.randrange(0, clicks + 1),
+                                'orders': orders, 'shks': orders, 'sum_price': orders * rng.randrange(300, 3000),
+                                'canceled': 0})
+                apps.append({'appType': app_type, 'nms': nms})
+            days.append({'date': f'{day}T00:00:00Z', 'apps': apps})
+        result.append({'advertId': advert['advertId'], 'days': days,
+                       'boosterStats': [{'date': f'{end.date()}T00:00:00Z', 'nm': advert['nms'][0], 'avg_position': 12}]})
+    return web.json_response(result)
+
+
+@limited('upd')
+async def adv_upd(request, fake, token):
+    date_from, date_to = _parse_dt(request.query.get('from')), _parse_dt(request.query.get('to'))
+    if date_from is None or date_to is None or (date_to - date_from).days > 31:
+        return _error(400, 'from/to: period up to 31 days')
+    rows = []
+    for day in _days(date_from.date(), date_to.date()):
+        for advert in fake.cabinet(token)['adverts']:
+            rng = fake.rng(token, 'upd', advert['advertId'], day)
+            if rng.random() < 0.5:
+                continue
+            rows.append({'updNum': 0, 'updTime': f'{day}T{rng.randrange(24):02d}:00:00+03:00',
+                         'updSum': rng.randrange(50, 5000), 'advertId': advert['advertId'],
+                         'campName': advert['name'], 'advertType': advert['type'],
+                         'paymentType': rng.choice(['Баланс', 'Счёт']), 'advertStatus': advert['status']})
+    return web.json_response(rows)
+
+
+@limited('search_report')
+async def search_report_details(request, fake, token):
+    # offset/limit в теле запроса, агрегат за период
+    body = await request.json()
+    limit, offset = _int(body.get('limit'), 1000), _int(body.get('offset'), 0)
+    nm_ids = body.get('nmIds') or None
+    if nm_ids and len(nm_ids) > 50:
+        return _error(400, 'nmIds: up to 50 items')
+    period = body.get('currentPeriod') or {}
+    products = fake.cabinet(token)['products']
+    if nm_ids:
+        products = [p for p in products if p['nmID'] in set(nm_ids)]
+    rows = []
+    for p in products[offset:offset + limit]:
+        rng = fake.rng(token, 'search', p['nmID'], period.get('start'), period.get('end'))
+        def metric(lo, hi):
+            return {'current': rng.randrange(lo, hi), 'dynamics': rng.randrange(-50, 50)}
+        rows.append({
+            'nmId': p['nmID'], 'name': p['subjectName'], 'vendorCode': p['vendorCode'],
+            'subjectName': p['subjectName'], 'brandName': p['brand'], 'mainPhoto': '',
+            'isAdvertised': rng.random() < 0.3, 'isSubstitutedSKU': False, 'isCardRated': True,
+            'rating': rng.randrange(1, 11), 'feedbackRating': round(rng.uniform(3.5, 5), 1),
+            'price': {'minPrice': p['price'], 'maxPrice': p['price'] + 100},
+            'avgPosition': metric(1, 500), 'openCard': metric(0, 3000), 'addToCart': metric(0, 500),
+            'openToCart': metric(0, 100), 'orders': metric(0, 200), 'cartToOrder': metric(0, 100),
+            'visibility': metric(0, 100),
+        })
+    return web.json_response({'data': {'products': rows}})
+
+
+def _report_rows(fake, token, kind, date_from, date_to, per_day, build):
+    rows = []
+    for day in _days(date_from.date(), date_to.date()):
+        rng = fake.rng(token, kind, day)
+        for i in range(rng.randrange(0, per_day)):
+            rows.append(build(rng, day, i))
+    return rows
+
+
+def _measurement(fake, token, tab):
+    products = fake.cabinet(token)['products']
+
+    def build(rng, day, i):
+        p = products[rng.randrange(len(products))]
+        row = {'nmId': p['nmID'], 'subject': p['subjectName'], 'dimId': rng.randrange(10**9), 'prcOver': rng.randrange(0, 50),
+               'volume': 1.5, 'width': 10, 'length': 20, 'height': 7, 'volumeSup': 1.2, 'widthSup': 9,
+               'lengthSup': 19, 'heightSup': 7, 'photoUrls': []}
+        if tab == 'penalty':
+            row.update({'dtBonus': f'{day}T10:00:00Z', 'isValid': True, 'isValidDt': f'{day}T10:00:00Z',
+                        'reversalAmount': 0, 'penaltyAmount': rng.randrange(10, 500)})
+        else:
+            row.update({'dt': f'{day}T10:00:00Z', 'dateStart': f'{day}T00:00:00Z', 'dateEnd': f'{day}T23:59:59Z'})
+        return row
+    return build
+
+
+def _paged_report(request, fake, token, kind, build, per_day):
+    q = request.query
+    date_from, date_to = _parse_dt(q.get('dateFrom')), _parse_dt(q.get('dateTo'))
+    if date_from is None or date_to is None or (date_to - date_from).days > 31:
+        return _error(400, 'dateFrom/dateTo: period up to 31 days')
+    limit, offset = _int(q.get('limit'), 1000), _int(q.get('offset'), 0)
+    if not 0 < limit <= 1000:
+        return _error(400, 'limit must be 1..1000')
+    rows = _report_rows(fake, token, kind, date_from, date_to, per_day, build)
+    return web.json_response({'data': {'reports': rows[offset:offset + limit], 'total': len(rows)}})
+
+
+@limited('measurements')
+async def warehouse_measurements(request, fake, token):
+    tab = request.query.get('tab', 'measurement')
+    if tab not in ('penalty', 'measurement'):
+        return _error(400, 'tab: penalty or measurement')
+    return _paged_report(request, fake, token, f'measurements-{tab}', _measurement(fake, token, tab), per_day=80)
+
+
+@limited('deductions')
+async def deductions(request, fake, token):
+    products = fake.cabinet(token)['products']
+
+    def build(rng, day, i):
+        p = products[rng.randrange(len(products))]
+        return {'dtBonus': f'{day}T12:00:00Z', 'nmId': p['nmID'], 'oldShkId': rng.randrange(10**10),
+                'oldColor': '', 'oldSize': '0', 'oldSku': p['barcode'], 'oldVendorCode': p['vendorCode'],
+                'newShkId': rng.randrange(10**10), 'newColor': '', 'newSize': '0', 'newSku': p['barcode']}
+    return _paged_report(request, fake, token, 'deductions', build, per_day=40)
+
+
+@limited('marketplace')
+async def marketplace_orders(request, fake, token):
+    # курсор next: id последнего заказа страницы, 0 - страниц больше нет
+    q = request.query
+    limit, next_value = _int(q.get('limit'), 1000), _int(q.get('next'), 0)
+    if not 0 < limit <= 1000:
+        return _error(400, 'limit must be 1..1000')
+    date_from, date_to = _int(q.get('dateFrom'), 0), _int(q.get('dateTo'), 0)
+    rows = [o for o in fake.cabinet(token)['fbs_orders']
+            if o['id'] > next_value and (not date_from or o['_ts'] >= date_from) and (not date_to or o['_ts'] <= date_to)]
+    page = rows[:limit]
+    next_cursor = page[-1]['id'] if len(rows) > limit else 0
+    return web.json_response({'next': next_cursor, 'orders': [_public(o) for o in page]})
+
+
+@limited('sales_funnel')
+async def sales_funnel_products(request, fake, token):
+    # offset/limit в теле запроса
+    body = await request.json()
+    limit, offset = _int(body.get('limit'), 1000), _int(body.get('offset'), 0)
+    nm_ids = set(body.get('nmIds') or [])
+    period = body.get('selectedPeriod') or {}
+    products = [p for p in fake.cabinet(token)['products'] if not nm_ids or p['nmID'] in nm_ids]
+    rows = []
+    for p in products[offset:offset + limit]:
+        rng = fake.rng(token, 'funnel', p['nmID'], period.get('start'), period.get('end'))
+        opens = rng.randrange(0, 3000)
+        carts = rng.randrange(0, max(opens // 5, 1))
+        orders = rng.randrange(0, max(carts // 2, 1))
+        rows.append({
+            'product': {'nmId': p['nmID'], 'title': p['subjectName'], 'vendorCode': p['vendorCode'],
+                        'brandName': p['brand'], 'subjectName': p['subjectName'],
+                        'stocks': {'mp': rng.randrange(0, 50), 'wb': rng.randrange(0, 500)}},
+            'statistic': {'selected': {
+                'period': {'start': period.get('start'), 'end': period.get('end')},
+                'openCount': opens, 'cartCount': carts, 'orderCount': orders, 'orderSum': orders * p['price'],
+                'buyoutCount': orders // 2, 'buyoutSum': orders // 2 * p['price'], 'cancelCount': 0, 'cancelSum': 0,
+                'avgPrice': p['price'], 'avgOrdersCountPerDay': orders,
+                'conversions': {'addToCartPercent': round(carts / opens * 100) if opens else 0,
+                                'cartToOrderPercent': round(orders / carts * 100) if carts else 0,
+                                'buyoutPercent': 50}}},
+        })
+    return web.json_response({'data': {'products': rows}})
+
+
+@limited('prices')
+async def goods_prices(request, fake, token):
+    # offset/limit
+    limit, offset = _int(request.query.get('limit'), 1000), _int(request.query.get('offset'), 0)
+    if not 0 < limit <= 1000:
+        return _error(400, 'limit must be 1..1000')
+    goods = []
+    for p in fake.cabinet(token)['products'][offset:offset + limit]:
+        discount = fake.rng(token, 'discount', p['nmID']).randrange(0, 60)
+        goods.append({'nmID': p['nmID'], 'vendorCode': p['vendorCode'], 'discount': discount, 'clubDiscount': 0,
+                      'sizes': [{'sizeID': p['nmID'], 'price': p['price'], 'techSizeName': '0',
+                                 'discountedPrice': round(p['price'] * (100 - discount) / 100, 2),
+                                 'clubDiscountedPrice': round(p['price'] * (100 - discount) / 100, 2)}]})
+    return web.json_response({'data': {'listGoods': goods}})
+
+
+async def card_detail(request):
+    # публичная карточка товара (card.wb.ru), без токена; ищется по уже сгенерированным кабинетам
+    fake = request.app['fake']
+    nm = _int(request.query.get('nm'), 0)
+    for token, cabinet in fake._cabinets.items():
+        for p in cabinet['products']:
+            if p['nmID'] == nm:
+                rng = fake.rng(token, 'card', nm)
+                spp = rng.randrange(5, 35)
+                return web.json_response({'products': [{
+                    'id': nm, 'brand': p['brand'], 'name': p['subjectName'],
+                    'reviewRating': round(rng.uniform(3.5, 5), 1), 'feedbacks': rng.randrange(0, 1000),
+                    'promoTextCard': 'РАСПРОДАЖА' if rng.random() < 0.3 else None,
+                    'sizes': [{'price': {'basic': p['price'] * 100, 'product': p['price'] * (100 - spp),
+                                         'total': p['price'] * (100 - spp)}}],
+                }]})
+    return web.json_response({'products': []})
+
+
+@limited('content')
+async def cards_list(request, fake, token):
+    # курсор updatedAt + nmID, total - сколько карточек в ответе
+    body = await request.json()
+    settings = body.get('settings') or {}
+    cursor = settings.get('cursor') or {}
+    limit = _int(cursor.get('limit'), 100)
+    if not 0 < limit <= 100:
+        return _error(400, 'cursor.limit must be 1..100')
+    cards = fake.cabinet(token)['cards']
+    text = str((settings.get('filter') or {}).get('textSearch') or '')
+    if text:
+        cards = [c for c in cards if text in (str(c['nmID']), c['vendorCode'])]
+    if cursor.get('updatedAt') and cursor.get('nmID'):
+        after = (_parse_dt(cursor['updatedAt']), int(cursor['nmID']))
+        cards = [c for c in cards if (c['updatedAt'], c['nmID']) > after]
+    page = cards[:limit]
+    last = page[-1] if page else None
+    return web.json_response({
+        'cards': [{'nmID': c['nmID'], 'vendorCode': c['vendorCode'], 'subjectName': c['subjectName'],
+                   'brand': c['brand'], 'sizes': [{'skus': [c['barcode']], 'techSize': '0'}],
+                   'updatedAt': _iso(c['updatedAt']) + 'Z'} for c in page],
+        'cursor': {'updatedAt': _iso(last['updatedAt']) + 'Z' if last else None,
+                   'nmID': last['nmID'] if last else None, 'total': len(page)},
+    })
+
+
+@web.middleware
+async def count_traffic(request, handler):
+    '''
+    Счётчики запросов и трафика (служебные /_fake/* не считаются)
+    '''
+    response = await handler(request)
+    if not request.path.startswith('/_fake/'):
+        fake = request.app['fake']
+        fake.requests_count += 1
+        fake.bytes_received += request.content_length or 0
+        fake.bytes_sent += len(response.body or b'')
+        fake.by_path[request.path] = fake.by_path.get(request.path, 0) + 1
+    return response
+
+
+async def stats(request):
+    fake = request.app['fake']
+    return web.json_response({'requests': fake.requests_count, 'throttled': fake.throttled_count,
+                              'bytes_received': fake.bytes_received, 'bytes_sent': fake.bytes_sent,
+                              'by_path': fake.by_path, 'cabinets': len(fake._cabinets)})
+
+
+async def reset_stats(request):
+    request.app['fake'].reset_stats()
+    return web.json_response({'ok': True})
+
+
+def create_app(**kwargs):
+    '''
+    aiohttp-приложение фейкового WB API. kwargs - параметры FakeWB (seed, rate_scale, rate_limits, sizes, today)
+    '''
+    app = web.Application(middlewares=[count_traffic])
+    app['fake'] = FakeWB(**kwargs)
+    app.add_routes([
+        web.get('/api/v1/supplier/stocks', supplier_stocks),
+        web.get('/api/v1/supplier/orders', supplier_orders),
+        web.get('/api/v1/feedbacks', feedbacks),
+        web.post('/api/v1/supplies', supplies_list),
+        web.get('/api/v1/supplies/{supply_id}', supply_details),
+        web.get('/api/v1/supplies/{supply_id}/goods', supply_goods),
+        web.post('/adv/v1/promotion/adverts', promotion_adverts),
+        web.get('/adv/v0/auction/adverts', auction_adverts),
+        web.get('/adv/v3/fullstats', fullstats),
+        web.get('/adv/v1/upd', adv_upd),
+        web.post('/api/v2/search-report/table/details', search_report_details),
+        web.get('/api/v1/analytics/warehouse-measurements', warehouse_measurements),
+        web.get('/api/analytics/v1/deductions', deductions),
+        web.get('/api/v3/orders', marketplace_orders),
+        web.post('/content/v2/get/cards/list', cards_list),
+        web.post('/api/analytics/v3/sales-funnel/products', sales_funnel_products),
+        web.get('/api/v2/list/goods/filter', goods_prices),
+        web.get('/cards/v4/detail', card_detail),
+        web.get('/_fake/stats', stats),
+        web.post('/_fake/reset', reset_stats),
+    ])
+    return app
+
+
+async def start_fake_server(host = '127.0.0.1', port = 0, **kwargs):
+    '''
+    Запускает фейк в текущем event loop. Returns (runner, base_url) - runner.cleanup() останавливает сервер.
+    '''
+    runner = web.AppRunner(create_app(**kwargs))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    real_port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{real_port}'
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Фейковый WB API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rate-scale', type=float, default=1.0, help='множитель интервалов лимитов (0 - без лимитов)')
+    parser.add_argument('--products', type=int, default=DEFAULT_SIZES['products'])
+    parser.add_argument('--orders', type=int, default=DEFAULT_SIZES['orders'])
+    parser.add_argument('--feedbacks', type=int, default=DEFAULT_SIZES['feedbacks'])
+    parser.add_argument('--stocks-page', type=int, default=DEFAULT_SIZES['stocks_page'])
+    args = parser.parse_args()
+
+    sizes = {'products': args.products, 'orders': args.orders, 'feedbacks': args.feedbacks, 'stocks_page': args.stocks_page}
+    web.run_app(create_app(seed=args.seed, rate_scale=args.rate_scale, sizes=sizes), host=args.host, port=args.port)
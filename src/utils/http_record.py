@@ -0,0 +1,359 @@
+'''
+Запись и воспроизведение HTTP-запросов скриптов (requests и aiohttp) для разбора упавших прогонов.
+
+Запись: все ответы сохраняются в сжатый JSONL. Токены, заголовки авторизации и ключи доступа вырезаются.
+Воспроизведение: ответы отдаются из файла без сети, time.sleep / asyncio.sleep не ждут,
+так что прогон, который на проде шёл полчаса из-за лимитов WB, повторяется за секунды.
+
+Запуск (из src), скрипт выполняется как __main__ со своими аргументами:
+    python -m utils.http_record record logs/http/avg_position.jsonl.gz main/avg_position_to_db.py
+    python -m utils.http_record replay logs/http/avg_position.jsonl.gz main/avg_position_to_db.py
+
+При воспроизведении запрос ищется сначала точно (метод, URL, параметры, тело), затем - следующий
+по порядку записанный запрос к тому же методу API (параметры с датами отличаются, если повторять
+прогон на другой день). --strict отключает второй вариант. Запись в БД скрипт делает как обычно -
+воспроизводить стоит на локальной базе.
+'''
+import os
+import sys
+import gzip
+import json
+import time
+import base64
+import runpy
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+REDACTED = '<REDACTED>'
+# заголовки и параметры, значения которых считаются секретами
+SECRET_HEADERS = {'authorization', 'x-api-key', 'apikey', 'cookie', 'x-goog-api-key'}
+SECRET_PARAMS = {'token', 'api_key', 'apikey', 'key', 'access_token'}
+# ключи в JSON-ответах и телах запросов (oauth, сервисные аккаунты)
+SECRET_FIELDS = {'access_token', 'refresh_token', 'id_token', 'private_key', 'client_secret', 'password'}
+# заголовки ответа, которые стоит сохранить (лимиты WB, тип содержимого)
+KEEP_RESPONSE_HEADERS = {'content-type', 'x-ratelimit-retry', 'x-ratelimit-limit', 'x-ratelimit-remaining',
+                         'x-ratelimit-reset', 'retry-after'}
+
+
+class NoRecordedResponse(Exception):
+    pass
+
+
+class HttpRecorder:
+    '''
+    Файл записи + подстановка ответов. mode: 'record' или 'replay'
+    '''
+
+    def __init__(self, path, mode, strict = False):
+        self.path = path
+        self.mode = mode
+        self.strict = strict
+        self.secrets = set()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._exact = defaultdict(deque)
+        self._by_endpoint = defaultdict(deque)
+        self._used = set()
+        if mode == 'replay':
+            self._load()
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # ---- секреты ----
+
+    def collect_secrets(self, headers = None, params = None):
+        for name, value in (headers or {}).items():
+            if name.lower() in SECRET_HEADERS and value:
+                value = str(value)
+                self.secrets.add(value)
+                if value.lower().startswith('bearer '):
+                    self.secrets.add(value[7:])
+        for name, value in params or []:
+            if name.lower() in SECRET_PARAMS and value:
+                self.secrets.add(str(value))
+
+    def redact_text(self, text):
+        for secret in self.secrets:
+            if len(secret) >= 6:
+                text = text.replace(secret, REDACTED)
+        return text
+
+    def redact_json(self, data):
+        if isinstance(data, dict):
+            return {k: REDACTED if k in SECRET_FIELDS else self.redact_json(v) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self.redact_json(v) for v in data]
+        if isinstance(data, str):
+            return self.redact_text(data)
+        return data
+
+    def redact_body(self, body):
+        '''
+        Тело запроса/ответа -> (JSON или текст, флаг base64) без секретов
+        '''
+        if body is None or body == b'' or body == '':
+            return None, False
+        if isinstance(body, bytes):
+            try:
+                body = body.decode('utf-8')
+            except UnicodeDecodeError:
+                return base64.b64encode(body).decode('ascii'), True
+        try:
+            return self.redact_json(json.loads(body)), False
+        except ValueError:
+            return self.redact_text(body), False
+
+    # ---- ключи ----
+
+    def request_key(self, method, url, params, body):
+        '''
+        (точный ключ, ключ метода API). params - список пар (в т.ч. из query-строки url)
+        '''
+        parts = urlsplit(url)
+        base = self.redact_text(f'{parts.scheme}://{parts.netloc}{parts.path}')
+        query = sorted((k, REDACTED if k.lower() in SECRET_PARAMS else self.redact_text(str(v)))
+                       for k, v in list(parse_qsl(parts.query, keep_blank_values=True)) + list(params or []))
+        redacted_body, _ = self.redact_body(body)
+        body_hash = hashlib.sha1(json.dumps(redacted_body, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+        endpoint = f'{method.upper()} {base}'
+        return f'{endpoint}?{urlencode(query)}#{body_hash}', endpoint, query, redacted_body
+
+    # ---- запись ----
+
+    def save(self, lib, method, url, params, body, status, headers, content, elapsed):
+        exact, endpoint, query, redacted_body = self.request_key(method, url, params, body)
+        response_body, is_base64 = self.redact_body(content)
+        with self._lock:
+            self._seq += 1
+            entry = {
+                'seq': self._seq, 'lib': lib, 'key': exact, 'endpoint': endpoint, 'query': query,
+                'request_body': redacted_body, 'status': status,
+                'headers': {k: v for k, v in headers.items() if k.lower() in KEEP_RESPONSE_HEADERS},
+                'body': response_body, 'base64': is_base64, 'elapsed': round(elapsed, 3),
+            }
+            # по одному gzip-блоку на запрос - файл читается, даже если скрипт упал посреди прогона
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    # ---- воспроизведение ----
+
+    def _load(self):
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self._exact[entry['key']].append(entry)
+                self._by_endpoint[entry['endpoint']].append(entry)
+
+    def find(self, method, url, params, body):
+        exact, endpoint, _, _ = self.request_key(method, url, params, body)
+        with self._lock:
+            for queue in [self._exact[exact]] + ([] if self.strict else [self._by_endpoint[endpoint]]):
+                while queue:
+                    entry = queue.popleft()
+                    if entry['seq'] not in self._used:
+                        self._used.add(entry['seq'])
+                        return entry
+        raise NoRecordedResponse(f'Нет записанного ответа для {exact}')
+
+    @staticmethod
+    def content(entry):
+        body = entry['body']
+        if body is None:
+            return b''
+        if entry.get('base64'):
+            return base64.b64decode(body)
+        if isinstance(body, str):
+            return body.encode('utf-8')
+        return json.dumps(body, ensure_ascii=False).encode('utf-8')
+
+
+# -------------------------------- requests --------------------------------
+
+def _patch_requests(recorder):
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        recorder.collect_secrets(request.headers)
+        body = request.body
+        if recorder.mode == 'replay':
+            try:
+                entry = recorder.find(request.method, request.url, None, body)
+            except NoRecordedResponse as e:
+                raise requests.ConnectionError(str(e), request=request)
+            response = requests.Response()
+            response.status_code = entry['status']
+            response._content = recorder.content(entry)
+            response.headers.update(entry['headers'])
+            response.encoding = 'utf-8'
+            response.url = request.url
+            response.request = request
+            response.reason = 'Replayed'
+            return response
+
+        start = time.perf_counter()
+        response = original_send(self, request, **kwargs)
+        recorder.save('requests', request.method, request.url, None, body, response.status_code,
+                      response.headers, response.content, time.perf_counter() - start)
+        return response
+
+    HTTPAdapter.send = send
+
+
+# -------------------------------- aiohttp --------------------------------
+
+class ReplayedResponse:
+    '''
+    Минимальная замена aiohttp.ClientResponse для воспроизведения
+    '''
+
+    def __init__(self, method, url, entry, content):
+        self.method = method
+        self.url = url
+        self.status = entry['status']
+        self.reason = 'Replayed'
+        self.headers = entry['headers']
+        self.content_type = entry['headers'].get('Content-Type', entry['headers'].get('content-type', 'application/json')).split(';')[0]
+        self._body = content
+        self.closed = False
+
+    @property
+    def ok(self):
+        return self.status < 400
+
+    async def read(self):
+        return self._body
+
+    async def text(self, encoding = None, errors = 'strict'):
+        return self._body.decode(encoding or 'utf-8', errors)
+
+    async def json(self, *, encoding = None, loads = json.loads, content_type = 'application/json'):
+        return loads(self._body.decode(encoding or 'utf-8')) if self._body else None
+
+    def raise_for_status(self):
+        if not self.ok:
+            import aiohttp
+            raise aiohttp.ClientResponseError(None, (), status=self.status, message=self.reason, headers=self.headers)
+
+    def release(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+    async def wait_for_close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def _params_list(params):
+    if not params:
+        return []
+    items = params.items() if isinstance(params, dict) else params
+    return [(str(k), str(v).lower() if isinstance(v, bool) else str(v)) for k, v in items]
+
+
+def _aiohttp_body(kwargs):
+    if kwargs.get('json') is not None:
+        return json.dumps(kwargs['json'], ensure_ascii=False)
+    data = kwargs.get('data')
+    return data if isinstance(data, (str, bytes)) else None
+
+
+def _patch_aiohttp(recorder):
+    try:
+        import aiohttp
+    except ImportError:
+        return
+    original_request = aiohttp.ClientSession._request
+
+    async def _request(self, method, str_or_url, **kwargs):
+        headers = {**dict(self.headers or {}), **dict(kwargs.get('headers') or {})}
+        recorder.collect_secrets(headers)
+        url = str(str_or_url)
+        params = _params_list(kwargs.get('params'))
+        body = _aiohttp_body(kwargs)
+
+        if recorder.mode == 'replay':
+            try:
+                entry = recorder.find(method, url, params, body)
+            except NoRecordedResponse as e:
+                raise aiohttp.ClientConnectionError(str(e))
+            return ReplayedResponse(method, url, entry, recorder.content(entry))
+
+        start = time.perf_counter()
+        response = await original_request(self, method, str_or_url, **kwargs)
+        content = await response.read()   # тело кешируется в ответе, скрипт читает его как обычно
+        recorder.save('aiohttp', method, url, params, body, response.status, response.headers, content,
+                      time.perf_counter() - start)
+        return response
+
+    aiohttp.ClientSession._request = _request
+
+
+# -------------------------------- sleep --------------------------------
+
+def _patch_sleep():
+    real_asyncio_sleep = asyncio.sleep
+
+    def no_sleep(seconds = 0):
+        return None
+
+    async def no_asyncio_sleep(delay = 0, result = None):
+        await real_asyncio_sleep(0)
+        return result
+
+    time.sleep = no_sleep
+    asyncio.sleep = no_asyncio_sleep
+
+
+def install(path, mode, strict = False):
+    '''
+    Включает запись (mode='record') или воспроизведение (mode='replay') для requests и aiohttp в текущем процессе.
+    Вызывать до импорта скрипта, иначе `from time import sleep` в скрипте останется настоящим.
+    '''
+    if mode not in ('record', 'replay'):
+        raise ValueError(f'Неизвестный режим {mode}')
+    recorder = HttpRecorder(path, mode, strict)
+    _patch_requests(recorder)
+    _patch_aiohttp(recorder)
+    if mode == 'replay':
+        _patch_sleep()
+    logging.info(f"HTTP {mode}: {path}")
+    return recorder
+
+
+def run_script(script, args = None):
+    '''
+    Выполняет скрипт как __main__, как если бы его запустили python script.py args
+    '''
+    script = os.path.abspath(script)
+    sys.argv = [script] + list(args or [])
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Запись/воспроизведение HTTP для скриптов из main')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('path', help='файл записи (.jsonl.gz)')
+    parser.add_argument('script', help='скрипт, например main/avg_position_to_db.py')
+    parser.add_argument('--strict', action='store_true', help='только точное совпадение запросов при воспроизведении')
+    args, script_args = parser.parse_known_args()
+
+    install(args.path, args.mode, args.strict)
+    run_script(args.script, script_args)
@@ -1,11 +1,6 @@
 import logging, os
-# from .env_loader import *
-from dotenv import load_dotenv
 
-load_dotenv()
-
-
-LOGS_PATH = os.getenv("LOGS_PATH")
+from .env import load_env
 
 # def setup_logger(filename="app.log"):
 #     path = os.getenv("LOGS_PATH", "./logs")
@@ -21,6 +16,7 @@ LOGS_PATH = os.getenv("LOGS_PATH")
 #     return logging.getLogger(filename)
 
 def setup_logger(filename="app.log"):
+    load_env()
     path = os.getenv("LOGS_PATH", "./logs")
     os.makedirs(path, exist_ok=True)
 
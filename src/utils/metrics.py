@@ -0,0 +1,405 @@
+'''
+Замеры прогонов скриптов: шаги (span) с длительностью и счётчики - запросы к WB API и Google Sheets,
+429, повторы, время и строки запросов к БД, трафик.
+
+Использование в скрипте:
+    from utils import metrics
+
+    metrics.start_run('autopilot_hourly')      # включает учёт HTTP / БД / Sheets и выгрузку при выходе
+    with metrics.span('funnel'):
+        ...
+    @metrics.span('push_prices')
+    def push_prices(...): ...
+
+Любой скрипт без правок: python -m utils.metrics main/wb_stocks.py [аргументы скрипта]
+
+По завершении прогона сводка дописывается строкой в METRICS_DIR/runs.jsonl
+(по умолчанию LOGS_PATH/metrics, без LOGS_PATH - logs/metrics в корне репозитория),
+а текущие значения пишутся в <job>.prom в METRICS_PROM_DIR (каталог textfile collector у node_exporter).
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from collections import defaultdict
+from functools import cache
+from contextlib import ContextDecorator
+from urllib.parse import urlsplit
+
+from .env import BASE_DIR
+
+
+PREFIX = 'wb_job'
+SLOW_SPAN_SECONDS = float(os.getenv('METRICS_SLOW_SPAN_SECONDS', 300))
+
+_run = None
+_current_span = contextvars.ContextVar('metrics_span', default='')
+_installed = False
+
+
+class Run:
+    '''
+    Состояние одного прогона: агрегаты по шагам и счётчики с метками
+    '''
+
+    def __init__(self, job):
+        self.job = job
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.status = 'ok'
+        self.error = None
+        self.spans = {}
+        self.counters = defaultdict(float)
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def add_span(self, name, seconds, failed):
+        with self._lock:
+            agg = self.spans.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+            agg['count'] += 1
+            agg['seconds'] += seconds
+            agg['max_seconds'] = max(agg['max_seconds'], seconds)
+            agg['errors'] += int(failed)
+
+    def incr(self, name, value = 1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def totals(self, name):
+        '''
+        Сумма счётчика по всем меткам
+        '''
+        return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def summary(self):
+        duration = time.perf_counter() - self.start
+        return {
+            'job': self.job,
+            'run_id': self.run_id,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_seconds': round(duration, 3),
+            'status': self.status,
+            'error': self.error,
+            'spans': {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in agg.items()}
+                      for name, agg in sorted(self.spans.items())},
+            'counters': [{'name': name, 'labels': dict(labels), 'value': round(value, 3)}
+                         for (name, labels), value in sorted(self.counters.items())],
+        }
+
+
+# -------------------------------- API --------------------------------
+
+def start_run(job, instrument = True):
+    '''
+    Начинает прогон job (повторный вызов возвращает уже начатый). Сводка выгружается при выходе из процесса
+    или по finish_run()
+    '''
+    global _run
+    if _run is not None and not _run.finished:
+        return _run
+    _run = Run(job)
+    if instrument:
+        install()
+    atexit.register(finish_run)
+    return _run
+
+
+def current_run():
+    return _run if _run is not None and not _run.finished else None
+
+
+class span(ContextDecorator):
+    '''
+    Шаг прогона: контекстный менеджер или декоратор. Вложенные шаги записываются как parent/child.
+    Вне прогона (start_run не вызывался) ничего не делает
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self._tokens = []
+
+    def __enter__(self):
+        parent = _current_span.get()
+        full_name = f'{parent}/{self.name}' if parent else self.name
+        self._tokens.append((_current_span.set(full_name), full_name, time.perf_counter()))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        token, full_name, start = self._tokens.pop()
+        _current_span.reset(token)
+        seconds = time.perf_counter() - start
+        run = current_run()
+        if run is not None:
+            run.add_span(full_name, seconds, exc_type is not None)
+            if seconds > SLOW_SPAN_SECONDS:
+                logging.warning(f'{run.job}: шаг {full_name} занял {seconds:.1f} с')
+        return False
+
+
+def incr(name, value = 1, **labels):
+    '''
+    Увеличивает счётчик текущего прогона (метка span проставляется автоматически)
+    '''
+    run = current_run()
+    if run is not None:
+        run.incr(name, value, span=_current_span.get(), **labels)
+
+
+def finish_run(status = None, error = None):
+    '''
+    Завершает прогон и выгружает сводку в JSONL и Prometheus textfile
+    '''
+    run = current_run()
+    if run is None:
+        return None
+    if status:
+        run.status = status
+    if error is not None:
+        run.status, run.error = 'error', str(error)[:500]
+    run.finished = True
+    summary = run.summary()
+    try:
+        write_jsonl(summary)
+        write_prometheus(run, summary)
+    except OSError as e:
+        logging.error(f'Не удалось сохранить метрики прогона {run.job}: {e}')
+    return summary
+
+
+# -------------------------------- выгрузка --------------------------------
+
+def metrics_dir():
+    # по умолчанию - logs в корне репозитория, а не в текущей папке (иначе прогон из src пишет в исходники)
+    return os.getenv('METRICS_DIR') or os.path.join(os.getenv('LOGS_PATH') or BASE_DIR / 'logs', 'metrics')
+
+
+def write_jsonl(summary):
+    path = metrics_dir()
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(summary, ensure_ascii=False) + '\n')
+
+
+def _labels(**labels):
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' '))
+                    for k, v in labels.items())
+    return '{' + body + '}'
+
+
+def render_prometheus(run, summary):
+    job = run.job
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{name} gauge')
+        for labels, value in samples:
+            lines.append(f'{PREFIX}_{name}{_labels(**labels)} {value}')
+
+    metric('last_run_timestamp_seconds', 'Время начала последнего прогона',
+           [({'job': job}, int(run.started_at.timestamp()))])
+    metric('last_run_duration_seconds', 'Длительность последнего прогона',
+           [({'job': job}, summary['duration_seconds'])])
+    metric('last_run_success', '1 если последний прогон завершился без ошибки',
+           [({'job': job}, int(summary['status'] == 'ok'))])
+    metric('span_seconds', 'Суммарное время шага за прогон',
+           [({'job': job, 'span': name}, agg['seconds']) for name, agg in summary['spans'].items()])
+    metric('span_count', 'Число выполнений шага за прогон',
+           [({'job': job, 'span': name}, agg['count']) for name, agg in summary['spans'].items()])
+
+    by_name = defaultdict(list)
+    for item in summary['counters']:
+        by_name[item['name']].append(({'job': job, **item['labels']}, item['value']))
+    for name, samples in sorted(by_name.items()):
+        metric(name, f'Счётчик {name} за последний прогон', samples)
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(run, summary):
+    path = os.getenv('METRICS_PROM_DIR') or metrics_dir()
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, f'{run.job}.prom')
+    # textfile collector может прочитать файл в момент записи - пишем во временный и подменяем
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus(run, summary))
+    os.replace(tmp, target)
+
+
+# -------------------------------- учёт HTTP / БД --------------------------------
+
+_failed_requests = {}
+
+
+@cache
+def _wb_netlocs():
+    from .my_api import WB_HOSTS
+    return {urlsplit(url).netloc: name for name, url in WB_HOSTS.items()}
+
+
+def classify_url(url):
+    '''
+    Сервис для метки: sheets (Google Sheets/Drive), wb_<сервис> для WB API, иначе хост
+    '''
+    parts = urlsplit(str(url))
+    if parts.netloc.endswith('googleapis.com') or parts.path.startswith(('/v4/spreadsheets', '/drive/v3')):
+        return 'sheets'
+    if parts.netloc in _wb_netlocs():
+        return f'wb_{_wb_netlocs()[parts.netloc]}'
+    override = os.getenv('WB_API_BASE_URL')
+    if override and urlsplit(override).netloc == parts.netloc:
+        return 'wb'
+    return parts.netloc
+
+
+def record_http(method, url, status, seconds, sent, received, body = None):
+    '''
+    Учитывает один HTTP-запрос. Повтором считается запрос, совпадающий с предыдущим неуспешным
+    '''
+    run = current_run()
+    if run is None:
+        return
+    service = classify_url(url)
+    key = (method, str(url), hash(body) if isinstance(body, (str, bytes)) else None)
+    status_label = str(status) if status in (429, 401, 403) else (f'{status // 100}xx' if status else 'error')
+    with run._lock:
+        retry = _failed_requests.pop(key, False)
+        if not status or status >= 400:
+            _failed_requests[key] = True
+    incr('http_requests', service=service, status=status_label)
+    incr('http_seconds', seconds, service=service)
+    incr('http_sent_bytes', sent, service=service)
+    incr('http_received_bytes', received, service=service)
+    if status == 429:
+        incr('http_throttled', service=service)
+    if retry:
+        incr('http_retries', service=service)
+
+
+def _patch_requests():
+    from requests.adapters import HTTPAdapter
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        sent = len(request.body or b'')
+        try:
+            response = original_send(self, request, **kwargs)
+        except Exception:
+            record_http(request.method, request.url, None, time.perf_counter() - start, sent, 0, request.body)
+            raise
+        received = int(response.headers.get('Content-Length') or 0) or len(response.content or b'')
+        record_http(request.method, request.url, response.status_code, time.perf_counter() - start, sent, received, request.body)
+        return response
+
+    HTTPAdapter.send = send
+
+
+def _patch_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        return
+    original_request = aiohttp.ClientSession._request
+
+    async def _request(self, method, str_or_url, **kwargs):
+        start = time.perf_counter()
+        body = json.dumps(kwargs['json']) if kwargs.get('json') is not None else kwargs.get('data')
+        sent = len(body) if isinstance(body, (str, bytes)) else 0
+        try:
+            response = await original_request(self, method, str_or_url, **kwargs)
+        except Exception:
+            record_http(method, str_or_url, None, time.perf_counter() - start, sent, 0, body)
+            raise
+        # тело не читаем, чтобы не менять поведение скрипта - размер берём из заголовка
+        received = int(response.headers.get('Content-Length') or 0)
+        record_http(method, str_or_url, response.status, time.perf_counter() - start, sent, received, body)
+        return response
+
+    aiohttp.ClientSession._request = _request
+
+
+def install():
+    '''
+    Включает учёт запросов requests и aiohttp (в т.ч. gspread - он ходит через requests). Повторный вызов ничего не делает
+    '''
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    _patch_requests()
+    _patch_aiohttp()
+
+
+try:
+    from psycopg2.extensions import cursor as _pg_cursor
+
+    class MeteredCursor(_pg_cursor):
+        '''
+        Курсор psycopg2 с учётом времени и строк запросов (execute_values/execute_batch идут через execute)
+        '''
+
+        def _record(self, query, start):
+            if isinstance(query, bytes):
+                query = query.decode('utf-8', 'replace')
+            op = (str(query).lstrip().split(None, 1) or ['?'])[0].lower()
+            incr('db_queries', op=op)
+            incr('db_seconds', time.perf_counter() - start, op=op)
+            if self.rowcount and self.rowcount > 0:
+                incr('db_rows', self.rowcount, op=op)
+
+        def execute(self, query, vars = None):
+            start = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                self._record(query, start)
+
+        def executemany(self, query, vars_list):
+            start = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                self._record(query, start)
+
+except ImportError:
+    MeteredCursor = None
+
+
+def track_connection(connection):
+    '''
+    Подключает к соединению psycopg2 курсор с учётом запросов, если идёт прогон с метриками
+    '''
+    if connection is not None and MeteredCursor is not None and current_run() is not None \
+            and connection.cursor_factory in (None, _pg_cursor):
+        connection.cursor_factory = MeteredCursor
+    return connection
+
+
+if __name__ == "__main__":
+
+    # при запуске через -m этот файл - __main__, а скрипт импортирует utils.metrics: состояние должно быть общим
+    from utils import metrics
+    from utils.http_record import run_script
+
+    if len(sys.argv) < 2:
+        sys.exit('usage: python -m utils.metrics main/<script>.py [args]')
+    script = sys.argv[1]
+    metrics.start_run(os.path.splitext(os.path.basename(script))[0])
+    try:
+        run_script(script, sys.argv[2:])
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            metrics.finish_run(error=f'exit code {e.code}')
+        raise
+    except BaseException as e:
+        metrics.finish_run(error=repr(e))
+        raise
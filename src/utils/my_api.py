@@ -1,11 +1,39 @@
 import os
 import json
 import time
+import asyncio
 import requests
 from requests.exceptions import RequestException
 import logging
 
 
+# -------------------------------- Base URLs --------------------------------
+
+WB_HOSTS = {
+    'statistics': 'https://statistics-api.wildberries.ru',
+    'content': 'https://content-api.wildberries.ru',
+    'advert': 'https://advert-api.wildberries.ru',
+    'analytics': 'https://seller-analytics-api.wildberries.ru',
+    'feedbacks': 'https://feedbacks-api.wildberries.ru',
+    'marketplace': 'https://marketplace-api.wildberries.ru',
+    'supplies': 'https://supplies-api.wildberries.ru',
+    'prices': 'https://discounts-prices-api.wildberries.ru',
+    'calendar': 'https://dp-calendar-api.wildberries.ru',
+    'chat': 'https://buyer-chat-api.wildberries.ru',
+    'documents': 'https://documents-api.wildberries.ru',
+    'card': 'https://card.wb.ru',
+}
+
+
+def wb_url(service, path = ''):
+    '''
+    URL метода WB API. Хост берётся из WB_<SERVICE>_URL, затем из WB_API_BASE_URL (один хост для всех сервисов,
+    например фейковый сервер utils.fake_wb_api), иначе боевой хост из WB_HOSTS.
+    '''
+    base = os.getenv(f'WB_{service.upper()}_URL') or os.getenv('WB_API_BASE_URL') or WB_HOSTS[service]
+    return base.rstrip('/') + path
+
+
 # -------------------------------- Product Cards --------------------------------
 
 
@@ -14,7 +42,7 @@ def get_all_product_cards(api_token):
     Получает все карточки товаров с учетом пагинации через API Wildberries
     """
 
-    url = 'https://content-api.wildberries.ru/content/v2/get/cards/list'
+    url = wb_url('content', '/content/v2/get/cards/list')
     headers = {'Authorization': api_token}
     
     # Initial payload
@@ -78,7 +106,7 @@ def get_product_by_nmid(api_token, nmid):
     Получает карточку товара по nmid.
     В качестве nmid можно передать и артикул, и вилд
     """
-    url = 'https://content-api.wildberries.ru/content/v2/get/cards/list'
+    url = wb_url('content', '/content/v2/get/cards/list')
     headers = {'Authorization': api_token}
     
     payload = {
@@ -195,7 +223,7 @@ def update_wb_product_card(api_token, product_card_data):
         raise ValueError("product_card_data должен быть словарем (dict) или списком (list)")
     
     # URL и заголовки для запроса
-    url = 'https://content-api.wildberries.ru/content/v2/cards/update'
+    url = wb_url('content', '/content/v2/cards/update')
     headers = {
         'Authorization': api_token,
         'Content-Type': 'application/json'
@@ -236,7 +264,7 @@ def update_wb_product_card(api_token, product_card_data):
     
 
 def get_product_cards_errors(api_token):
-    return get_json('https://content-api.wildberries.ru/content/v2/cards/error/list', headers = {'Authorization': api_token})['data']
+    return get_json(wb_url('content', '/content/v2/cards/error/list'), headers = {'Authorization': api_token})['data']
 
 
 def get_json(url, headers=None, params=None):
@@ -283,7 +311,7 @@ def get_all_trashed_cards(api_token: str, locale: str = 'ru', with_photo: int =
     Returns:
         List[Dict]: A list of all trashed cards (each card is a dict).
     """
-    url = 'https://content-api.wildberries.ru/content/v2/get/cards/trash'
+    url = wb_url('content', '/content/v2/get/cards/trash')
     headers = {'Authorization': api_token}
     params = {'locale': locale}
     
@@ -331,7 +359,7 @@ def get_docs_list(api_token, beginTime, endTime, **kwargs):
     Дату принимает в формате "2025-07-15".
     В kwargs можно передать category
     '''
-    url = 'https://documents-api.wildberries.ru/api/v1/documents/list'
+    url = wb_url('documents', '/api/v1/documents/list')
     headers = {"Authorization": api_token}
     params = {
         "beginTime": beginTime,
@@ -346,7 +374,7 @@ def get_docs_list(api_token, beginTime, endTime, **kwargs):
 # -------------------------------- Orders --------------------------------
 
 def get_orders(api_token, dateFrom, flag = 0):
-    url = 'https://statistics-api.wildberries.ru/api/v1/supplier/orders'
+    url = wb_url('statistics', '/api/v1/supplier/orders')
     headers = {"Authorization": api_token}
     params = {
         "dateFrom": dateFrom,
@@ -355,3 +383,50 @@ def get_orders(api_token, dateFrom, flag = 0):
     res = requests.get(url = url, headers = headers, params = params)
     res.raise_for_status()
     return res.json()
+
+
+
+
+# -------------------------------- Rate limits --------------------------------
+
+class AsyncRateLimiter:
+    '''
+    Лимитер для асинхронных запросов: не чаще одного запроса в interval секунд (всплеск = 1).
+    Слот резервируется без await, поэтому лимитер можно делить между задачами одного процесса
+    и переиспользовать в разных event loop.
+    '''
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_time = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        start = max(now, self._next_time)
+        self._next_time = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def penalize(self, delay: float):
+        '''Сдвигает следующий слот, например, после ответа 429'''
+        self._next_time = max(self._next_time, time.monotonic() + delay)
+
+    async def __aenter__(self):
+        await self.wait()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_RATE_LIMITERS = {}
+
+def get_rate_limiter(key, interval: float) -> AsyncRateLimiter:
+    '''
+    Возвращает общий на процесс лимитер для ключа (например, (метод, токен)).
+    Квоты WB считаются на аккаунт продавца, поэтому все вызовы одного метода с одним токеном
+    должны проходить через один лимитер.
+    '''
+    if key not in _RATE_LIMITERS:
+        _RATE_LIMITERS[key] = AsyncRateLimiter(interval)
+    return _RATE_LIMITERS[key]
@@ -1,5 +1,4 @@
 import os
-import pandas as pd
 from decimal import Decimal
 from datetime import datetime
 from psycopg2.extras import execute_batch
@@ -7,14 +6,12 @@ from psycopg2.extras import execute_values
 import logging
 
 # my packages
-# from .env_loader import *
-from .my_pandas import process_decimal
+# pandas (my_pandas) и clickhouse_driver подгружаются в функциях, которым они нужны
+from .env import load_env
+from .cache import cached
 from .my_general import process_decimal_in_dict
 from .utils import create_connection, read_sql_to_df
-from .clickhouse_utils import ClickHouseConnector
-from dotenv import load_dotenv
-
-load_dotenv()
+from .metrics import track_connection
 
 
 # -------------------------------- CONNECTION, BASIC INFO --------------------------------
@@ -24,7 +21,7 @@ def create_connection_w_env():
     '''
     Установление соединения с БД Postgres
     '''
-    # load_dotenv()
+    load_env()
     user = os.getenv('USER_2')
     name = os.getenv('NAME_2')
     password = (os.getenv('PASSWORD_2'))
@@ -32,7 +29,7 @@ def create_connection_w_env():
     port = os.getenv('PORT_2')
     # dialect = 'postgresql'
 
-    connection = create_connection(name, user, password, host, port)
+    connection = track_connection(create_connection(name, user, password, host, port))
     cur = connection.cursor()
     cur.execute("SET TIME ZONE 'Europe/Moscow';")  # ← This ensures NOW() is in Moscow time
     cur.close()
@@ -43,7 +40,8 @@ def create_clickhouse_connector():
     '''
     Установление соединения с БД Clickhouse
     '''
-    # load_dotenv()
+    from .clickhouse_utils import ClickHouseConnector
+    load_env()
     connector = ClickHouseConnector(
         host=os.getenv('CLICKHOUSE_HOST'),
         port=os.getenv('CLICKHOUSE_PORT'),
@@ -80,6 +78,7 @@ def get_df_from_db(db_query, conn=None, cursor=None, decimal_to_num = True):
             res = [read_sql_to_df(conn, query) for query in db_query]
 
         if decimal_to_num:
+            from .my_pandas import process_decimal
             res = process_decimal(res)
             
         return res
@@ -194,6 +193,7 @@ def get_and_load_commissions_data():
     return df
 
 
+@cached(ttl=6 * 3600, disk=True)
 def get_purchase_price_from_db():
     '''
     Возвращает словарь в формате {артикул : закупочная цена}.
@@ -217,6 +217,7 @@ def get_purchase_price_from_db():
     return article_price_dict
 
 
+@cached(ttl=6 * 3600, disk=True)
 def get_basic_info(columns = 'article_id,  local_vendor_code, subject_name, manager, parent_name'):
     query = f'''
     SELECT DISTINCT ON (article_id)
@@ -296,6 +297,48 @@ def insert_new_rows(db_table, df, conn=None, cursor=None):
             conn.close()
 
 
+def upsert_rows(db_table, df, conflict_cols, conn=None, cursor=None, page_size=1000):
+    """
+    Вставляет все значения df в БД, при конфликте по conflict_cols обновляет остальные колонки.
+    Откатывает изменения при ошибках.
+    """
+    own_conn = not conn
+    try:
+        if not cursor:
+            if not conn:
+                conn = create_connection_w_env()
+            cursor = conn.cursor()
+
+        if isinstance(conflict_cols, str):
+            conflict_cols = [conflict_cols]
+        update_cols = [col for col in df.columns if col not in conflict_cols]
+        updates = ', '.join(f"{col} = EXCLUDED.{col}" for col in update_cols)
+
+        data_tuples = [tuple(x) for x in df.to_numpy()]
+
+        execute_values(
+            cursor,
+            f"""INSERT INTO {db_table} ({','.join(df.columns)}) VALUES %s
+            ON CONFLICT ({','.join(conflict_cols)}) DO UPDATE SET {updates}""",
+            data_tuples,
+            page_size=page_size
+        )
+
+        conn.commit()
+        print(f'Данные успешно обновлены в таблице БД {db_table}: {len(data_tuples)} строк')
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f'Возникла ошибка при работе с БД. Новые изменения отменены, старые данные сохранены. Ошибка:\n{e}')
+        raise
+    finally:
+        if cursor:
+            cursor.close()
+        if own_conn and conn:
+            conn.close()
+
+
 def create_db_table(conn=None, cursor = None, create_query=None, triggers=None):
     """
     Создает таблицу в БД PostgreSQL с опциональными триггерами, откатывает изменения при ошибках.
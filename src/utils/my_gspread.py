@@ -4,28 +4,28 @@ import time
 import logging
 import gspread
 import requests
-import pandas as pd
 from datetime import datetime
 
 # my packages
-from . import my_pandas
+# pandas (и my_pandas) подгружаются в функциях, которым нужны датафреймы
+from .env import BASE_DIR, creds_path
 from .my_general import find_duplicates
-# from .env_loader import *
-from pathlib import Path
-from dotenv import load_dotenv
+from .cache import cached
 
-load_dotenv()
-
-BASE_DIR = Path(__file__).resolve().parents[2]
-CREDS_PATH = BASE_DIR / os.getenv("CREDS_DIR") / os.getenv("CREDS_FILE")
-
-# CREDS_PATH = os.getenv('CREDS_PATH')
+# путь к creds по умолчанию (CREDS_DIR / CREDS_FILE) берётся при подключении, а не при импорте
 
 # -------------------------------- ПОДКЛЮЧЕНИЕ К ТАБЛИЦАМ --------------------------------
 
-def init_client(creds_file_name = CREDS_PATH):
-    '''Инициализирует аккаунт для работы с Google Sheets'''
-    return gspread.service_account(filename=creds_file_name)
+def init_client(creds_file_name = None):
+    '''
+    Инициализирует аккаунт для работы с Google Sheets.
+    Если задан GSHEETS_FAKE_URL, запросы уходят на фейковый сервер utils.fake_gspread (без авторизации).
+    '''
+    fake_url = os.getenv('GSHEETS_FAKE_URL')
+    if fake_url:
+        from .fake_gspread import redirected_client
+        return redirected_client(fake_url)
+    return gspread.service_account(filename=creds_file_name or creds_path())
 
 def get_table_by_url(table_url):
     '''Получение таблицы из Google Sheets по ссылке'''
@@ -42,16 +42,16 @@ def connect_to_local_sheet(table_url = None, sheet_name = None, table = None):
     sh = table.worksheet(sheet_name)
     return sh
 
-def connect_to_remote_sheet(table_name, sheet_name, creds_file = CREDS_PATH):
+def connect_to_remote_sheet(table_name, sheet_name, creds_file = None):
     '''Подключение к таблице и листу'''    
     table = safe_open_spreadsheet(table_name, creds_file = creds_file)
     return table.worksheet(sheet_name)
 
-def safe_open_spreadsheet(title, retries=5, delay=5, creds_file = CREDS_PATH):
+def safe_open_spreadsheet(title, retries=5, delay=5, creds_file = None):
     """
     Пытается открыть таблицу с повторными попытками при APIError 503.
     """
-    gc = gspread.service_account(filename = creds_file)
+    gc = init_client(creds_file)
     for attempt in range(1, retries + 1):
         # print(f"Попытка {attempt} открыть доступ к таблице")
         try:
@@ -78,6 +78,8 @@ def get_articles_and_clients_df(wild = False):
     Возвращает df с артикулами с указанием ЛК из таблицы UNIT
     '''
 
+    import pandas as pd
+
     # в перспективе можно поставить цикл, чтобы парсил любые колонки
     try: 
         sh = connect_to_remote_sheet('UNIT 2.0 (tested)', 'MAIN (tested)')
@@ -98,6 +100,7 @@ def get_articles_and_clients_df(wild = False):
     return df
 
 
+@cached(ttl=3 * 3600, disk=True, bypass_args=('sh',))
 def get_articles_and_clients_dict(filter_articles=None, sh=None):
 
     try:
@@ -216,6 +219,7 @@ def get_purchase_price(sh = None):
     return clean_prices
 
 
+@cached(ttl=3 * 3600, disk=True)
 def get_skus_unit(unit_sh = None):
     '''
     Возвращает отсортированный и отформатированный список артикулов из UNIT
@@ -295,6 +299,7 @@ def add_data_to_range(sheet, data, sh_range, clean_range = True, headers = False
         # добавление полученных данных
         if hasattr(data, 'values'):
             # если df
+            from . import my_pandas
             data = my_pandas.process_decimal(data)
             data_to_insert = data.values.tolist()
             if headers:
@@ -332,6 +337,7 @@ def add_data_to_google_sheet(sheet, data, take_headers_from_google_sheet = True)
         sheet.clear()
 
         # добавление полученных данных
+        from . import my_pandas
         data = my_pandas.process_decimal(data)
         data_to_insert = data.values.tolist()
         sheet.update([headers], 'A1')
@@ -374,6 +380,80 @@ def clean_extra_rows(sh, inserted_data, sheet_name="Sheet", logger=None):
 
 
 
+def rows_to_runs(row_indices):
+    """
+    Схлопывает номера строк в непрерывные диапазоны: [2, 3, 4, 7, 9, 10] --> [(2, 4), (7, 7), (9, 10)]
+    """
+    runs = []
+    for idx in sorted(set(row_indices)):
+        if runs and idx == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], idx)
+        else:
+            runs.append((idx, idx))
+    return runs
+
+
+def delete_rows_batch(sh, row_indices):
+    """
+    Удаляет строки (номера с 1) одним запросом spreadsheets.batchUpdate:
+    по одному deleteDimension на каждый непрерывный диапазон, снизу вверх, чтобы индексы не смещались.
+    Возвращает список удалённых диапазонов [(start, end), ...].
+    """
+    runs = rows_to_runs(row_indices)
+    if not runs:
+        return runs
+
+    requests = [{
+        'deleteDimension': {
+            'range': {
+                'sheetId': sh.id,
+                'dimension': 'ROWS',
+                'startIndex': start - 1,
+                'endIndex': end
+            }
+        }
+    } for start, end in reversed(runs)]
+
+    sh.spreadsheet.batch_update({'requests': requests})
+    logging.info(f'{sh.title}: deleted {sum(end - start + 1 for start, end in runs)} rows in {len(runs)} ranges: {runs}')
+    return runs
+
+
+def normalize_sheet_key(value):
+    """
+    Приводит ключ из таблицы / датафрейма к строке: 123, 123.0, '123' --> '123'
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def sync_rows_by_key(sh, rows, key_col_num, valid_keys, changed_keys, header_row = 2):
+    """
+    Инкрементальная синхронизация листа по ключевой колонке (данные начинаются после header_row).
+    1. Строки, чей ключ не входит в valid_keys (вышли из окна / стали невалидны) или входит в changed_keys,
+       удаляются одним batchUpdate (delete_rows_batch).
+    2. rows (актуальные версии изменённых и новые строки) дописываются в конец одним append_rows.
+
+    Возвращает (кол-во удалённых, кол-во добавленных) строк.
+    """
+    valid_keys = {normalize_sheet_key(k) for k in valid_keys}
+    changed_keys = {normalize_sheet_key(k) for k in changed_keys}
+
+    sheet_keys = sh.col_values(key_col_num, value_render_option='UNFORMATTED_VALUE')[header_row:]
+    rows_to_delete = [
+        header_row + 1 + i for i, key in enumerate(sheet_keys)
+        if normalize_sheet_key(key) not in valid_keys or normalize_sheet_key(key) in changed_keys
+    ]
+
+    delete_rows_batch(sh, rows_to_delete)
+    if rows:
+        sh.append_rows(rows, value_input_option='RAW', table_range=f'A{header_row}')
+
+    logging.info(f'{sh.title}: incremental sync - deleted {len(rows_to_delete)}, appended {len(rows)} rows')
+    return len(rows_to_delete), len(rows)
+
+
 def delete_rows_by_index(sh, row_indices, trash_sheet=None, dont_delete = False):
     """
     Удаляет строки по индексам.
@@ -398,11 +478,9 @@ def delete_rows_by_index(sh, row_indices, trash_sheet=None, dont_delete = False)
         # Добавляем данные в конец
         trash_sheet.append_rows(deleted_rows)
 
-    # Удаляем строки (снизу вверх)
+    # Удаляем строки одним batchUpdate
     if not dont_delete:
-        for idx in sorted(row_indices, reverse=True):
-            sh.delete_rows(idx)
-            logging.info(f'Deleted row {idx}')
+        delete_rows_batch(sh, row_indices)
             
 
 def delete_rows_based_on_values(sh, values_to_delete, col_num, transform_to_str = True, trash_sheet = None):
@@ -426,6 +504,8 @@ def delete_rows_based_on_values(sh, values_to_delete, col_num, transform_to_str
 
     if transform_to_str:
         values_str = [str(value) for value in values_to_delete]
+    else:
+        values_str = values_to_delete
 
     rows_to_delete = [
         i + 1 for i, value in enumerate(col_values)
@@ -436,20 +516,12 @@ def delete_rows_based_on_values(sh, values_to_delete, col_num, transform_to_str
         logging.info(f"{sh.title}: Duplicates aren't found, no rows to delete.")
         return
 
-    # сортируем в обратном порядке, чтобы избежать смещения строк
-    rows_to_delete.sort(reverse=True)
     rows_num = len(rows_to_delete)
     logging.info(f'Found {rows_num} rows to delete')
     print(rows_to_delete)
 
     try:
-        c = 1
-        for row_num in rows_to_delete:
-            sh.delete_rows(row_num)
-            logging.info(f'Deleted row {row_num}: proccessed {c}/{rows_num} rows')
-
-            # trash_sheet.update()
-            c += 1
+        delete_rows_batch(sh, rows_to_delete)
         logging.info(f"Successfully deleted {len(rows_to_delete)} rows: {sorted(rows_to_delete, reverse=False)}")
     except Exception as e:
         logging.error(f"Error during deletion: {e}")
@@ -1,9 +1,10 @@
 import requests
-import pandas as pd
 
 # my packages
 from . import my_db_functions as db
 from .utils import load_api_tokens
+from .my_api import wb_url
+from .cache import cached
 
 def check_orders_region(sku, limit = 50):
     '''
@@ -42,7 +43,7 @@ def check_sku_price(sku, client_name):
     tokens = load_api_tokens()
     api_token = tokens[client_name]
     sku = int(sku)
-    url = 'https://discounts-prices-api.wildberries.ru/api/v2/list/goods/filter'
+    url = wb_url('prices', '/api/v2/list/goods/filter')
     params = {
             'limit': 10,
             'filterNmID': sku}
@@ -56,16 +57,17 @@ def check_sku_price(sku, client_name):
         return response
     
 
+@cached(ttl=6 * 3600, disk=True)
 def load_wild_managers(df = False):
-    managers = db.get_df_from_db('''
+    query = '''
                              SELECT DISTINCT ON (local_vendor_code)
                              local_vendor_code,
                              manager
                              FROM orders_articles_analyze
                              WHERE local_vendor_code LIKE 'wild%'
                              ORDER BY local_vendor_code, date DESC
-                             ''')
+                             '''
     if df:
-        return db.get_df_from_db(managers)
+        return db.get_df_from_db(query)
     else:
-        return db.fetch_db_data_into_dict(managers)
\ No newline at end of file
+        return db.fetch_db_data_into_dict(query)
\ No newline at end of file
@@ -0,0 +1,322 @@
+'''
+Запуск скриптов из main по реестру (main/jobs.py): блокировка от параллельных запусков, зависимости,
+таймауты, повторы с паузой и история запусков в БД (таблица job_runs).
+
+Задание в реестре:
+    'remains_report_update': {
+        'script': 'main/remains_report_update.py',
+        'depends_on': ['wb_stocks'],   # перед запуском upstream должен успешно отработать не раньше fresh_for назад
+        'timeout': 1800,               # секунды, после - процесс снимается
+        'retries': 1,                  # дополнительные попытки при ошибке / таймауте
+        'retry_delay': 60,             # пауза перед повтором, удваивается с каждой попыткой
+        'fresh_for': 6 * 3600,         # сколько успешный прогон считается актуальным для зависимых заданий
+    }
+
+Скрипт запускается отдельным процессом через utils.metrics, так что в METRICS_DIR попадают замеры каждого запуска.
+Успех определяется по коду выхода: скрипт из реестра при ошибке должен завершаться с ненулевым кодом
+(пробросить исключение после логирования или sys.exit), иначе запуск запишется как success.
+'''
+import os
+import sys
+import time
+import uuid
+import fcntl
+import signal
+import socket
+import logging
+import subprocess
+from datetime import datetime
+
+from .env import BASE_DIR
+from .my_db_functions import create_connection_w_env
+
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS_TABLE = 'job_runs'
+DEFAULTS = {'args': [], 'depends_on': [], 'timeout': 3600, 'retries': 0, 'retry_delay': 60, 'fresh_for': 24 * 3600}
+KILL_GRACE_SECONDS = 30
+
+# статусы запусков
+SUCCESS = 'success'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+LOCKED = 'skipped_locked'
+UPSTREAM_FAILED = 'upstream_failed'
+
+
+class JobError(Exception):
+    pass
+
+
+def job_config(registry, name):
+    if name not in registry:
+        raise JobError(f'Задание {name} не найдено в реестре')
+    return {**DEFAULTS, **registry[name]}
+
+
+def check_registry(registry):
+    '''
+    Проверяет, что скрипты существуют, зависимости есть в реестре и не образуют цикл
+    '''
+    for name, job in registry.items():
+        if not os.path.exists(os.path.join(SRC_DIR, job['script'])):
+            raise JobError(f"{name}: нет скрипта {job['script']}")
+        for dep in job.get('depends_on', []):
+            if dep not in registry:
+                raise JobError(f'{name}: неизвестная зависимость {dep}')
+
+    def visit(name, path):
+        if name in path:
+            raise JobError(f"Цикл зависимостей: {' -> '.join(path + [name])}")
+        for dep in registry[name].get('depends_on', []):
+            visit(dep, path + [name])
+
+    for name in registry:
+        visit(name, [])
+
+
+# -------------------------------- блокировки --------------------------------
+
+class JobLock:
+    '''
+    Файловая блокировка задания (flock): снимается ОС, даже если процесс раннера убит
+    '''
+
+    def __init__(self, name):
+        # путь не зависит от текущей папки: крон и ручной запуск из другого каталога берут один и тот же lock
+        lock_dir = os.getenv('JOB_LOCKS_DIR') or os.path.join(os.getenv('LOGS_PATH') or BASE_DIR / 'logs', 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        self.path = os.path.join(lock_dir, f'{name}.lock')
+        self._file = None
+
+    def acquire(self, wait = 0):
+        '''
+        wait - сколько секунд ждать освобождения; 0 - не ждать
+        '''
+        self._file = open(self.path, 'a+')
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file.seek(0)
+                self._file.truncate()
+                self._file.write(f'{os.getpid()} {datetime.now().isoformat(timespec="seconds")}\n')
+                self._file.flush()
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._file.close()
+                    self._file = None
+                    return False
+                time.sleep(5)
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+# -------------------------------- история --------------------------------
+
+class RunHistory:
+    '''
+    История запусков в Postgres. Если БД недоступна, задания всё равно запускаются,
+    а зависимости считаются неактуальными
+    '''
+
+    def __init__(self):
+        self.conn = None
+        try:
+            self.conn = create_connection_w_env()
+            if self.conn is not None:
+                self.conn.autocommit = True
+                self.create_table()
+        except Exception as e:
+            logging.error(f'История запусков недоступна: {e}')
+            self.conn = None
+
+    def create_table(self):
+        with self.conn.cursor() as cur:
+            cur.execute(f'''
+                CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (
+                    id bigserial PRIMARY KEY,
+                    run_id text NOT NULL,
+                    job text NOT NULL,
+                    attempt integer NOT NULL DEFAULT 1,
+                    trigger text,
+                    status text NOT NULL,
+                    exit_code integer,
+                    host text,
+                    pid integer,
+                    started_at timestamp NOT NULL,
+                    finished_at timestamp,
+                    duration_seconds numeric,
+                    error text
+                );
+                CREATE INDEX IF NOT EXISTS {RUNS_TABLE}_job_started_idx ON {RUNS_TABLE} (job, started_at DESC);
+            ''')
+
+    def start(self, run_id, job, attempt, trigger):
+        if self.conn is None:
+            return None
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f'''
+                    INSERT INTO {RUNS_TABLE} (run_id, job, attempt, trigger, status, host, pid, started_at)
+                    VALUES (%s, %s, %s, %s, 'running', %s, %s, NOW()) RETURNING id
+                ''', (run_id, job, attempt, trigger, socket.gethostname(), os.getpid()))
+                return cur.fetchone()[0]
+        except Exception as e:
+            logging.error(f'Не удалось записать запуск {job}: {e}')
+            return None
+
+    def finish(self, row_id, status, exit_code = None, error = None):
+        if self.conn is None or row_id is None:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(f'''
+                    UPDATE {RUNS_TABLE}
+                    SET status = %s, exit_code = %s, error = %s, finished_at = NOW(),
+                        duration_seconds = EXTRACT(EPOCH FROM NOW() - started_at)
+                    WHERE id = %s
+                ''', (status, exit_code, error, row_id))
+        except Exception as e:
+            logging.error(f'Не удалось обновить запуск {row_id}: {e}')
+
+    def record(self, run_id, job, trigger, status, error = None):
+        '''
+        Запуск, который не состоялся (занято, упала зависимость)
+        '''
+        self.finish(self.start(run_id, job, 0, trigger), status, error=error)
+
+    def succeeded_within(self, job, seconds):
+        '''
+        Был ли успешный запуск за последние seconds секунд (время считает БД - в той же зоне, что и finished_at)
+        '''
+        if self.conn is None:
+            return False
+        with self.conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT EXISTS (
+                    SELECT 1 FROM {RUNS_TABLE}
+                    WHERE job = %s AND status = %s AND finished_at > NOW() - make_interval(secs => %s)
+                )
+            ''', (job, SUCCESS, seconds))
+            return cur.fetchone()[0]
+
+    def recent(self, job = None, limit = 20):
+        if self.conn is None:
+            return []
+        with self.conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT job, run_id, attempt, trigger, status, exit_code, started_at, duration_seconds, error
+                FROM {RUNS_TABLE}
+                WHERE %(job)s IS NULL OR job = %(job)s
+                ORDER BY started_at DESC
+                LIMIT %(limit)s
+            ''', {'job': job, 'limit': limit})
+            return cur.fetchall()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+# -------------------------------- запуск --------------------------------
+
+def run_process(job, extra_args = None):
+    '''
+    Запускает скрипт задания и ждёт завершения. Возвращает (status, exit_code, error)
+    '''
+    cmd = [sys.executable, '-m', 'utils.metrics', job['script']] + list(job['args']) + list(extra_args or [])
+    # своя группа процессов - по таймауту снимаем скрипт вместе с его дочерними процессами
+    proc = subprocess.Popen(cmd, cwd=SRC_DIR, start_new_session=True)
+    try:
+        exit_code = proc.wait(timeout=job['timeout'])
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(timeout=KILL_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        return TIMEOUT, None, f"Превышен таймаут {job['timeout']} с"
+    if exit_code != 0:
+        return FAILED, exit_code, f'Код выхода {exit_code}'
+    return SUCCESS, 0, None
+
+
+class Orchestrator:
+
+    def __init__(self, registry, history = None):
+        self.registry = registry
+        self.history = history or RunHistory()
+        self._done = {}   # результаты заданий в рамках одного вызова раннера
+
+    def is_fresh(self, name):
+        job = job_config(self.registry, name)
+        try:
+            return self.history.succeeded_within(name, job['fresh_for'])
+        except Exception as e:
+            logging.error(f'Не удалось проверить последний запуск {name}: {e}')
+            return False
+
+    def ensure_upstream(self, name):
+        '''
+        Актуализирует зависимости задания. False - если какая-то из них не отработала
+        '''
+        for dep in job_config(self.registry, name)['depends_on']:
+            if self._done.get(dep) == SUCCESS or self.is_fresh(dep):
+                continue
+            logging.info(f'{name}: зависимость {dep} неактуальна, запускаем')
+            # если dep уже идёт (например, по своему крону) - дожидаемся его, а не запускаем второй раз
+            status = self.run(dep, trigger=f'dependency:{name}', wait_lock=True)
+            if status != SUCCESS:
+                logging.error(f'{name}: зависимость {dep} завершилась со статусом {status}')
+                return False
+        return True
+
+    def run(self, name, trigger = 'manual', extra_args = None, with_deps = True, wait_lock = False):
+        '''
+        Запуск задания с зависимостями, блокировкой и повторами. Возвращает итоговый статус
+        '''
+        if name in self._done:
+            return self._done[name]
+        job = job_config(self.registry, name)
+        run_id = uuid.uuid4().hex[:12]
+
+        lock = JobLock(name)
+        if not lock.acquire(wait=job['timeout'] if wait_lock else 0):
+            logging.warning(f'{name}: уже выполняется, запуск пропущен')
+            self.history.record(run_id, name, trigger, LOCKED)
+            return LOCKED
+
+        try:
+            if wait_lock and self.is_fresh(name):
+                # пока ждали блокировку, задание успело отработать в другом процессе
+                self._done[name] = SUCCESS
+                return SUCCESS
+
+            if with_deps and not self.ensure_upstream(name):
+                self.history.record(run_id, name, trigger, UPSTREAM_FAILED)
+                self._done[name] = UPSTREAM_FAILED
+                return UPSTREAM_FAILED
+
+            for attempt in range(1, job['retries'] + 2):
+                logging.info(f'{name}: запуск {run_id}, попытка {attempt}')
+                row_id = self.history.start(run_id, name, attempt, trigger)
+                status, exit_code, error = run_process(job, extra_args)
+                self.history.finish(row_id, status, exit_code, error)
+                if status == SUCCESS:
+                    logging.info(f'{name}: успешно')
+                    break
+                logging.error(f'{name}: попытка {attempt} - {status}: {error}')
+                if attempt <= job['retries']:
+                    time.sleep(job['retry_delay'] * 2 ** (attempt - 1))
+
+            self._done[name] = status
+            return status
+        finally:
+            lock.release()
@@ -0,0 +1,187 @@
+'''
+Локальный снапшот больших выгрузок из БД: Parquet по дням (data/snapshots/<name>/date=YYYY-MM-DD.parquet).
+
+Отчёты, которые каждый запуск читают месяцы истории, забирают из БД только дни новее отметки (watermark)
+плюс несколько последних дней (lookback - данные за них ещё пересчитываются), остальное читается с диска:
+
+    df = load_snapshot('ror_subject_daily', QUERY, date_from='2025-07-16', lookback_days=3)
+
+QUERY - SQL с {date_from} / {date_to} (подставляются как 'YYYY-MM-DD'), в результате обязательна колонка date.
+Если текст запроса меняется, снапшот пересобирается целиком. Полная перезагрузка - refresh=True
+или `python -m utils.snapshots clear <name>`; `python -m utils.snapshots list` - что лежит на диске.
+'''
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+from datetime import date, datetime, timedelta
+
+from .env import BASE_DIR
+
+
+DATE_COLUMN = 'date'
+
+
+def snapshots_dir():
+    return os.getenv('SNAPSHOT_DIR') or str(BASE_DIR / 'data' / 'snapshots')
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+class Snapshot:
+    '''
+    Каталог с партициями одного запроса и _meta.json: хеш запроса и покрытый диапазон дат
+    (дни внутри диапазона без файла - дни без данных)
+    '''
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self.path = os.path.join(snapshots_dir(), name)
+        self.query_hash = hashlib.sha1(' '.join(query.split()).encode('utf-8')).hexdigest()[:16]
+
+    # ---- meta ----
+
+    def read_meta(self):
+        try:
+            with open(os.path.join(self.path, '_meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('query_hash') != self.query_hash:
+            logging.info(f'Снапшот {self.name}: запрос изменился, пересобираем')
+            return None
+        return meta
+
+    def write_meta(self, covered_from, covered_to):
+        meta = {
+            'query_hash': self.query_hash,
+            'covered_from': covered_from.isoformat(),
+            'covered_to': covered_to.isoformat(),
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self._atomic_write(os.path.join(self.path, '_meta.json'),
+                           lambda tmp: open(tmp, 'w', encoding='utf-8').write(json.dumps(meta, ensure_ascii=False)))
+
+    # ---- партиции ----
+
+    def partition_path(self, day):
+        return os.path.join(self.path, f'{DATE_COLUMN}={day.isoformat()}.parquet')
+
+    @staticmethod
+    def _atomic_write(target, write):
+        # параллельный процесс читает либо старый файл, либо новый целиком
+        tmp = f'{target}.{os.getpid()}.tmp'
+        write(tmp)
+        os.replace(tmp, target)
+
+    def write_partitions(self, df, days):
+        '''
+        Перезаписывает партиции за days; дни без строк удаляются
+        '''
+        os.makedirs(self.path, exist_ok=True)
+        by_day = {_as_date(d): part for d, part in df.groupby(DATE_COLUMN)} if len(df) else {}
+        for day in days:
+            target = self.partition_path(day)
+            part = by_day.get(day)
+            if part is None:
+                if os.path.exists(target):
+                    os.remove(target)
+                continue
+            self._atomic_write(target, lambda tmp: part.to_parquet(tmp, index=False))
+
+    def read_partitions(self, start, end):
+        import pandas as pd
+        files = [self.partition_path(day) for day in _days(start, end) if os.path.exists(self.partition_path(day))]
+        if not files:
+            return None
+        df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN]).dt.date
+        return df
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def fetch_range(query, start, end, conn = None):
+    from .my_db_functions import get_df_from_db
+    df = get_df_from_db(query.format(date_from=f"'{start.isoformat()}'", date_to=f"'{end.isoformat()}'"), conn=conn)
+    if DATE_COLUMN not in df.columns:
+        raise ValueError(f'В результате запроса снапшота нет колонки {DATE_COLUMN}')
+    return df
+
+
+def load_snapshot(name, query, date_from, date_to = None, lookback_days = 3, refresh = False, conn = None):
+    '''
+    Данные запроса за [date_from, date_to] (по умолчанию - по сегодня): из БД забираются только
+    недостающие дни и последние lookback_days дней покрытого диапазона, остальное - из Parquet
+    '''
+    import pandas as pd
+
+    start = _as_date(date_from)
+    end = _as_date(date_to or date.today())
+    snapshot = Snapshot(name, query)
+    meta = None if refresh else snapshot.read_meta()
+    if meta is None:
+        snapshot.clear()
+
+    if meta is None:
+        ranges = [(start, end)]
+        covered_from, covered_to = start, end
+    else:
+        covered_from, covered_to = _as_date(meta['covered_from']), _as_date(meta['covered_to'])
+        ranges = []
+        # покрытие остаётся непрерывным: недостающие дни слева и справа догружаются вместе с промежутком
+        if start < covered_from:
+            ranges.append((start, covered_from - timedelta(days=1)))
+        tail_from = max(covered_from, covered_to - timedelta(days=lookback_days - 1))
+        if end >= tail_from:
+            ranges.append((tail_from, max(end, covered_to)))
+        covered_from, covered_to = min(start, covered_from), max(end, covered_to)
+
+    for range_start, range_end in ranges:
+        df = fetch_range(query, range_start, range_end, conn=conn)
+        snapshot.write_partitions(df, _days(range_start, range_end))
+        logging.info(f'Снапшот {name}: из БД {range_start} - {range_end}, {len(df)} строк')
+    snapshot.write_meta(covered_from, covered_to)
+
+    df = snapshot.read_partitions(start, end)
+    if df is None:
+        return pd.DataFrame(columns=[DATE_COLUMN])
+    return df
+
+
+if __name__ == "__main__":
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    root = snapshots_dir()
+    if command == 'clear' and len(sys.argv) > 2:
+        for name in sys.argv[2:]:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            print(f'Удалён снапшот {name}')
+    elif command == 'list':
+        for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            path = os.path.join(root, name)
+            files = [f for f in os.listdir(path) if f.endswith('.parquet')]
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in files)
+            try:
+                with open(os.path.join(path, '_meta.json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+                covered = f"{meta['covered_from']} - {meta['covered_to']}, обновлён {meta['updated_at']}"
+            except (OSError, ValueError, KeyError):
+                covered = 'без _meta.json'
+            print(f'{name:<32} {len(files):>4} дн. {size / 1024:>9.1f} KB  {covered}')
+    else:
+        sys.exit('usage: python -m utils.snapshots [list | clear <name> ...]')
@@ -1,32 +1,21 @@
 import re
 import hashlib
 import json
-from pandas import DataFrame
-from gspread import worksheet
-from datetime import timedelta, datetime
-from gspread_dataframe import set_with_dataframe
-import psycopg2
-from psycopg2 import OperationalError
-from sqlalchemy import create_engine
-from typing import List
-from gspread.exceptions import APIError
-import time
 import logging
-import requests
 import os
-from pathlib import Path
-
-# from .env_loader import *
-from dotenv import load_dotenv  
-load_dotenv()
+from datetime import timedelta, datetime
+from zoneinfo import ZoneInfo
 
+# pandas, gspread и psycopg2 импортируются внутри функций: load_api_tokens и мелкие хелперы
+# нужны почти каждому скрипту, и тянуть ради них весь стек на каждом запуске из крона незачем
+from .env import BASE_DIR, tokens_path
+from .cache import cached
 
-BASE_DIR = Path(__file__).resolve().parents[2]
-TOKENS_PATH = BASE_DIR / os.getenv("CREDS_DIR") / os.getenv("TOKENS_FILE")
 
-# Функция для загрузки API токенов из файла tokens.json
-def load_api_tokens(filename = TOKENS_PATH):
-    with open(filename, encoding= 'utf-8') as f:
+# Функция для загрузки API токенов из файла tokens.json (кеш только в памяти - токены не пишем на диск)
+@cached(ttl=600)
+def load_api_tokens(filename = None):
+    with open(filename or tokens_path(), encoding= 'utf-8') as f:
         tokens = json.load(f)
         return tokens
     
@@ -175,12 +164,7 @@ def send_df_to_google(df, sheet):
 
 
 
-
-import gspread
-from gspread_dataframe import set_with_dataframe
-import pandas as pd
-
-def update_df_in_google(df: pd.DataFrame, sheet):
+def update_df_in_google(df, sheet):
     """
     Перезаписывает данные DataFrame на указанный лист Google Таблицы.
     Также добавляет дату и время последнего обновления в первую строку последней колонки.
@@ -237,7 +221,7 @@ def update_df_in_google(df: pd.DataFrame, sheet):
             print(f"Данные сохранены в резервную копию: {backup_file}")
 
 
-def send_unique_id_to_google(df: DataFrame, sheet: worksheet):
+def send_unique_id_to_google(df, sheet):
     """
     Отправляет DataFrame на указанный лист Google Таблицы, добавляя только уникальные строки по столбцу 'parametr'.
 
@@ -282,11 +266,9 @@ def send_unique_id_to_google(df: DataFrame, sheet: worksheet):
     except Exception as e:
         print(f"An error occurred: {e}")
 
-import pytz
-# Устанавливаем московское время
-# Функция для получения временной метки "за 24 часа назад"
+# Функция для получения временной метки "за 24 часа назад" (московское время)
 def get_udf():
-    moscow_tz = pytz.timezone('Europe/Moscow')
+    moscow_tz = ZoneInfo('Europe/Moscow')
     now = datetime.now(moscow_tz)
     udf = now - timedelta(days=1)
 
@@ -295,7 +277,7 @@ def get_udf():
 
 # Функция для получения временной метки "за сегодня"
 def get_udt():
-    moscow_tz = pytz.timezone('Europe/Moscow')
+    moscow_tz = ZoneInfo('Europe/Moscow')
 
     now = datetime.now(moscow_tz)
     udt = now.replace(hour=23, minute=59, second=0, microsecond=0)
@@ -315,6 +297,7 @@ def collect_for_all(function, tokens:dict):
 
 # Подключение к базе данных
 def create_connection(db_name, db_user, db_password, db_host, db_port):
+    import psycopg2
     connection = None
     try:
         connection = psycopg2.connect(
@@ -325,7 +308,7 @@ def create_connection(db_name, db_user, db_password, db_host, db_port):
             port=db_port,
         )
         print(f"Соединение с БД PostgreSQL успешно установлено в {datetime.now().strftime('%Y-%m-%d')}")
-    except OperationalError as error:
+    except psycopg2.OperationalError as error:
         print(f"Произошла ошибка при подключении к БД PostgreSQL {error}")
     return connection
 
@@ -347,6 +330,7 @@ def execute_query(connection, query, data=None):
 
 # Функция на чтение данных из БД
 def execute_read_query(connection, query):
+    from psycopg2 import OperationalError
     cursor = connection.cursor()
     result = None
     try:
@@ -359,6 +343,8 @@ def execute_read_query(connection, query):
 
 # Функция для чтения SQL в df с headers (M)
 def read_sql_to_df(connection, query):
+    import pandas as pd
+    from psycopg2 import OperationalError
     cursor = connection.cursor()
     df = None
     try:
@@ -373,6 +359,8 @@ def read_sql_to_df(connection, query):
 
 def google_sheet_to_table(table_title: str, sheet_title: str):
     """Функция преобразует лист гугл таблицы в датфрейм"""
+    import gspread
+    import pandas as pd
     # Дает права на взаимодействие с гугл-таблицами
     gc = gspread.service_account(filename=r'C:\Users\123\Desktop\adv_test\creds.json')
     table = gc.open(f'{table_title}')
@@ -383,6 +371,7 @@ def google_sheet_to_table(table_title: str, sheet_title: str):
 # Функция для получения датафрейма из БД
 def get_db_table(db_query: str, connection):
     """Функция получает данные из Базы Данных и преобразует их в датафрейм"""
+    import pandas as pd
     execute_read_query(connection, db_query)
     # Преобразуем таблицу в датафрейм
     try:
@@ -391,159 +380,3 @@ def get_db_table(db_query: str, connection):
         return df_db
     except Exception as e:
         print(f'Ошибка получения данных из БД {e}')
-
-import re
-import hashlib
-import json
-from pandas import DataFrame
-from gspread import worksheet
-import openpyxl
-from gspread_dataframe import set_with_dataframe
-import psycopg2
-from psycopg2 import OperationalError
-from sqlalchemy import create_engine
-from typing import List
-
-
-def camel_to_snake(name):
-    """
-    Converts a camelCase string to snake_case.
-
-    Parameters:
-    - name: The camelCase string to convert.
-
-    Returns:
-    - A snake_case version of the input string.
-    """
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-
-
-def calculate_hash(record):
-    """
-    Calculates a SHA-256 hash for a given record.
-
-    Parameters:
-    - record: A dictionary representing the record.
-
-    Returns:
-    - A SHA-256 hash of the record's JSON string representation.
-    """
-    record_str = json.dumps(record, ensure_ascii=False, sort_keys=True)
-    return hashlib.sha256(record_str.encode()).hexdigest()
-
-
-def batchify(data, batch_size):
-    """
-    Splits data into batches of a specified size.
-
-    Parameters:
-    - data: The list of items to be batched.
-    - batch_size: The size of each batch.
-
-    Returns:
-    - A generator yielding batches of data.
-    """
-    for i in range(0, len(data), batch_size):
-        yield data[i:i + batch_size]
-
-
-def prepare_nms_record(record, account_id):
-    record.pop('photos', None)
-    record['account_id'] = account_id
-    record = {camel_to_snake(k): v for k, v in record.items() if k != 'photos'}
-    record['data_hash'] = calculate_hash(record)
-    # Ensure 'dimensions', 'characteristics', and 'sizes' are JSON strings
-    for key in ['dimensions', 'characteristics', 'sizes']:
-        if key in record:
-            record[key] = json.dumps(record[key], ensure_ascii=False)
-    return record
-
-
-def prepare_campaign_record(record, account_id):
-    record['account_id'] = account_id
-    record = {camel_to_snake(k): v for k, v in record.items()}
-    record['data_hash'] = calculate_hash(record)
-    record['search_pluse_state'] = record.get('search_pluse_state', None)
-    for key in ['auto_params', 'params', 'united_params']:
-        if key in record:
-            record[key] = json.dumps(record[key], ensure_ascii=False)
-        else:
-            record[key] = None
-    return record
-
-
-def prepare_account_record(record):
-    record['data_hash'] = calculate_hash(record)
-    return record
-
-
-def map_colnames(colnames):
-    col_name_mapping = {
-        'dt': 'дата',
-        'month': 'месяц',
-        'week': 'неделя',
-        'nm_id': 'артикул',
-        'item_name': 'товар',
-        'campaign_name': 'название рк',
-        'campaign_id': 'номера рк',
-        'views': 'показы',
-        'clicks': 'клики',
-        'ad_spend': 'расходы',
-        'orders': 'заказы с рекламы',
-        'items_sold': 'продажи рк, шт.',
-        'sum_price': 'продажи рк, руб.',
-        'openCardCount': 'переход в карточку',
-        'addToCartCount': 'добавить в корзину',
-        'ordersCount': 'продажи всего, шт.',
-        'ordersSumRub': 'продажи всего, руб',
-        'buyoutsCount': 'выкуплено всего, шт.',
-        'buyoutsSumRub': 'выкуплено всего, руб.',
-    }
-    return [col_name_mapping.get(cn, cn) for cn in colnames]
-def send_df_to_google(df, sheet):
-    """
-    Отправляет DataFrame на указанный лист Google Таблицы.
-
-    Параметры:
-    df (DataFrame): DataFrame, который нужно отправить.
-    sheet (gspread.models.Worksheet): Объект листа, на который будут добавлены данные.
-
-    Возвращаемое значение:
-    None
-    """
-    try:
-        # Данные, которые нужно добавить
-        df_data_to_append = [df.columns.values.tolist()] + df.values.tolist()
-        
-        # Проверка существующих данных на листе
-        existing_data = sheet.get_all_values()
-        
-        if len(existing_data) <= 1:  # Если данных нет
-            print("Добавляем заголовки и данные")
-            sheet.append_rows(df_data_to_append, value_input_option='USER_ENTERED')
-             # Получаем текущую дату и время
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-        else:
-            print("Добавляем только данные")
-            sheet.append_rows(df_data_to_append[1:], value_input_option='USER_ENTERED')
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-            
-    except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file